@@ -14,8 +14,10 @@
 FILES=${SITE}/files
 EMAIL=ebms@cancer.gov
 USERPW=$(openssl rand -base64 12)
+REFRESH_TOKEN=$(openssl rand -hex 24)
 mkdir -p ${UNVERSIONED}
 echo ${USERPW} > ${UNVERSIONED}/userpw
+echo ${REFRESH_TOKEN} > ${UNVERSIONED}/refresh_token
 echo options: > ${REPO_BASE}/drush/drush.yml
 echo "  uri: https://${SITEHOST}" >> ${REPO_BASE}/drush/drush.yml
 $SUDO chmod a+w ${SITE}
@@ -27,6 +29,7 @@
 cp -f ${SITE}/default.settings.php ${SETTINGS}
 $SUDO chmod +w ${SETTINGS}
 echo "\$settings['trusted_host_patterns'] = ['^${SITEHOST}\$'];" >> ${SETTINGS}
+echo "\$settings['ebms_refresh_token'] = '${REFRESH_TOKEN}';" >> ${SETTINGS}
 $DRUSH si -y --site-name=EBMS --account-pass=${USERPW} --db-url=${DBURL} \
        --site-mail=${EMAIL}
 $SUDO chmod -w ${SETTINGS}
@@ -3,6 +3,10 @@
 /**
  * Find EBMS Pubmed records which have been dropped by NLM, and report them.
  *
+ * If the PubMed update job has recently checked all of our articles with
+ * NLM (see the `--drops` option), we use its results instead of asking NLM
+ * about every article all over again.
+ *
  * See https://tracker.nci.nih.gov/browse/OCEEBMS-270.
  */
 
@@ -16,10 +20,13 @@ function send_report(string $recips) {
   // Fetch the information from NLM.
   ebms_debug_log('Starting Dropped PubMed Articles report', 1);
   $start = microtime(TRUE);
-  $report = AbandonedArticlesReport::report();
+  $report = AbandonedArticlesReport::report(use_drops_file: TRUE);
 
   // Assemble a rich-text message body.
   $checked = 'Checked ' . $report['checked'] . ' Active Articles';
+  if (!empty($report['as_of'])) {
+    $checked .= ' against NLM results from ' . $report['as_of'];
+  }
   $missing_count = count($report['missing']);
   $missing_s = $missing_count === 1 ? '' : 's';
   $items = [];
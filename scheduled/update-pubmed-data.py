@@ -12,266 +12,2912 @@ Processing logic.
 The actual refresh is handled by the PHP code for the site, which also
 takes care of notifying those who are registered for the report.
 
+Timings and counts for each stage of the run (requests, retries, bytes,
+latencies, and articles per second) are logged, written to a JSON report
+in the logs directory, and written in the Prometheus text format for
+the node exporter's textfile collector (see `--metrics-textfile`).
+
+For benchmarks and testing, `--eutils-url` and `--base-url` can point
+the job at the stand-in services in `scripts/eutils-stand-in.py` (see
+`scripts/benchmark-updater.py`), with `--requests-per-second` raised
+to suit.
+
 The last step in the logic refreshes any article for which our date for
 the last update and NLM's date for the most recent change are the same,
 in case NLM changed the article later on the same day when we last picked
 up the XML. Won't happen very often, but it's important not to miss those
 updates.
 
+Rather than checking the same fixed window of days every time, we ask
+NLM only for articles modified since the last fully successful run
+(recorded in a watermark file), reaching back an extra day for safety.
+Because the watermark is the date on which that run *started*, the
+window always includes the day of our most recent refresh, so the
+same-day check described above still catches changes NLM made after
+we picked up the XML. If the previous run failed or was skipped, we
+fall back on the wide window (`DAYS_TO_CHECK` days, or further back if
+the last success was even longer ago). Articles which the site rejects
+during a refresh won't turn up in a later window once the watermark
+has moved past them, so their PubMed IDs are saved and submitted again
+with the next run's stale articles (for up to `FAILED_RUNS` runs).
+
+The number of articles in each ESEARCH and EFETCH request is tuned
+while the job runs, within fixed bounds: it grows while requests come
+back well within `--batch-seconds`, and shrinks when they are slow,
+when a response is very large, or when a request looks to have failed
+because it was too big (a read timeout, or a 502 or 504 from a proxy).
+Such a batch is split in two and the halves are tried again (down to
+the smallest size allowed), rather than sending the same oversized
+request over and over. Throttling (429 or 503 responses, or anything
+with a `Retry-After` header) and other failures are simply retried.
+Use `--fixed-batches` to keep the starting sizes.
+
+With the `--upload-xml` option, the XML we have already downloaded for
+the stale articles is sent along with the refresh request, so the PHP
+code doesn't have to fetch the same records from NLM all over again.
+
+The stale articles are submitted for refresh in batches (a few at a
+time), so a busy day doesn't turn into one enormous request. A batch
+which fails is retried on its own, and only a run in which every batch
+eventually succeeded moves the watermark forward. When there's more
+than one batch, the site only sends email for the batches which fail,
+and the totals for the run are in our log.
+
+Progress is recorded in a journal as each batch of work finishes. If a
+run dies (for example, during an NLM outage), running the script again
+with `--resume` picks up where it left off, using the same search
+window and skipping the searches, fetches, and refresh batches which
+were already done. The journal is removed when a run succeeds.
+
+A large job can be split across several processes or machines (each
+with its own API key, if desired). Each `--shard K/N` run checks only
+the articles whose PubMed IDs fall in its part of the collection, and
+saves the recently changed and stale articles it finds in a results
+file in the logs directory. A final run given all N files with the
+`--merge` option combines them, submits the refresh, and saves the
+watermark. Shard runs never refresh articles or move the watermark.
+
+If the job has been broken or disabled for longer than the search
+window reaches back, `--full-resync` skips the search and fetches every
+article we have, comparing all of NLM's revision dates with ours. The
+responses are parsed in a pool of processes (`--processes`) while the
+worker threads keep downloading, and the run can be interrupted and
+continued with `--resume`. It can be combined with `--shard`.
+
+Instead of running once a day from cron, the job can run as a service
+(`--daemon`), checking every `--interval` minutes. NLM's modification
+dates are only precise to the day, so each cycle still searches from
+the day before the previous cycle through today, but only articles
+which changed since the previous cycle turn out to be stale, so the
+load is spread over the day and revisions are picked up within
+minutes. Because the window is so narrow, each cycle runs a single
+search for everything NLM modified in it and picks out our articles
+locally, instead of sending all of our PubMed IDs to NLM again (as
+long as the window holds no more than the 10,000 IDs PubMed returns
+for a search). The cycles share warm connections to NLM and an
+in-memory copy of the article dates, which is kept current with
+incremental requests to the site.
+
 See https://tracker.nci.nih.gov/browse/OCEEBMS-87
 and https://tracker.nci.nih.gov/browse/OCEEBMS-687.
 """
 
 from argparse import ArgumentParser
-from datetime import datetime
-from functools import cached_property
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import cached_property, partial
+from gzip import GzipFile
+from heapq import merge
+from json import dumps, loads
 from logging import basicConfig, getLogger
+from os import cpu_count, fsync
 from pathlib import Path
-from sys import stdin, stderr
-from time import sleep
+from sys import byteorder, stdin, stderr
+from tempfile import TemporaryFile
+from signal import SIGINT, SIGTERM, signal
+from threading import Event, Lock
+from time import monotonic, perf_counter, sleep
 from lxml import etree
-from requests import get, post
+from requests import get, post, Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import ReadTimeout
+from urllib3.exceptions import ReadTimeoutError
 
 
-class Control:
+class RateLimiter:
+    """Token bucket shared by all of the threads which talk to NLM.
 
-    ESEARCH = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-    ESEARCH_PARMS = "db=pubmed&retmax=5000&term="
-    ESEARCH_BATCH_SIZE = 1000
-    EFETCH = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-    EFETCH_PARMS = "db=pubmed&id="
-    EFETCH_BATCH_SIZE = 100
-    ROOTS = "/local/drupal/ebms", "/var/www", "/var/www/ebms"
-    IMPORT_DATES = "articles/import/dates"
-    IMPORT_REFRESH = "articles/import/refresh"
-    EBMS_CORE = "web/modules/custom/ebms_core"
-    LOG_NAME = "update-pubmed-data.log"
-    OPEN, CLOSE = b"<PubmedArticle>", b"</PubmedArticle>"
-    ARTICLE_SET = b"<PubmedArticleSet>"
-    DAYS_TO_CHECK = 15
+    NLM allows three E-utilities requests per second (ten with an API
+    key). The bucket holds a single token by default, so requests are
+    spaced out evenly instead of arriving in bursts which could trip
+    NLM's throttling.
+    """
 
-    def main(self):
-        started = datetime.now()
-        self.logger.info("-" * 40)
-        self.logger.info("job started")
-        try:
-            if self.stale_articles:
-                url = f"{self.base_url}/{self.IMPORT_REFRESH}"
-                pmids = ",".join(sorted(self.stale_articles, key=int))
-                response = post(url, data=dict(pmids=pmids))
-                self.logger.info(response.text)
-        except Exception:
-            self.logger.exception("refresh job failure")
-        elapsed = datetime.now() - started
-        self.logger.info("job finished (%s)", elapsed)
-        self.logger.info("-" * 40)
+    def __init__(self, rate, burst=1):
+        """Remember the settings.
 
-    @cached_property
-    def base_url(self):
-        """Find the address for talking to the EBMS."""
+        Required positional argument:
+            rate - number of requests allowed per second
 
-        if self.opts.base_url:
-            return self.opts.base_url
-        path = self.root / "unversioned/sitehost"
-        if path.exists():
-            host = path.read_text().strip()
-            scheme = "http" if "localhost" in host else "https"
-            return f"{scheme}://{host}"
-        raise Exception("Unable to find site host")
+        Optional keyword argument:
+            burst - number of tokens the bucket can hold
+        """
 
-    @cached_property
-    def ebms_dates(self):
-        """Dictionary of last-refresh dates indexed by Pubmed IDs."""
+        self.interval = 1 / rate
+        self.burst = burst
+        self.lock = Lock()
+        self.next = monotonic()
 
-        if self.opts.pipe_dates:
-            lines = stdin
-        else:
-            url = f"{self.base_url}/{self.IMPORT_DATES}"
-            response = get(url)
-            lines = response.text.splitlines()
-        dates = {}
-        for line in lines:
-            id, pmid, refreshed = line.strip().split("\t")
-            pmid = pmid.strip()
-            dates[pmid] = refreshed
-        self.logger.info("fetched dates for %d articles", len(dates))
-        return dates
+    def acquire(self):
+        """Wait until it's our turn to send a request."""
 
-    @cached_property
-    def logger(self):
-        """Used to record what we do."""
+        with self.lock:
+            now = monotonic()
+            earliest = now - (self.burst - 1) * self.interval
+            slot = max(self.next, earliest)
+            self.next = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
 
-        fmt = "%(asctime)s [%(levelname)s] %(message)s"
-        path = f"{self.root}/logs/{self.LOG_NAME}"
-        basicConfig(format=fmt, level="INFO", filename=path)
-        return getLogger()
 
-    @cached_property
-    def opts(self):
-      """Run-time options."""
+class RunMetrics:
+    """Timings and counters for each stage of a run.
 
-      parser = ArgumentParser()
-      parser.add_argument("--verbose", "-v", action="store_true")
-      parser.add_argument("--pipe-dates", "-p", action="store_true")
-      parser.add_argument("--root", "-r")
-      parser.add_argument("--base-url", "-b")
-      return parser.parse_args()
+    The stages are the download of our article dates (`dates`), the
+    E-utilities requests (`epost`, `esearch`, and `efetch`), the parsing
+    of the EFETCH responses (`parse`), and the refresh requests sent
+    to the EBMS (`refresh`). Because the searches and fetches overlap,
+    each stage tracks both its span (from the start of its first piece
+    of work to the end of its last) and its busy time (the sum of the
+    durations of its requests).
+    """
 
-    @cached_property
-    def root(self):
-        """Find the base directory for the site."""
+    STAGES = "dates", "epost", "esearch", "efetch", "parse", "refresh"
+    COUNTERS = (
+        "requests",
+        "retries",
+        "failures",
+        "splits",
+        "bytes",
+        "articles",
+    )
+    QUANTILES = .5, .95, .99
+    PREFIX = "ebms_pubmed_update"
 
-        if self.opts.root:
-            return Path(self.opts.root)
-        for root in self.ROOTS:
-            path = Path(root)
-            if (path / self.EBMS_CORE).exists():
-                return path
-        raise Exception("Unable to locate base directory for site")
+    def __init__(self):
+        """Start with empty statistics for every stage."""
 
-    @cached_property
-    def recently_changed_articles(self):
-        """Sequence of PubMed IDs for articles which were modified recently."""
+        self.lock = Lock()
+        self.stages = {}
+        for stage in self.STAGES:
+            self.stages[stage] = dict(
+                first=None,
+                last=None,
+                busy=0.0,
+                latencies=[],
+                **{name: 0 for name in self.COUNTERS}
+            )
 
-        pmids = sorted(self.ebms_dates, key=int)
-        offset = 0
-        recent = set()
-        if self.verbose:
-          msg = f"Checking {len(pmids)} articles to see which are changed\n"
-          stderr.write(msg)
-        while offset < len(pmids):
-            batch = pmids[offset:offset+self.ESEARCH_BATCH_SIZE]
-            offset += len(batch)
-            term = "+OR+".join([f"{pmid}[pmid]" for pmid in batch])
-            term = f'({term})+AND+"last {self.DAYS_TO_CHECK} days"[mdat]'
-            parms = f"{self.ESEARCH_PARMS}{term}"
-            tries = 10
-            snooze = .5
-            while tries > 0:
-                try:
-                    response = post(self.ESEARCH, data=parms)
-                    root = etree.fromstring(response.content)
-                    for node in root.findall("IdList/Id"):
-                        pmid = node.text
-                        if pmid:
-                            pmid = pmid.strip()
-                            if pmid:
-                                recent.add(pmid)
-                    break
-                except Exception:
-                    tries -= 0
-                    self.logger.exception("MDAT search; %d tries left", tries)
-                    if tries < 1:
-                        raise Exception("Failure searching PubMed articles")
-                    sleep(snooze)
-                    snooze *= 2
-            if offset < len(pmids):
-                sleep(.35)
-            if self.verbose:
-                percent = offset / len(pmids)
-                left = "=" * int(72 * percent)
-                right = " " * (72 - len(left))
-                stderr.write(f"\r[{left}>{right}]")
-        self.logger.info("found %d recently changed articles", len(recent))
-        return recent
+    def record(self, stage, started=None, elapsed=None, **counts):
+        """Add the results of a piece of work to a stage's statistics.
 
-    @cached_property
-    def stale_articles(self):
-        """Sequence of PubMed IDs for articles which need to be refreshed."""
+        Required positional argument:
+            stage - name of the stage (one of `STAGES`)
 
-        pmids = sorted(self.recently_changed_articles, key=int)
-        n = len(pmids)
-        offset = 0
-        stale = set()
-        if self.verbose and pmids:
-              stderr.write(f"\nChecking {n} articles to see which are stale\n")
-        while offset < n:
-            chunk = pmids[offset:offset+self.EFETCH_BATCH_SIZE]
-            offset += len(chunk)
-            response = self._fetch_articles(chunk)
-            start = response.find(self.OPEN)
-            while start > 0:
-                end = response.find(self.CLOSE, start)
-                if end < 0:
-                    break
-                end += len(self.CLOSE)
-                xml = response[start:end]
-                start = response.find(self.OPEN, end)
-                try:
-                    article = self.PubmedArticle(xml)
-                    if article.pmid in self.ebms_dates:
-                        if article.revised >= self.ebms_dates[article.pmid]:
-                            stale.add(article.pmid)
-                except Exception as e:
-                    self.logger.exception("parsing Pubmed article")
-            if offset < n:
-                sleep(.35)
-            if self.verbose:
-                percent = offset / n
-                left = "=" * int(72 * percent)
-                right = " " * (72 - len(left))
-                stderr.write(f"\r[{left}>{right}]")
-        if self.verbose:
-            if stale:
-                msg = f"\nwaiting for refresh of {len(stale)} articles\n"
-                stderr.write(msg)
-            else:
-                stderr.write("\nno articles need refreshing\n")
-        self.logger.info("identified %d stale articles", len(stale))
-        return stale
+        Optional keyword arguments:
+            started - `perf_counter()` value for the start of the work
+            elapsed - seconds the work took
+            requests - number of requests completed
+            retries - number of failed attempts which were retried
+            failures - number of requests which failed for good
+            splits - number of failed batches split and tried again
+            bytes - number of bytes transferred
+            articles - number of articles handled
+        """
 
-    @cached_property
-    def verbose(self):
-        """Should we display progress?"""
-        return self.opts.verbose
+        with self.lock:
+            values = self.stages[stage]
+            for name, count in counts.items():
+                values[name] += count
+            if elapsed is not None:
+                values["busy"] += elapsed
+                if counts.get("requests"):
+                    values["latencies"].append(elapsed)
+                if started is not None:
+                    finished = started + elapsed
+                    if values["first"] is None or started < values["first"]:
+                        values["first"] = started
+                    if values["last"] is None or finished > values["last"]:
+                        values["last"] = finished
 
-    def _fetch_articles(self, pmids):
-        """Retrieve the XML for a batch of PubMed articles from NLM.
+    def log(self, logger):
+        """Write a line for each stage which did anything to the log.
 
         Required positional argument:
-            pmids - sequence of strings for the PubMed IDs for the articles
+            logger - where to write the statistics
+        """
+
+        for stage, values in self.summary().items():
+            if not any(values[name] for name in self.COUNTERS):
+                continue
+            latency = values["latency"]
+            args = (
+                stage,
+                values["seconds"],
+                values["requests"],
+                values["retries"],
+                values["bytes"] / 1024 / 1024,
+                values["articles"],
+                values["articles_per_second"],
+            )
+            message = ("%s: %.1fs; %d requests, %d retries, %.1f MB, "
+                       "%d articles (%.1f/sec)")
+            if latency:
+                args += latency["mean"], latency["p95"], latency["max"]
+                message += "; latency mean %.2fs p95 %.2fs max %.2fs"
+            logger.info(message, *args)
+
+    def summary(self):
+        """Assemble the statistics for each stage.
+
+        Return:
+            dictionary of dictionaries of values, indexed by stage name
+        """
+
+        summary = {}
+        with self.lock:
+            for stage, values in self.stages.items():
+                seconds = 0.0
+                if values["first"] is not None:
+                    seconds = values["last"] - values["first"]
+                elif values["busy"]:
+                    seconds = values["busy"]
+                articles = values["articles"]
+                stats = dict(seconds=round(seconds, 3))
+                stats["busy_seconds"] = round(values["busy"], 3)
+                for name in self.COUNTERS:
+                    stats[name] = values[name]
+                rate = articles / seconds if seconds else 0
+                stats["articles_per_second"] = round(rate, 1)
+                stats["latency"] = self._latency(values["latencies"])
+                summary[stage] = stats
+        return summary
+
+    def save(self, path, **run):
+        """Write the JSON report for the run.
+
+        Required positional argument:
+            path - where to write the report
+
+        Optional keyword arguments:
+            values for the run as a whole (e.g., when it started)
+        """
+
+        report = dict(run, stages=self.summary())
+        temp = path.with_name(f"{path.name}.tmp")
+        temp.write_text(dumps(report, indent=2, default=str) + "\n")
+        temp.replace(path)
+
+    def save_textfile(self, path, run):
+        """Write the statistics for the Prometheus node exporter.
+
+        The file is renamed into place, so the exporter's textfile
+        collector never sees a partially written file.
+
+        Required positional arguments:
+            path - where to write the metrics (should end in `.prom`)
+            run - dictionary of help strings and numeric values for
+                  the run as a whole, indexed by metric name
+        """
+
+        lines = []
+
+        def add(name, help, samples):
+            name = f"{self.PREFIX}_{name}"
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                labels = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}{labels} {value}")
+
+        for name, (help, value) in run.items():
+            add(name, help, [({}, value)])
+        summary = self.summary()
+        names = dict(
+            seconds="Wall-clock seconds spanned by the stage.",
+            busy_seconds="Seconds spent working on the stage.",
+            requests="Requests completed by the stage.",
+            retries="Failed attempts which were retried.",
+            failures="Requests which failed for good.",
+            splits="Failed batches split in two and tried again.",
+            bytes="Bytes transferred by the stage.",
+            articles="Articles handled by the stage.",
+            articles_per_second="Articles handled per second of the span.",
+        )
+        for name, help in names.items():
+            samples = []
+            for stage, values in summary.items():
+                samples.append((dict(stage=stage), values[name]))
+            add(f"stage_{name}", help, samples)
+        samples = []
+        for stage, values in summary.items():
+            if values["latency"]:
+                for q in self.QUANTILES:
+                    key = f"p{q * 100:g}"
+                    labels = dict(stage=stage, quantile=str(q))
+                    samples.append((labels, values["latency"][key]))
+        help = "Request latency quantiles in seconds."
+        add("stage_latency_seconds", help, samples)
+        temp = path.with_name(f"{path.name}.tmp")
+        temp.write_text("\n".join(lines) + "\n")
+        temp.replace(path)
+
+    @classmethod
+    def _latency(cls, latencies):
+        """Calculate the mean, maximum, and quantiles for request times.
+
+        Required positional argument:
+            latencies - sequence of request durations in seconds
 
         Return:
-            bytes for the response from NLM's API
+            dictionary of values, or `None` if there were no requests
         """
 
-        parms = self.EFETCH_PARMS + ",".join(pmids)
-        tries = 10
-        snooze = .5
-        while tries > 0:
+        if not latencies:
+            return None
+        latencies = sorted(latencies)
+        n = len(latencies)
+        values = dict(mean=round(sum(latencies) / n, 3))
+        for q in cls.QUANTILES:
+            values[f"p{q * 100:g}"] = round(latencies[min(n-1, int(n*q))], 3)
+        values["max"] = round(latencies[-1], 3)
+        return values
+
+
+class BatchTooBig(Exception):
+    """Raised when a request looks to have failed because of its size."""
+
+
+class EutilsClient:
+    """Pooled, rate-limited connection to NLM's E-utilities services.
+
+    All of the worker threads share a single session, so batches reuse
+    open keep-alive connections instead of paying for a new TCP/TLS
+    handshake each time. Compressed responses are requested (and are
+    decompressed transparently, including for streamed responses).
+    Failed requests are retried with exponential backoff, honoring
+    any `Retry-After` header NLM sends with a 429 or 503 response, and
+    every request has connect and read timeouts so a stuck connection
+    can't hang the job.
+
+    Some failures suggest the request was too big rather than that NLM
+    is busy or down: a read timeout, a 502 or 504 from a proxy which
+    gave up waiting, or a 413 or 414 response. A request for a batch
+    which could be split can be given a smaller budget for those
+    failures, after which `BatchTooBig` is raised so the caller can
+    split the batch. Throttling and other failures always get the
+    full number of tries.
+    """
+
+    TRIES = 10
+    BACKOFF = .5
+    MAX_BACKOFF = 60
+    RETRY_STATUS = 429, 500, 502, 503, 504
+    SIZE_STATUS = 413, 414, 502, 504
+    CONNECT_TIMEOUT = 10
+    READ_TIMEOUT = 120
+
+    def __init__(self, limiter, logger, metrics, **opts):
+        """Set up the session.
+
+        Required positional arguments:
+            limiter - `RateLimiter` shared by all the requests
+            logger - for recording problems
+            metrics - `RunMetrics` object for the request statistics
+
+        Optional keyword arguments:
+            api_key - NCBI key added to every request
+            connections - maximum number of pooled connections
+            timeout - seconds to wait for data from the server
+            tries - how many times to attempt a request
+        """
+
+        self.limiter = limiter
+        self.logger = logger
+        self.api_key = opts.get("api_key")
+        read_timeout = opts.get("timeout") or self.READ_TIMEOUT
+        self.timeout = self.CONNECT_TIMEOUT, read_timeout
+        self.tries = opts.get("tries") or self.TRIES
+        connections = opts.get("connections") or 1
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+        self.session = Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.metrics = metrics
+
+    def post(self, url, parms, label, handler, tries=None, observe=None,
+             split_tries=None):
+        """Send a request to NLM, retrying as necessary.
+
+        The handler is invoked inside the retry loop, so a response
+        which can't be parsed (for example, because the connection was
+        dropped in the middle of the body) is retried as well.
+
+        Required positional arguments:
+            url - address of the E-utilities service
+            parms - string for the encoded request parameters
+            label - name of the request for logging (its lowercase
+                    version names the stage for the statistics)
+            handler - callback which turns the response into a value
+                      (raising an exception if the response is bad)
+
+        Optional keyword arguments:
+            tries - how many times to attempt this request (overriding
+                    the client's setting)
+            observe - callback which is passed the seconds and bytes
+                      for the request if it succeeds
+            split_tries - how many size-related failures to put up
+                          with before giving up so the batch can be
+                          split (by default they count against the
+                          regular tries)
+
+        Return:
+            value returned by the handler
+
+        Raise:
+            `BatchTooBig` if `split_tries` size-related failures
+            happen, or `Exception` if all the attempts fail, or if NLM
+            rejects the request in a way retrying won't fix
+        """
+
+        if self.api_key:
+            parms = f"{parms}&api_key={self.api_key}"
+        stage = label.lower()
+        snooze = self.BACKOFF
+        tries = tries or self.tries
+        while True:
+            tries -= 1
+            self.limiter.acquire()
+            started = perf_counter()
             try:
-                response = post(self.EFETCH, data=parms)
-                if self.ARTICLE_SET in response.content:
-                    return response.content
-                raise Exception("fetch response: %s", response.content)
+                opts = dict(data=parms, stream=True, timeout=self.timeout)
+                with self.session.post(url, **opts) as response:
+                    status = response.status_code
+                    if status in self.RETRY_STATUS:
+                        delay = self._retry_after(response)
+                        if delay is not None:
+                            snooze = max(snooze, delay)
+                        elif status in self.SIZE_STATUS:
+                            raise BatchTooBig(f"HTTP status {status}")
+                        raise Exception(f"HTTP status {status}")
+                    if 400 <= status < 500:
+                        if status in self.SIZE_STATUS and split_tries:
+                            split_tries = 1
+                            raise BatchTooBig(f"HTTP status {status}")
+                        tries = 0
+                        raise Exception(f"HTTP status {status}")
+                    value = handler(response)
+                    size = self._bytes_read(response)
+                elapsed = perf_counter() - started
+                opts = dict(started=started, elapsed=elapsed, bytes=size)
+                self.metrics.record(stage, requests=1, **opts)
+                if observe:
+                    observe(elapsed, size)
+                return value
             except Exception as e:
-                tries -= 1
-                self.logger.exception("fetch: %d tries left", tries)
+                if split_tries and self._too_big(e):
+                    split_tries -= 1
+                    if split_tries < 1:
+                        self.metrics.record(stage, failures=1)
+                        self.logger.warning("%s: %s (too big?)", label, e)
+                        raise BatchTooBig(f"{label} failure") from e
                 if tries < 1:
-                    raise Exception("Failure fetching PubMed articles")
+                    self.metrics.record(stage, failures=1)
+                    self.logger.exception("%s failure", label)
+                    raise Exception(f"{label} failure")
+                self.metrics.record(stage, retries=1)
+                args = label, e, tries, snooze
+                self.logger.warning("%s: %s (%d tries left; wait %ss)", *args)
                 sleep(snooze)
-                snooze *= 2
+                snooze = min(snooze * 2, self.MAX_BACKOFF)
 
+    @staticmethod
+    def _bytes_read(response):
+        """Find out how many bytes came over the wire for a response."""
 
-    class PubmedArticle:
-        """Article fetched from NLM."""
+        try:
+            return response.raw.tell()
+        except Exception:
+            return len(response.content or b"")
 
-        def __init__(self, xml):
-            """Extract the PubMed ID and the data last revised.
+    @staticmethod
+    def _too_big(error):
+        """Might the request have failed because the batch was too big?
 
-            Required positional argument:
-                xml - bytes for the serialized article record
-            """
+        Required positional argument:
+            error - exception raised for the request
+
+        Return:
+            `True` for a read timeout or a `BatchTooBig` exception
+        """
+
+        if isinstance(error, (BatchTooBig, ReadTimeout)):
+            return True
+        if isinstance(error, RequestsConnectionError) and error.args:
+            return isinstance(error.args[0], ReadTimeoutError)
+        return False
+
+    @staticmethod
+    def _retry_after(response):
+        """Find out how long the server wants us to wait (if it said)."""
+
+        value = response.headers.get("Retry-After", "").strip()
+        if value.isdigit():
+            return int(value)
+        return None
+
+
+class BatchSizer:
+    """Number of articles to put in each request of a given kind.
+
+    The size starts out at the configured value and is tuned as the
+    responses come back, staying within the configured bounds. While
+    requests finish well within the target time (and the responses
+    aren't too big), the size grows by a quarter with each full batch.
+    A response which is too slow or too big shrinks the size to what
+    would have hit the target, and a batch which fails because it was
+    too big cuts it in half.
+    The worker threads share each sizer.
+    """
+
+    GROWTH = 1.25
+
+    def __init__(self, size, minimum, maximum, seconds, max_bytes=None):
+        """Remember the settings.
+
+        Required positional arguments:
+            size - starting number of articles in a batch
+            minimum - smallest batch size to use (or to split)
+            maximum - largest batch size to use
+            seconds - target time for a request
+
+        Optional keyword argument:
+            max_bytes - largest response we want to handle
+        """
+
+        self.minimum = max(1, min(minimum, size))
+        self.maximum = max(maximum, size)
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.current = size
+
+    @property
+    def size(self):
+        """Number of articles to put in the next batch."""
+        return self.current
+
+    def failed(self, count):
+        """Halve the batch size after a request fails.
+
+        Required positional argument:
+            count - number of articles in the failed batch
+        """
+
+        with self.lock:
+            self._resize(min(self.current, count) / 2)
+
+    def splittable(self, count):
+        """Is a batch big enough to be split in two if it fails?
+
+        Required positional argument:
+            count - number of articles in the batch
+
+        Return:
+            `True` if the batch is bigger than the minimum size
+        """
+
+        return count > self.minimum
+
+    def succeeded(self, count, elapsed, size=0):
+        """Adjust the batch size to suit the way a request went.
+
+        Required positional arguments:
+            count - number of articles in the batch
+            elapsed - number of seconds the request took
+
+        Optional keyword argument:
+            size - number of bytes in the response
+        """
+
+        scale = self.GROWTH
+        if elapsed > 0:
+            scale = min(scale, self.seconds / elapsed)
+        if self.max_bytes and size:
+            scale = min(scale, self.max_bytes / size)
+        with self.lock:
+            if scale < 1:
+                self._resize(min(self.current, count * scale))
+            elif count >= self.current:
+                self._resize(self.current * scale)
+
+    def _resize(self, size):
+        """Set the batch size, keeping it within bounds (lock is held)."""
+        self.current = max(self.minimum, min(self.maximum, int(size)))
+
+
+class BatchQueue:
+    """Articles waiting to be sent to NLM, handed out in batches.
+
+    The size of each batch is decided when it's taken from the queue,
+    so it can follow the changes made by a `BatchSizer`. A batch which
+    fails can be split, and its halves go to the front of the queue.
+    Each run of articles is sliced as it's used up, rather than being
+    carved into batches up front. Unless the queue is told it can mix
+    runs, a batch never spans two of them (so, for example, a batch of
+    searches always covers a contiguous range of our IDs).
+    """
+
+    def __init__(self, articles=(), mix=False):
+        """Start the queue.
+
+        Optional keyword arguments:
+            articles - sequence of articles to start with
+            mix - if `True`, fill batches from more than one run
+                  (the batches are then lists)
+        """
+
+        self.runs = deque()
+        self.mix = mix
+        self.extend(articles)
+
+    def __bool__(self):
+        return bool(self.runs)
+
+    def __len__(self):
+        return sum(len(run) - i for run, i in self.runs)
+
+    def batches(self, size):
+        """Estimate how many more batches of the given size we'll need."""
+        return sum(-(-(len(run) - i) // size) for run, i in self.runs)
+
+    def extend(self, articles):
+        """Add a sequence of articles to the back of the queue."""
+
+        if len(articles):
+            self.runs.append((articles, 0))
+
+    def split(self, batch):
+        """Put the two halves of a failed batch at the front of the queue."""
+
+        half = len(batch) // 2
+        self.runs.appendleft((batch[half:], 0))
+        self.runs.appendleft((batch[:half], 0))
+
+    def take(self, size):
+        """Take the next batch from the queue.
+
+        Required positional argument:
+            size - most articles to put in the batch
+
+        Return:
+            slice of one of the sequences which were queued (or a list
+            of articles from the front of the queue if runs can be mixed)
+        """
+
+        batch = []
+        while self.runs and len(batch) < size:
+            articles, start = self.runs.popleft()
+            end = start + size - len(batch)
+            if end < len(articles):
+                self.runs.appendleft((articles, end))
+            if not self.mix:
+                return articles[start:end]
+            batch.extend(articles[start:end])
+        return batch
+
+
+class RefreshDates:
+    """Compact table of the dates on which we last refreshed our articles.
+
+    A dictionary of PubMed ID strings mapped to date strings costs well
+    over a hundred bytes per article. Here the PubMed IDs are stored
+    in a sorted array of unsigned integers, with a parallel array of
+    day numbers (`date.toordinal()`), so each article takes up eight
+    bytes, and lookups are binary searches.
+    """
+
+    SORT_CHUNK = 64 * 1024
+
+    def __init__(self, lines=()):
+        """Build the table from the tab-separated lines as they stream in.
+
+        Each line has the EBMS article ID, the PubMed ID, and the date
+        of the last refresh (possibly followed by the time of day). If
+        a PubMed ID appears more than once, we keep the earliest date,
+        so that the article is refreshed if any of its rows is stale.
+
+        The site sends the rows in PubMed ID order, so normally they
+        can be appended as they come. If they arrive out of order,
+        they are sorted without building a list of all of them (see
+        `_sorted()`).
+
+        Optional positional argument:
+            lines - iterable of strings for the article rows
+        """
+
+        keys = array("Q")
+        ordered = True
+        for line in lines:
+            line = line.strip()
+            if line:
+                id, pmid, refreshed = line.split("\t")
+                year = int(refreshed[:4])
+                month = int(refreshed[5:7])
+                day = int(refreshed[8:10])
+                day = date(year, month, day).toordinal()
+                key = int(pmid) << 32 | day
+                if ordered and keys and key < keys[-1]:
+                    ordered = False
+                keys.append(key)
+        self.pmids = array("I")
+        self.days = array("I")
+        self.etag = self.as_of = None
+        for key in keys if ordered else self._sorted(keys):
+            pmid = key >> 32
+            if not self.pmids or self.pmids[-1] != pmid:
+                self.pmids.append(pmid)
+                self.days.append(key & 0xFFFFFFFF)
+
+    def __contains__(self, pmid):
+        return self.get(pmid) is not None
+
+    def __iter__(self):
+        return iter(self.pmids)
+
+    def __len__(self):
+        return len(self.pmids)
+
+    def get(self, pmid):
+        """Find the day number for our last refresh of an article.
+
+        Required positional argument:
+            pmid - PubMed ID for the article (integer or string)
+
+        Return:
+            integer from `date.toordinal()`, or `None` if we don't
+            have the article
+        """
+
+        pmid = int(pmid)
+        i = bisect_left(self.pmids, pmid)
+        if i < len(self.pmids) and self.pmids[i] == pmid:
+            return self.days[i]
+        return None
+
+    def merge(self, changes):
+        """Fold changed rows into the table.
+
+        Required positional argument:
+            changes - `RefreshDates` object for the rows which changed
+                      (its dates replace ours for the same articles)
+        """
+
+        pmids, days = array("I"), array("I")
+        mine, theirs = len(self.pmids), len(changes.pmids)
+        i = j = 0
+        while i < mine or j < theirs:
+            if j >= theirs or i < mine and self.pmids[i] < changes.pmids[j]:
+                pmids.append(self.pmids[i])
+                days.append(self.days[i])
+                i += 1
+            else:
+                if i < mine and self.pmids[i] == changes.pmids[j]:
+                    i += 1
+                pmids.append(changes.pmids[j])
+                days.append(changes.days[j])
+                j += 1
+        self.pmids, self.days = pmids, days
+
+    def save(self, path):
+        """Store the table (and what we know about its freshness).
+
+        The arrays are written in binary form, with a small JSON file
+        alongside for the ETag and the as-of date the site gave us.
+        Both files are written under temporary names and then renamed.
+
+        Required positional argument:
+            path - `Path` object for the location of the binary file
+        """
+
+        meta = dict(
+            count=len(self.pmids),
+            etag=self.etag,
+            as_of=self.as_of,
+            byteorder=byteorder,
+        )
+        temp = path.with_name(f"{path.name}.tmp")
+        temp.write_bytes(self.pmids.tobytes() + self.days.tobytes())
+        temp.replace(path)
+        meta_path = self._meta_path(path)
+        temp = meta_path.with_name(f"{meta_path.name}.tmp")
+        temp.write_text(dumps(meta))
+        temp.replace(meta_path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a table saved by an earlier run.
+
+        Required positional argument:
+            path - `Path` object for the location of the binary file
+
+        Return:
+            `RefreshDates` object, or `None` if no usable copy exists
+        """
+
+        meta_path = cls._meta_path(path)
+        if not path.exists() or not meta_path.exists():
+            return None
+        meta = loads(meta_path.read_text())
+        if meta.get("byteorder") != byteorder:
+            return None
+        data = path.read_bytes()
+        size = meta["count"] * 4
+        if len(data) != size * 2:
+            return None
+        dates = cls()
+        dates.pmids.frombytes(data[:size])
+        dates.days.frombytes(data[size:])
+        dates.etag = meta.get("etag")
+        dates.as_of = meta.get("as_of")
+        return dates
+
+    @staticmethod
+    def _meta_path(path):
+        """Location of the JSON file saved with the binary table.
+
+        Required positional argument:
+            path - `Path` object for the location of the binary file
+
+        Return:
+            `Path` object for the same name with `.json` added
+        """
+
+        return path.with_name(f"{path.name}.json")
+
+    @classmethod
+    def _sorted(cls, keys):
+        """Walk through the keys in order, using little extra memory.
+
+        Sorting the whole array at once would build a list of a Python
+        integer for every key (tens of megabytes for a million rows).
+        Instead, each chunk of the array is sorted in place, and the
+        sorted chunks are merged.
+
+        Required positional argument:
+            keys - array of integers for the keys (sorted in chunks)
+
+        Return:
+            iterator of the keys in ascending order
+        """
+
+        size = cls.SORT_CHUNK
+        for i in range(0, len(keys), size):
+            keys[i:i+size] = array("Q", sorted(keys[i:i+size]))
+        view = memoryview(keys)
+        return merge(*[view[i:i+size] for i in range(0, len(keys), size)])
+
+
+class StagedArticles:
+    """PubMed XML for the articles we are going to refresh.
+
+    The worker threads add articles as they find stale ones. Each
+    article's XML goes into a temporary file, and we remember where,
+    so the compressed document uploaded with each refresh batch holds
+    only the articles in that batch.
+    """
+
+    HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<PubmedArticleSet>\n'
+    FOOTER = b"</PubmedArticleSet>\n"
+
+    def __init__(self):
+        """Start with an empty temporary file."""
+
+        self.lock = Lock()
+        self.offsets = {}
+        self.file = TemporaryFile()
+
+    @property
+    def pmids(self):
+        """PubMed IDs of the articles we have XML for."""
+        return self.offsets.keys()
+
+    def add(self, article):
+        """Save an article's XML (once).
+
+        Required positional argument:
+            article - `Control.PubmedArticle` object with serialized XML
+        """
+
+        with self.lock:
+            if article.pmid not in self.offsets:
+                self.file.seek(0, 2)
+                offset = self.file.tell()
+                self.file.write(article.xml)
+                self.offsets[article.pmid] = offset, len(article.xml)
+
+    def document(self, pmids):
+        """Assemble a compressed document for some of the articles.
+
+        Required positional argument:
+            pmids - PubMed IDs for the articles to include
+
+        Return:
+            file object positioned at the start of the compressed XML
+        """
+
+        fp = TemporaryFile()
+        with GzipFile(fileobj=fp, mode="wb") as gzip:
+            gzip.write(self.HEADER)
+            for pmid in pmids:
+                with self.lock:
+                    if pmid not in self.offsets:
+                        continue
+                    offset, length = self.offsets[pmid]
+                    self.file.seek(offset)
+                    xml = self.file.read(length)
+                gzip.write(xml)
+                gzip.write(b"\n")
+            gzip.write(self.FOOTER)
+        fp.seek(0)
+        return fp
+
+
+class RunJournal:
+    """Durable record of the work a run has finished, so it can be resumed.
+
+    Each record is a line of JSON appended to the file (and flushed to
+    disk) as soon as an ESEARCH batch, EFETCH batch, or refresh batch
+    finishes. Searches are recorded as the range of our PubMed IDs they
+    covered, because each batch is a contiguous slice of the sorted IDs.
+    A line left incomplete by a crash is ignored when the journal is
+    read back in.
+    """
+
+    def __init__(self, path, resume=False):
+        """Open the journal, reading back the earlier records if resuming.
+
+        Required positional argument:
+            path - location of the journal file
+
+        Optional keyword argument:
+            resume - if True, pick up where the journal's run left off;
+                     otherwise, start a new journal
+        """
+
+        self.path = path
+        self.started = self.filter = None
+        self.searched = []
+        self.found = set()
+        self.fetched = set()
+        self.stale = set()
+        self.missing = set()
+        self.refreshed = set()
+        self.scanned = False
+        if resume and path.exists():
+            with path.open(encoding="utf-8") as fp:
+                for line in fp:
+                    try:
+                        self._replay(loads(line))
+                    except ValueError:
+                        break
+            self.searched.sort()
+        self.resumed = self.started is not None
+        self.file = None
+
+    def covered(self, pmid):
+        """Was this article included in one of the finished searches?
+
+        Required positional argument:
+            pmid - integer for the article's PubMed ID
+
+        Return:
+            `True` if the article doesn't need to be searched again
+        """
+
+        i = bisect_left(self.searched, [pmid + 1]) - 1
+        return i >= 0 and self.searched[i][0] <= pmid <= self.searched[i][1]
+
+    def finish(self):
+        """Throw away the journal after a successful run."""
+
+        if self.file:
+            self.file.close()
+            self.file = None
+        self.path.unlink(missing_ok=True)
+
+    def record(self, **values):
+        """Append a record to the journal and make sure it's on disk.
+
+        Optional keyword arguments:
+            started - date on which the run began (in the first record)
+            filter - search term for the modification window
+            search - first and last PubMed IDs in a finished search
+            found - recently changed articles found by that search
+            fetch - PubMed IDs of the articles in a finished EFETCH
+            stale - stale articles found by that fetch
+            missing - requested articles NLM didn't return
+            scanned - `True` when all the searches and fetches are done
+            refreshed - PubMed IDs for a batch refreshed by the site
+        """
+
+        if self.file is None:
+            mode = "a" if self.resumed else "w"
+            self.file = self.path.open(mode, encoding="utf-8")
+        self._replay(values)
+        self.file.write(dumps(values, default=str) + "\n")
+        self.file.flush()
+        fsync(self.file.fileno())
+
+    def _replay(self, values):
+        """Apply a record to what we know about the run's progress.
+
+        Required positional argument:
+            values - dictionary of values for the record
+        """
+
+        if "started" in values:
+            started = values["started"]
+            if isinstance(started, str):
+                started = date.fromisoformat(started)
+            self.started = started
+            self.filter = values["filter"]
+        if "search" in values:
+            self.searched.append(list(values["search"]))
+            self.found.update(values.get("found", []))
+        if "fetch" in values:
+            self.fetched.update(values["fetch"])
+            self.stale.update(values.get("stale", []))
+            self.missing.update(values.get("missing", []))
+        if values.get("scanned"):
+            self.scanned = True
+        self.refreshed.update(values.get("refreshed", []))
+
+
+class Control:
+
+    EUTILS = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+    ESEARCH = "esearch.fcgi"
+    ESEARCH_RETMAX = 5000
+    ESEARCH_BATCH_SIZE = 1000
+    ESEARCH_BATCH_BOUNDS = 100, ESEARCH_RETMAX
+    EFETCH = "efetch.fcgi"
+    EFETCH_PARMS = "db=pubmed&id="
+    EFETCH_BATCH_SIZE = 100
+    EFETCH_BATCH_BOUNDS = 20, 2000
+    EFETCH_MAX_BYTES = 32 * 1024 * 1024
+    RESYNC_BATCH_SIZE = 500
+    RESYNC_BATCH_BOUNDS = 50, 5000
+    BATCH_SECONDS = 10
+    SPLIT_TRIES = 2
+    EPOST = "epost.fcgi"
+    EPOST_BATCH_SIZE = 10000
+    HISTORY_LIMIT = 10000
+    ROOTS = "/local/drupal/ebms", "/var/www", "/var/www/ebms"
+    IMPORT_DATES = "articles/import/dates"
+    IMPORT_REFRESH = "articles/import/refresh"
+    EBMS_CORE = "web/modules/custom/ebms_core"
+    LOG_NAME = "update-pubmed-data.log"
+    CHUNK_SIZE = 64 * 1024
+    DAYS_TO_CHECK = 15
+    OVERLAP_DAYS = 1
+    WATERMARK = "update-pubmed-data.watermark"
+    JOURNAL = "update-pubmed-data.journal"
+    REPORT = "update-pubmed-data.report.json"
+    TEXTFILE = "update-pubmed-data.prom"
+    SHARD_RESULTS = "update-pubmed-data.results.json"
+    DROPS = "update-pubmed-data.drops.json"
+    FAILED = "update-pubmed-data.failed.json"
+    FAILED_RUNS = 5
+    REFRESH_TOKEN = "unversioned/refresh_token"
+    DATES_SNAPSHOT = "update-pubmed-data.dates"
+    UPLOAD_NAME = "pubmed.xml.gz"
+    UPLOAD_TYPE = "application/gzip"
+    REFRESH_BATCH_SIZE = 500
+    REFRESH_WORKERS = 2
+    REFRESH_TRIES = 3
+    REFRESH_BACKOFF = 30
+    REFRESH_SECONDS_PER_ARTICLE = 2
+    EBMS_CONNECT_TIMEOUT = 10
+    EBMS_READ_TIMEOUT = 300
+    API_KEY = "unversioned/ncbi_api_key"
+    REQUESTS_PER_SECOND = 3
+    REQUESTS_PER_SECOND_WITH_KEY = 10
+    WORKERS = 4
+    DAEMON_INTERVAL = 15
+    CYCLE_PROPERTIES = (
+        "failed_articles",
+        "history",
+        "journal",
+        "mdat_filter",
+        "metrics",
+        "pmids",
+        "posted",
+        "recently_changed_articles",
+        "revisions",
+        "scan",
+        "staging",
+        "stale_articles",
+        "watermark",
+        "window",
+    )
+
+    def main(self):
+        if self.opts.daemon:
+            self._serve()
+        else:
+            self._run()
+
+    @cached_property
+    def api_key(self):
+        """Optional NCBI key, which lets us send requests at a faster rate."""
+
+        if self.opts.api_key:
+            return self.opts.api_key
+        path = self.root / self.API_KEY
+        if path.exists():
+            return path.read_text().strip() or None
+        return None
+
+    @cached_property
+    def base_url(self):
+        """Find the address for talking to the EBMS."""
+
+        if self.opts.base_url:
+            return self.opts.base_url
+        path = self.root / "unversioned/sitehost"
+        if path.exists():
+            host = path.read_text().strip()
+            scheme = "http" if "localhost" in host else "https"
+            return f"{scheme}://{host}"
+        raise Exception("Unable to find site host")
+
+    @cached_property
+    def client(self):
+        """Connection used for all of our requests to NLM."""
+
+        opts = dict(
+            api_key=self.api_key,
+            connections=self.opts.workers,
+            timeout=self.opts.timeout,
+        )
+        return EutilsClient(self.limiter, self.logger, self.metrics, **opts)
+
+    @cached_property
+    def ebms_dates(self):
+        """Last-refresh dates for our articles (see `RefreshDates`).
+
+        Unless the `--full-dates` option is set, we keep a copy of the
+        table from the previous run and ask the site only for what has
+        changed since then (or nothing at all, if the ETag says the
+        table hasn't changed), with the response compressed.
+        """
+
+        started = perf_counter()
+        if self.opts.pipe_dates:
+            dates = RefreshDates(stdin)
+            self.logger.info("fetched dates for %d articles", len(dates))
+            elapsed = perf_counter() - started
+            opts = dict(started=started, elapsed=elapsed, articles=len(dates))
+            self.metrics.record("dates", **opts)
+            return dates
+        path = self._state_path(self.DATES_SNAPSHOT)
+        snapshot = None
+        if not self.opts.full_dates:
+            try:
+                snapshot = RefreshDates.load(path)
+            except Exception:
+                self.logger.exception("unable to load %s", path)
+        return self._sync_dates(snapshot, started)
+
+    @cached_property
+    def efetch_sizer(self):
+        """Number of articles to fetch with each EFETCH request."""
+
+        size, bounds = self.EFETCH_BATCH_SIZE, self.EFETCH_BATCH_BOUNDS
+        return self._batch_sizer(size, bounds, self.EFETCH_MAX_BYTES)
+
+    @cached_property
+    def esearch_sizer(self):
+        """Number of our articles to check with each ESEARCH request."""
+
+        size, bounds = self.ESEARCH_BATCH_SIZE, self.ESEARCH_BATCH_BOUNDS
+        return self._batch_sizer(size, bounds)
+
+    @cached_property
+    def eutils_url(self):
+        """Base address for NLM's E-utilities (or a stand-in for testing)."""
+        return (self.opts.eutils_url or self.EUTILS).rstrip("/")
+
+    @cached_property
+    def failed_articles(self):
+        """Articles the site rejected in earlier runs.
+
+        Shard runs don't refresh anything, so they leave these to the
+        `--merge` run.
+
+        Return:
+            dictionary of the number of runs in which each article has
+            failed, indexed by PubMed ID string
+        """
+
+        path = self._state_path(self.FAILED)
+        if self.shard or not path.exists():
+            return {}
+        try:
+            return loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            self.logger.exception("unable to read %s", path)
+            return {}
+
+    @cached_property
+    def history(self):
+        """Search for recently changed articles using NLM's history server.
+
+        Instead of sending every PubMed ID we have with every batch of
+        ESEARCH requests (ORing together a thousand `[pmid]` terms at a
+        time), we EPost our IDs to the history server once, then run
+        a single search for the ones modified recently against the
+        posted sets, leaving the results on the server for EFETCH to
+        page through.
+
+        Return:
+            tuple of WebEnv, query key, and count for the search
+            results, or `None` if there are too many results to be
+            retrieved from the history server (the caller falls back
+            on the batched searches in that case)
+        """
+
+        webenv, keys = self.posted
+        sets = "+OR+".join([f"%23{key}" for key, _ in keys])
+        term = f"({sets})+AND+{self.mdat_filter}"
+        parms = dict(db="pubmed", usehistory="y", retmax=0, WebEnv=webenv)
+        root = self._eutils(self.ESEARCH, parms, "ESEARCH", term)
+        count = int(root.findtext("Count"))
+        self.metrics.record("esearch", articles=count)
+        key = root.findtext("QueryKey").strip()
+        webenv = root.findtext("WebEnv").strip()
+        args = len(keys), count
+        self.logger.info("posted %d sets; %d recently changed articles", *args)
+        if count > self.HISTORY_LIMIT:
+            args = count, self.HISTORY_LIMIT
+            message = "%d results exceeds history limit of %d"
+            self.logger.warning(message, *args)
+            return None
+        return webenv, key, count
+
+    @cached_property
+    def journal(self):
+        """Record of this run's progress (see `RunJournal`).
+
+        With the `--resume` option, we pick up the journal left behind
+        by a run which didn't finish. Otherwise any such journal is
+        replaced.
+        """
+
+        path = self._state_path(self.JOURNAL)
+        exists = path.exists()
+        journal = RunJournal(path, resume=self.opts.resume)
+        if journal.resumed:
+            args = journal.started, len(journal.searched), len(journal.fetched)
+            message = "resuming run started %s (%d searches, %d fetched)"
+            self.logger.info(message, *args)
+        elif self.opts.resume:
+            self.logger.warning("no journal to resume; starting a new run")
+        elif exists:
+            self.logger.warning("discarding journal from an unfinished run")
+        return journal
+
+    @cached_property
+    def limiter(self):
+        """Throttle for all of the requests we send to NLM."""
+
+        if self.opts.requests_per_second:
+            return RateLimiter(self.opts.requests_per_second)
+        if self.api_key:
+            return RateLimiter(self.REQUESTS_PER_SECOND_WITH_KEY)
+        return RateLimiter(self.REQUESTS_PER_SECOND)
+
+    @cached_property
+    def logger(self):
+        """Used to record what we do."""
+
+        fmt = "%(asctime)s [%(levelname)s] %(message)s"
+        path = f"{self.root}/logs/{self.LOG_NAME}"
+        basicConfig(format=fmt, level="INFO", filename=path)
+        return getLogger()
+
+    @cached_property
+    def mdat_filter(self):
+        """Search term restricting results to recently modified articles.
+
+        See the module's docstring for an explanation of how we pick
+        the window of days to check.
+        """
+
+        if self.journal.resumed:
+            self.logger.info("using the resumed run's search filter")
+            return self.journal.filter
+        if self.opts.full_resync:
+            return None
+        if self.opts.merge:
+            return self.merged["filter"]
+        today = date.today()
+        if self.opts.days:
+            days = self.opts.days
+            self.logger.info("checking the last %d days (--days)", days)
+            return f'"last {days} days"[mdat]'
+        if self.watermark is None:
+            days = self.DAYS_TO_CHECK
+            self.logger.info("no watermark; checking the last %d days", days)
+            return f'"last {days} days"[mdat]'
+        since = (today - self.watermark).days
+        if since > 1:
+            days = max(self.DAYS_TO_CHECK, since + self.OVERLAP_DAYS)
+            args = self.watermark, days
+            self.logger.info("last success %s; checking last %d days", *args)
+            return f'"last {days} days"[mdat]'
+        start = self.watermark - timedelta(days=self.OVERLAP_DAYS)
+        start, end = start.strftime("%Y/%m/%d"), today.strftime("%Y/%m/%d")
+        self.logger.info("checking modifications from %s to %s", start, end)
+        return f'("{start}"[mdat]+:+"{end}"[mdat])'
+
+    @cached_property
+    def merged(self):
+        """Combined results from the shard files named by `--merge`.
+
+        Each shard file holds the results of a `--shard K/N` run. We
+        make sure we have every shard, then take the union of their
+        recently changed and stale articles. The run is treated as
+        having started when the earliest shard started, so that the
+        watermark we save doesn't skip anything a shard might have
+        missed. Shards run with `--full-resync` have no search filter;
+        if every shard was a resync, so is the merged run (its filter
+        is `None`).
+
+        Return:
+            dictionary with `started`, `filter`, `recent`, `stale`,
+            and `shards` (the file name for each shard number)
+
+        Raise:
+            `Exception` if the files don't make up a complete set
+        """
+
+        shards = {}
+        counts = set()
+        filters = set()
+        started = []
+        recent = set()
+        stale = set()
+        for name in self.opts.merge:
+            values = loads(Path(name).read_text(encoding="utf-8"))
+            shards[values["shard"]] = name
+            counts.add(values["shards"])
+            filters.add(values["filter"])
+            started.append(date.fromisoformat(values["started"]))
+            recent.update(values["recent"])
+            stale.update(values["stale"])
+            args = values["shard"], values["shards"], len(values["stale"])
+            self.logger.info("shard %d of %d: %d stale articles", *args)
+        if len(counts) != 1:
+            raise Exception("shard files are from different partitionings")
+        missing = set(range(1, counts.pop() + 1)) - set(shards)
+        if missing:
+            missing = ", ".join(str(shard) for shard in sorted(missing))
+            raise Exception(f"missing results for shard(s) {missing}")
+        if len(filters) > 1:
+            self.logger.warning("shards used different search windows")
+        resyncs = None in filters
+        filters.discard(None)
+        if resyncs and filters:
+            self.logger.warning("only some of the shards were resyncs")
+        elif resyncs:
+            self.logger.info("merging the shards of a full resync")
+        args = len(shards), len(recent), len(stale)
+        self.logger.info("merged %d shards: %d recent, %d stale", *args)
+        return dict(
+            started=min(started),
+            filter=" OR ".join(sorted(filters)) or None,
+            recent=recent,
+            stale=stale,
+            shards=shards,
+        )
+
+    @cached_property
+    def metrics(self):
+        """Statistics for each stage of the run (see `RunMetrics`)."""
+        return RunMetrics()
+
+    @cached_property
+    def opts(self):
+      """Run-time options."""
+
+      parser = ArgumentParser()
+      parser.add_argument("--verbose", "-v", action="store_true")
+      parser.add_argument("--pipe-dates", "-p", action="store_true")
+      parser.add_argument("--root", "-r")
+      parser.add_argument("--base-url", "-b")
+      parser.add_argument("--api-key", "-k")
+      parser.add_argument("--workers", "-w", type=int, default=self.WORKERS)
+      parser.add_argument("--history", "-H", action="store_true")
+      parser.add_argument("--days", "-d", type=int)
+      parser.add_argument("--upload-xml", "-u", action="store_true")
+      parser.add_argument("--refresh-token", "-t")
+      parser.add_argument("--timeout", type=float)
+      parser.add_argument("--ebms-timeout", type=float,
+                          help="seconds to wait for data from the site")
+      parser.add_argument("--full-dates", "-f", action="store_true")
+      parser.add_argument("--refresh-batch-size", type=int,
+                          default=self.REFRESH_BATCH_SIZE)
+      parser.add_argument("--refresh-workers", type=int,
+                          default=self.REFRESH_WORKERS)
+      parser.add_argument("--resume", action="store_true")
+      parser.add_argument("--metrics-textfile", "-m")
+      parser.add_argument("--eutils-url", "-e")
+      parser.add_argument("--requests-per-second", type=float)
+      parser.add_argument("--shard", "-s", metavar="K/N")
+      parser.add_argument("--merge", nargs="+", metavar="FILE")
+      parser.add_argument("--full-resync", action="store_true")
+      parser.add_argument("--processes", type=int, default=cpu_count())
+      parser.add_argument("--daemon", "-D", action="store_true")
+      parser.add_argument("--drops", action="store_true")
+      parser.add_argument("--batch-seconds", type=float,
+                          default=self.BATCH_SECONDS,
+                          help="target time for ESEARCH/EFETCH requests")
+      parser.add_argument("--fixed-batches", action="store_true",
+                          help="don't tune the ESEARCH/EFETCH batch sizes")
+      parser.add_argument("--interval", type=float,
+                          default=self.DAEMON_INTERVAL,
+                          help="minutes between checks in daemon mode")
+      return parser.parse_args()
+
+    @cached_property
+    def refresh_token(self):
+        """Shared secret which lets the site accept XML we upload."""
+
+        if self.opts.refresh_token:
+            return self.opts.refresh_token
+        path = self.root / self.REFRESH_TOKEN
+        if path.exists():
+            return path.read_text().strip() or None
+        return None
+
+    @cached_property
+    def refreshed_revisions(self):
+        """NLM revision days for articles refreshed today (daemon mode).
+
+        The site records the day of each refresh, and NLM records the
+        day of each revision, so an article which NLM revised today
+        looks stale again as soon as we've refreshed it. The daemon
+        remembers which revision it has already refreshed today, and
+        doesn't refresh the same revision again until tomorrow (when
+        the usual same-day check applies, as described in the module's
+        docstring). Empty when we're not running as a daemon.
+        """
+
+        return {}
+
+    @cached_property
+    def revisions(self):
+        """NLM revision day for each stale article found by this run."""
+        return {}
+
+    @cached_property
+    def resync_sizer(self):
+        """Number of articles to fetch with each full-resync request.
+
+        The whole response is held in memory until a parser process
+        is ready for it, so its size is capped.
+        """
+
+        size, bounds = self.RESYNC_BATCH_SIZE, self.RESYNC_BATCH_BOUNDS
+        return self._batch_sizer(size, bounds, self.EFETCH_MAX_BYTES)
+
+    @cached_property
+    def root(self):
+        """Find the base directory for the site."""
+
+        if self.opts.root:
+            return Path(self.opts.root)
+        for root in self.ROOTS:
+            path = Path(root)
+            if (path / self.EBMS_CORE).exists():
+                return path
+        raise Exception("Unable to locate base directory for site")
+
+    @cached_property
+    def pmids(self):
+        """Sorted array of the PubMed IDs this run is responsible for."""
+
+        pmids = self.ebms_dates.pmids
+        if self.shard:
+            shard, shards = self.shard
+            pmids = array("I", [p for p in pmids if p % shards == shard - 1])
+            args = len(pmids), len(self.ebms_dates), shard, shards
+            self.logger.info("%d of %d articles in shard %d of %d", *args)
+        return pmids
+
+    @cached_property
+    def posted(self):
+        """Post our PubMed IDs to NLM's history server.
+
+        Return:
+            tuple of the WebEnv string and a sequence of query key and
+            ID array pairs (one for each set posted)
+        """
+
+        pmids = self.pmids
+        size = self.EPOST_BATCH_SIZE
+        webenv = None
+        keys = []
+        for i in range(0, len(pmids), size):
+            ids = pmids[i:i+size]
+            parms = dict(db="pubmed", id=",".join([str(p) for p in ids]))
+            if webenv:
+                parms["WebEnv"] = webenv
+            root = self._eutils(self.EPOST, parms, "EPOST")
+            webenv = root.findtext("WebEnv").strip()
+            keys.append((root.findtext("QueryKey").strip(), ids))
+        return webenv, keys
+
+    @cached_property
+    def recently_changed_articles(self):
+        """Sequence of PubMed IDs for articles which were modified recently."""
+        return self.scan[0]
+
+    @cached_property
+    def scan(self):
+        """Find the recently changed articles and which of them are stale.
+
+        The ESEARCH and EFETCH requests are run in a pool of worker
+        threads. The PubMed IDs found by each ESEARCH batch are queued
+        for EFETCH as soon as they come back, and those EFETCH batches
+        are given priority over the remaining searches, so the two
+        stages overlap instead of running one after the other. Every
+        request waits its turn with the shared rate limiter.
+
+        The number of articles in each request is tuned as the run goes
+        along (see `BatchSizer`), and a batch which looks to have failed
+        because it was too big is split in two and tried again, down to
+        the smallest size allowed, instead of sending the same request
+        over and over.
+
+        If the `--history` option is set, the search is done in a single
+        request against our IDs posted to NLM's history server, and
+        the EFETCH requests page through the results stored there.
+        A daemon cycle instead searches once for everything modified
+        in its (narrow) window and keeps the articles we have (see
+        `window`).
+
+        Each finished batch is recorded in the run's journal. When we
+        resume an unfinished run, only the IDs not covered by finished
+        searches are searched, and only the articles found but not yet
+        fetched are fetched. The history server's results don't outlive
+        the run which created them, so a resumed run always uses the
+        batched searches.
+
+        Return:
+            tuple of sets of PubMed IDs for recently changed and
+            stale articles
+        """
+
+        if self.opts.merge:
+            return self.merged["recent"], self.merged["stale"]
+        journal = self.journal
+        recent = journal.found | journal.fetched
+        stale = set(journal.stale)
+        if journal.scanned:
+            args = len(recent), len(stale)
+            message = "journal has %d recent and %d stale articles"
+            self.logger.info(message, *args)
+            return recent, stale
+        # A resync has no search filter (even when it's resumed).
+        if self.opts.full_resync or journal.resumed and not journal.filter:
+            return self._resync(recent, stale)
+        pmids = self.pmids
+        self.logger.info("search filter: %s", self.mdat_filter)
+        if self.staging:
+            self.logger.info("staging XML for stale articles")
+        searches = BatchQueue()
+        fetches = BatchQueue(mix=True)
+        pages = BatchQueue()
+        if journal.resumed:
+            pmids = array("I", [p for p in pmids if not journal.covered(p)])
+            unfetched = sorted(journal.found - journal.fetched, key=int)
+            fetches.extend(unfetched)
+            args = len(pmids), len(unfetched)
+            message = "resuming with %d articles to search and %d to fetch"
+            self.logger.info(message, *args)
+        history = window = None
+        if self.opts.daemon and not journal.resumed:
+            window = self.window
+        elif self.opts.history and not journal.resumed:
+            history = self.history
+        if window is not None:
+            recent.update(window)
+            if pmids:
+                journal.record(search=(pmids[0], pmids[-1]), found=window)
+            fetches.extend(window)
+        elif history:
+            pages.extend(range(history[2]))
+        else:
+            searches.extend(pmids)
+        # Ordered so the EFETCH batches go ahead of the searches. While
+        # there are still searches to do, we wait for a full batch of
+        # articles to fetch, so we don't waste requests on small ones.
+        def ready(kind):
+            queue, _, sizer, _ = queues[kind]
+            if kind == "fetch" and searches:
+                return len(queue) >= sizer.size
+            return bool(queue)
+
+        check_page = partial(self._check_page, history)
+        queues = dict(
+            fetch=(fetches, self._check_batch, self.efetch_sizer, "EFETCH"),
+            page=(pages, check_page, self.efetch_sizer, "EFETCH"),
+            search=(searches, self._search, self.esearch_sizer, "ESEARCH"),
+        )
+        completed = 0
+        jobs = {}
+        if self.verbose:
+            msg = f"Checking {len(pmids)} articles to see which are changed\n"
+            stderr.write(msg)
+        pool = ThreadPoolExecutor(self.opts.workers)
+        try:
+            while searches or fetches or pages or jobs:
+                while len(jobs) < self.opts.workers:
+                    kind = next((k for k in queues if ready(k)), None)
+                    if kind is None:
+                        break
+                    queue, check, sizer, _ = queues[kind]
+                    batch = queue.take(sizer.size)
+                    jobs[pool.submit(check, batch)] = kind, batch
+                done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+                for job in done:
+                    kind, batch = jobs.pop(job)
+                    queue, _, sizer, label = queues[kind]
+                    error = job.exception()
+                    if error:
+                        self._split(queue, batch, sizer, label, error)
+                        continue
+                    if kind == "search":
+                        found = sorted(job.result(), key=int)
+                        recent.update(found)
+                        search = batch[0], batch[-1]
+                        journal.record(search=search, found=found)
+                        found = [p for p in found if p not in journal.fetched]
+                        fetches.extend(found)
+                    elif kind == "page":
+                        found, stale_found = job.result()
+                        recent.update(found)
+                        stale.update(stale_found)
+                        found, stale_found = sorted(found), sorted(stale_found)
+                        journal.record(fetch=found, stale=stale_found)
+                    else:
+                        stale_found = sorted(job.result())
+                        stale.update(stale_found)
+                        journal.record(fetch=batch, stale=stale_found)
+                    completed += 1
+                    if self.verbose:
+                        total = completed + len(jobs)
+                        for queue, _, sizer, _ in queues.values():
+                            total += queue.batches(sizer.size)
+                        self._show_progress(completed / total)
+        finally:
+            pool.shutdown(cancel_futures=True)
+        journal.record(scanned=True)
+        self.logger.info("found %d recently changed articles", len(recent))
+        if self.verbose:
+            if stale:
+                msg = f"\nwaiting for refresh of {len(stale)} articles\n"
+                stderr.write(msg)
+            else:
+                stderr.write("\nno articles need refreshing\n")
+        self.logger.info("identified %d stale articles", len(stale))
+        return recent, stale
+
+    @cached_property
+    def shard(self):
+        """Which part of the collection (`--shard K/N`) we're checking.
+
+        Articles are assigned to shards by their PubMed IDs (modulo N),
+        so every run with the same N divides the collection the same
+        way, and each shard gets its fair share of the work.
+
+        Return:
+            tuple of the shard number and count, or `None`
+        """
+
+        if not self.opts.shard:
+            return None
+        try:
+            shard, shards = [int(n) for n in self.opts.shard.split("/")]
+        except Exception:
+            raise Exception(f"invalid shard {self.opts.shard!r}")
+        if shards < 1 or not 1 <= shard <= shards:
+            raise Exception(f"invalid shard {self.opts.shard!r}")
+        if self.opts.merge:
+            raise Exception("--shard and --merge can't be combined")
+        return shard, shards
+
+    @cached_property
+    def staging(self):
+        """Where we collect the XML for stale articles (if uploading it)."""
+
+        if not self.opts.upload_xml:
+            return None
+        if self.opts.merge or self.shard:
+            self.logger.warning("XML is not uploaded for sharded runs")
+            return None
+        if not self.refresh_token:
+            self.logger.warning("no refresh token; XML will not be uploaded")
+            return None
+        return StagedArticles()
+
+    @cached_property
+    def stale_articles(self):
+        """Sequence of PubMed IDs for articles which need to be refreshed."""
+        return self.scan[1]
+
+    @cached_property
+    def verbose(self):
+        """Should we display progress?"""
+        return self.opts.verbose
+
+    @cached_property
+    def watermark(self):
+        """Date on which the last fully successful run started (if known)."""
+
+        path = self.root / "logs" / self.WATERMARK
+        if path.exists():
+            try:
+                return date.fromisoformat(path.read_text().strip())
+            except Exception:
+                self.logger.exception("unable to read %s", path)
+        return None
+
+    @cached_property
+    def window(self):
+        """Find our articles which NLM modified recently, in one search.
+
+        A daemon cycle's window is only a day or two wide, so there
+        are far fewer articles modified in it than we have. Rather
+        than sending every one of our PubMed IDs with each cycle's
+        searches (or posting them all to the history server again),
+        we search for everything modified in the window and keep the
+        IDs we have. PubMed only hands back the first `HISTORY_LIMIT`
+        IDs of a search, so a window holding more than that can't be
+        checked this way.
+
+        Return:
+            sorted sequence of PubMed ID strings for our recently
+            changed articles, or `None` if the window holds too many
+            articles (the caller falls back on the batched searches
+            in that case)
+        """
+
+        parms = dict(db="pubmed", retmax=self.HISTORY_LIMIT)
+        term = self.mdat_filter
+        root = self._eutils(self.ESEARCH, parms, "ESEARCH", term)
+        count = int(root.findtext("Count"))
+        self.logger.info("%d articles modified in the search window", count)
+        if count > self.HISTORY_LIMIT:
+            args = count, self.HISTORY_LIMIT
+            message = "%d results exceeds limit of %d; searching in batches"
+            self.logger.warning(message, *args)
+            return None
+        found = set()
+        for node in root.findall("IdList/Id"):
+            pmid = (node.text or "").strip()
+            if pmid and pmid in self.ebms_dates:
+                found.add(pmid)
+        found = sorted(found, key=int)
+        self.metrics.record("esearch", articles=len(found))
+        self.logger.info("%d of our articles changed recently", len(found))
+        return found
+
+    def _batch_sizer(self, size, bounds, max_bytes=None):
+        """Create an object to tune the size of a kind of request.
+
+        With the `--fixed-batches` option the size never changes.
+
+        Required positional arguments:
+            size - starting number of articles in a batch
+            bounds - smallest and largest batch sizes allowed
+
+        Optional keyword argument:
+            max_bytes - largest response we want for a batch
+
+        Return:
+            `BatchSizer` object
+        """
+
+        minimum, maximum = (size, size) if self.opts.fixed_batches else bounds
+        seconds = self.opts.batch_seconds
+        return BatchSizer(size, minimum, maximum, seconds, max_bytes)
+
+    def _check_batch(self, pmids):
+        """Find out which articles in this batch need to be refreshed.
+
+        Required positional argument:
+            pmids - sequence of strings for the PubMed IDs for the articles
+
+        Return:
+            set of PubMed IDs for the stale articles in the batch
+        """
+
+        return self._find_stale(self._fetch_articles(pmids))
+
+    def _check_page(self, history, offsets):
+        """Fetch a page of recently changed articles from the history server.
+
+        Required positional arguments:
+            history - WebEnv, query key, and count for the search results
+            offsets - `range` of positions in the results for the page
+
+        Return:
+            tuple of sets of PubMed IDs for the articles in the page
+            and for the stale articles among them
+        """
+
+        webenv, key, count = history
+        parms = dict(
+            db="pubmed",
+            WebEnv=webenv,
+            query_key=key,
+            retstart=offsets.start,
+            retmax=len(offsets),
+        )
+        parms = "&".join([f"{name}={value}" for name, value in parms.items()])
+        opts = self._request_opts(self.efetch_sizer, len(offsets))
+        articles = self._efetch(parms, **opts)
+        return set(a.pmid for a in articles), self._find_stale(articles)
+
+    def _ebms_timeout(self, articles=0):
+        """Connect and read timeouts for a request to the EBMS site.
+
+        Unless the `--ebms-timeout` option says otherwise, we wait at
+        least `EBMS_READ_TIMEOUT` seconds for data, and longer for a
+        refresh request big enough to need it, so a stalled request
+        can't hang the job (or every later cycle of the daemon).
+
+        Optional keyword argument:
+            articles - number of articles the site will refresh
+
+        Return:
+            tuple of connect and read timeouts in seconds
+        """
+
+        seconds = articles * self.REFRESH_SECONDS_PER_ARTICLE
+        read = self.opts.ebms_timeout or max(self.EBMS_READ_TIMEOUT, seconds)
+        return self.EBMS_CONNECT_TIMEOUT, read
+
+    def _efetch(self, parms, **opts):
+        """Send an EFETCH request and parse the response as it arrives.
+
+        Required positional argument:
+            parms - string for the encoded parameters for the request
+
+        Optional keyword arguments:
+            passed on to `EutilsClient.post()`
+
+        Return:
+            sequence of `PubmedArticle` objects
+        """
+
+        keep = self._is_stale if self.staging else None
+
+        def parse(response):
+            started = perf_counter()
+            waiting = 0.0
+            size = 0
+
+            # Leave out the time spent waiting for the data to arrive.
+            def chunks():
+                nonlocal waiting, size
+                content = response.iter_content(self.CHUNK_SIZE)
+                while True:
+                    waited = perf_counter()
+                    chunk = next(content, None)
+                    waiting += perf_counter() - waited
+                    if chunk is None:
+                        return
+                    size += len(chunk)
+                    yield chunk
+
+            parser = self.PubmedArticle.parse
+            articles = parser(chunks(), self.logger, keep=keep)
+            elapsed = perf_counter() - started - waiting
+            counts = dict(bytes=size, articles=len(articles))
+            self.metrics.record("parse", elapsed=elapsed, **counts)
+            return articles
+
+        url = f"{self.eutils_url}/{self.EFETCH}"
+        articles = self.client.post(url, parms, "EFETCH", parse, **opts)
+        self.metrics.record("efetch", articles=len(articles))
+        return articles
+
+    def _eutils(self, service, parms, label, term=None, **opts):
+        """Send a request to NLM and return the parsed response.
+
+        Required positional arguments:
+            service - name of the E-utilities service (e.g., `ESEARCH`)
+            parms - dictionary of request parameters
+            label - name of the request for logging
+
+        Optional keyword arguments:
+            term - search string (already encoded), if any
+            others are passed on to `EutilsClient.post()`
+
+        Return:
+            root element of the parsed response
+        """
+
+        parms = "&".join([f"{name}={value}" for name, value in parms.items()])
+        if term:
+            parms += f"&term={term}"
+
+        def parse(response):
+            root = etree.fromstring(response.content)
+            error = root.findtext("ERROR")
+            if error:
+                raise Exception(f"{label}: {error}")
+            return root
+
+        url = f"{self.eutils_url}/{service}"
+        return self.client.post(url, parms, label, parse, **opts)
+
+    def _fetch_articles(self, pmids):
+        """Retrieve the revision dates for a batch of PubMed articles from NLM.
+
+        The response is parsed incrementally as it arrives from NLM, so
+        we never hold the whole document in memory.
+
+        Required positional argument:
+            pmids - sequence of strings for the PubMed IDs for the articles
+
+        Return:
+            sequence of `PubmedArticle` objects
+        """
+
+        opts = self._request_opts(self.efetch_sizer, len(pmids))
+        return self._efetch(self.EFETCH_PARMS + ",".join(pmids), **opts)
+
+    def _find_stale(self, articles):
+        """Pick out the articles whose NLM revision date isn't older than ours.
+
+        If we're uploading the XML for the refresh, the stale articles'
+        XML is added to the staged document.
+
+        Required positional argument:
+            articles - sequence of `PubmedArticle` objects
+
+        Return:
+            set of PubMed IDs for the articles which need to be refreshed
+        """
+
+        stale = set()
+        for article in articles:
+            if self._is_stale(article):
+                stale.add(article.pmid)
+                self.revisions[article.pmid] = article.revised
+                if self.staging and article.xml:
+                    self.staging.add(article)
+        return stale
+
+    def _is_stale(self, article):
+        """Does our copy of this article need to be refreshed?
+
+        Required positional argument:
+            article - `PubmedArticle` object with NLM's revision date
+
+        Return:
+            `True` if NLM's date is not older than our refresh date
+        """
+
+        refreshed = self.ebms_dates.get(article.pmid)
+        if refreshed is None:
+            return False
+        if self.refreshed_revisions.get(article.pmid) == article.revised:
+            return False
+        return article.revised >= refreshed
+
+    def _search(self, pmids):
+        """Find out which articles in a batch were modified recently.
+
+        Required positional argument:
+            pmids - sequence of strings for the PubMed IDs for the articles
+
+        Return:
+            set of PubMed IDs for the recently changed articles
+        """
+
+        term = "+OR+".join([f"{pmid}[pmid]" for pmid in pmids])
+        term = f"({term})+AND+{self.mdat_filter}"
+        parms = dict(db="pubmed", retmax=self.ESEARCH_RETMAX)
+        opts = self._request_opts(self.esearch_sizer, len(pmids))
+        root = self._eutils(self.ESEARCH, parms, "ESEARCH", term, **opts)
+        recent = set()
+        for node in root.findall("IdList/Id"):
+            pmid = node.text
+            if pmid:
+                pmid = pmid.strip()
+                if pmid:
+                    recent.add(pmid)
+        self.metrics.record("esearch", articles=len(recent))
+        return recent
+
+    def _refresh(self):
+        """Have the EBMS refresh the stale articles, a batch at a time.
+
+        Up to `--refresh-workers` batches are submitted at once. A batch
+        whose request fails is retried (after the others have finished
+        their round) without resubmitting the batches which succeeded.
+        Articles the site rejects with errors are counted, but are not
+        retried by this run, as the same XML would just be rejected
+        again, but they are saved so the next run can submit them
+        again (see `_save_failed()`), along with its own stale ones.
+        Batches which succeed are recorded in the journal, and articles
+        which a resumed run finds there aren't submitted again.
+
+        Raise:
+            `Exception` if any batch still fails after all its tries
+        """
+
+        retries = set(self.failed_articles) - self.stale_articles
+        if retries:
+            message = "resubmitting %d articles which failed before"
+            self.logger.info(message, len(retries))
+        candidates = self.stale_articles | retries
+        pmids = candidates - self.journal.refreshed
+        if len(pmids) < len(candidates):
+            skipped = len(candidates) - len(pmids)
+            self.logger.info("%d articles already refreshed", skipped)
+        pmids = sorted(pmids, key=int)
+        size = max(self.opts.refresh_batch_size, 1)
+        batches = [pmids[i:i+size] for i in range(0, len(pmids), size)]
+        if self.staging:
+            staged = len(self.staging.pmids)
+            message = "uploading XML for %d of %d articles"
+            self.logger.info(message, staged, len(pmids))
+        message = "refreshing %d articles in %d batches (%d at a time)"
+        workers = max(self.opts.refresh_workers, 1)
+        self.logger.info(message, len(pmids), len(batches), workers)
+        totals = dict(refreshed=0, replaced=0, unchanged=0, failed=0)
+        rejected = set()
+        pending = list(range(len(batches)))
+        started = perf_counter()
+        for tries in range(self.REFRESH_TRIES):
+            if tries:
+                message = "retrying %d failed batches in %d seconds"
+                delay = self.REFRESH_BACKOFF
+                self.logger.warning(message, len(pending), delay)
+                sleep(delay)
+            failed = []
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                jobs = {}
+                for i in pending:
+                    job = pool.submit(self._refresh_batch, batches[i],
+                                      len(batches) > 1)
+                    jobs[job] = i
+                for job in as_completed(jobs):
+                    i = jobs[job]
+                    label = f"batch {i+1}/{len(batches)}"
+                    try:
+                        counts, elapsed = job.result()
+                    except Exception as e:
+                        self.logger.error("%s failed: %s", label, e)
+                        failed.append(i)
+                        last_try = tries + 1 == self.REFRESH_TRIES
+                        outcome = "failures" if last_try else "retries"
+                        self.metrics.record("refresh", **{outcome: 1})
+                        continue
+                    self.journal.record(refreshed=batches[i])
+                    for key in totals:
+                        totals[key] += counts.get(key, 0)
+                    if counts.get("failed"):
+                        # An older site doesn't say which ones failed.
+                        failed_pmids = counts.get("failed_pmids", batches[i])
+                        rejected.update(str(pmid) for pmid in failed_pmids)
+                    message = ("%s: %d articles refreshed (%d replaced, "
+                               "%d unchanged), %d failed, in %.1f seconds")
+                    args = (
+                        label,
+                        counts.get("refreshed", 0),
+                        counts.get("replaced", 0),
+                        counts.get("unchanged", 0),
+                        counts.get("failed", 0),
+                        elapsed,
+                    )
+                    self.logger.info(message, *args)
+            pending = sorted(failed)
+            if not pending:
+                break
+        elapsed = perf_counter() - started
+        rate = totals["refreshed"] / elapsed if elapsed else 0
+        message = ("refreshed %d articles (%d replaced, %d unchanged), "
+                   "%d failed, in %.1f seconds (%.1f articles/sec)")
+        args = (
+            totals["refreshed"],
+            totals["replaced"],
+            totals["unchanged"],
+            totals["failed"],
+            elapsed,
+            rate,
+        )
+        self.logger.info(message, *args)
+        self._save_failed(rejected)
+        if pending:
+            count = sum(len(batches[i]) for i in pending)
+            message = f"{len(pending)} batches ({count} articles) failed"
+            raise Exception(message)
+
+    def _refresh_batch(self, pmids, quiet):
+        """Ask the EBMS to refresh one batch of articles.
+
+        Required positional arguments:
+            pmids - sequence of PubMed IDs for the articles in the batch
+            quiet - if True, the site only sends email if the batch fails
+
+        Return:
+            dictionary of counts reported by the site, and elapsed seconds
+
+        Raise:
+            `Exception` if the request or the refresh fails
+        """
+
+        started = perf_counter()
+        url = f"{self.base_url}/{self.IMPORT_REFRESH}"
+        data = dict(pmids=",".join(pmids), format="json")
+        if quiet:
+            data["quiet"] = "1"
+        files = None
+        size = 0
+        if self.staging:
+            data["token"] = self.refresh_token
+            xml = self.staging.document(pmids)
+            size = xml.seek(0, 2)
+            xml.seek(0)
+            files = dict(xml=(self.UPLOAD_NAME, xml, self.UPLOAD_TYPE))
+        timeout = self._ebms_timeout(len(pmids))
+        try:
+            response = post(url, data=data, files=files, timeout=timeout)
+        finally:
+            if files:
+                xml.close()
+        response.raise_for_status()
+        values = response.json()
+        self.logger.debug(values.get("message"))
+        if not values.get("success"):
+            raise Exception(values.get("message") or "refresh request failed")
+        elapsed = perf_counter() - started
+        counts = dict(
+            requests=1,
+            bytes=size + len(response.content),
+            articles=values.get("refreshed", 0),
+        )
+        self.metrics.record("refresh", started, elapsed, **counts)
+        return values, elapsed
+
+    def _request_opts(self, sizer, count):
+        """Tie a batch's request to the sizer for that kind of request.
+
+        A batch which could be split gets fewer tries for failures
+        which suggest it's too big (see `EutilsClient`), so we don't
+        keep sending a request which is too big to succeed. Other
+        failures (NLM throttling us, for example) get the full number
+        of tries.
+
+        Required positional arguments:
+            sizer - `BatchSizer` for the kind of request
+            count - number of articles in the batch
+
+        Return:
+            dictionary of keyword arguments for `EutilsClient.post()`
+        """
+
+        def observe(elapsed, size):
+            sizer.succeeded(count, elapsed, size)
+
+        tries = self.SPLIT_TRIES if sizer.splittable(count) else None
+        return dict(split_tries=tries, observe=observe)
+
+    def _resync(self, recent, stale):
+        """Compare NLM's revision date for every article with ours.
+
+        This catches up after the job has been broken or disabled for
+        longer than the search window covers. There's no search: all
+        of our articles are fetched, in larger batches than usual, by
+        the worker threads (which share the rate limiter), and the
+        responses are parsed in a pool of processes, so parsing keeps
+        up with downloading on a multi-core machine. Only a bounded
+        number of downloaded responses wait for a parser at any time.
+        The batch size is tuned as we go, and failed downloads are split
+        and tried again, as they are for the usual EFETCH requests (see
+        `scan`). Finished batches are recorded in the journal, so an
+        interrupted resync can be continued with `--resume`.
+
+        Required positional arguments:
+            recent - set of articles fetched by the run we're resuming
+            stale - set of stale articles found by that run
+
+        Return:
+            tuple of sets of PubMed IDs for the articles NLM returned
+            and the stale articles among them
+        """
+
+        journal = self.journal
+        pmids = [str(p) for p in self.pmids if str(p) not in journal.fetched]
+        sizer = self.resync_sizer
+        batches = BatchQueue(pmids, mix=True)
+        args = len(pmids), sizer.size
+        message = "full resync of %d articles (starting with %d per batch)"
+        self.logger.info(message, *args)
+        if self.verbose:
+            stderr.write(f"Fetching all {len(pmids)} articles\n")
+        url = f"{self.eutils_url}/{self.EFETCH}"
+        workers = max(self.opts.workers, 1)
+        processes = max(self.opts.processes or 1, 1)
+        downloads = {}
+        parses = {}
+        completed = 0
+        threads = ThreadPoolExecutor(workers)
+        pool = ProcessPoolExecutor(processes)
+        try:
+            while batches or downloads or parses:
+                while batches and len(downloads) < workers:
+                    if len(downloads) + len(parses) >= 2 * processes:
+                        break
+                    batch = batches.take(sizer.size)
+                    parms = self.EFETCH_PARMS + ",".join(batch)
+                    args = url, parms, "EFETCH", lambda r: r.content
+                    opts = self._request_opts(sizer, len(batch))
+                    job = threads.submit(self.client.post, *args, **opts)
+                    downloads[job] = batch
+                jobs = list(downloads) + list(parses)
+                done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+                for job in done:
+                    if job in downloads:
+                        batch = downloads.pop(job)
+                        error = job.exception()
+                        if error:
+                            args = batches, batch, sizer, "EFETCH", error
+                            self._split(*args)
+                            continue
+                        xml = job.result()
+                        refreshed = {p: self.ebms_dates.get(p) for p in batch}
+                        args = xml, refreshed, bool(self.staging)
+                        job = pool.submit(self._check_revisions, *args)
+                        parses[job] = batch
+                        continue
+                    batch = parses.pop(job)
+                    found, stale_found, staged, elapsed, size = job.result()
+                    self.metrics.record("efetch", articles=len(found))
+                    counts = dict(bytes=size, articles=len(found))
+                    self.metrics.record("parse", elapsed=elapsed, **counts)
+                    recent.update(found)
+                    stale.update(stale_found)
+                    for pmid, xml in staged:
+                        article = self.PubmedArticle(pmid)
+                        article.xml = xml
+                        self.staging.add(article)
+                    missing = sorted(set(batch) - set(found), key=int)
+                    stale_found = sorted(stale_found, key=int)
+                    args = dict(fetch=batch, stale=stale_found)
+                    journal.record(missing=missing, **args)
+                    completed += 1
+                    if self.verbose:
+                        total = completed + len(downloads) + len(parses)
+                        total += batches.batches(sizer.size)
+                        self._show_progress(completed / total)
+        finally:
+            threads.shutdown(cancel_futures=True)
+            pool.shutdown(cancel_futures=True)
+        journal.record(scanned=True)
+        self.logger.info("NLM returned %d articles", len(recent))
+        if self.verbose:
+            stderr.write(f"\n{len(stale)} articles need refreshing\n")
+        self.logger.info("identified %d stale articles", len(stale))
+        return recent, stale
+
+    def _serve(self):
+        """Keep checking for stale articles until we're told to stop.
+
+        Each cycle is a normal run, whose window runs from the day
+        before the previous cycle started through today. The cycles
+        share the pooled NLM connections and the table of article
+        dates, which is brought up to date before each cycle with an
+        incremental request to the site. Because the stale articles
+        are only those which changed since the previous cycle, the
+        refresh requests stay small. The daemon stops cleanly (between
+        cycles, or when a cycle finishes) on SIGTERM or SIGINT.
+        """
+
+        if self.opts.pipe_dates or self.opts.merge or self.shard:
+            message = "--daemon can't be used with --pipe-dates, --merge, "
+            raise Exception(message + "or --shard")
+        if self.opts.full_resync:
+            raise Exception("--daemon can't be used with --full-resync")
+        stopping = Event()
+
+        def stop(signum, frame):
+            self.logger.info("received signal %d; stopping", signum)
+            stopping.set()
+
+        signal(SIGTERM, stop)
+        signal(SIGINT, stop)
+        if self.opts.interval <= 0:
+            raise Exception("--interval must be a positive number of minutes")
+        interval = self.opts.interval * 60
+        self.logger.info("daemon started (every %s minutes)", interval / 60)
+        day = date.today()
+        while not stopping.is_set():
+            next_cycle = monotonic() + interval
+            if date.today() != day:
+                day = date.today()
+                self.refreshed_revisions.clear()
+            self._start_cycle()
+            if self._run():
+                for pmid in self.stale_articles:
+                    revised = self.revisions.get(pmid)
+                    if revised is not None:
+                        self.refreshed_revisions[pmid] = revised
+            self.opts.resume = False
+            stopping.wait(max(next_cycle - monotonic(), 0))
+        self.logger.info("daemon stopped")
+
+    def _run(self):
+        """Check for stale articles and have them refreshed (once).
+
+        Return:
+            `True` if the run did everything it should have
+        """
+
+        started = datetime.now()
+        self.logger.info("-" * 40)
+        if self.shard:
+            self.logger.info("job started (shard %d of %d)", *self.shard)
+        else:
+            self.logger.info("job started")
+        try:
+            if not self.journal.resumed:
+                term = self.mdat_filter
+                begun = started.date()
+                if self.opts.merge:
+                    begun = self.merged["started"]
+                self.journal.record(started=begun, filter=term)
+            if self.shard:
+                self._save_shard()
+            else:
+                if self.stale_articles or self.failed_articles:
+                    self._refresh()
+                self._save_watermark(self.journal.started)
+            if self.opts.drops:
+                try:
+                    self._save_drops()
+                except Exception:
+                    self.logger.exception("unable to check for drops")
+            self.journal.finish()
+            success = True
+        except Exception:
+            self.logger.exception("refresh job failure")
+            success = False
+        self.metrics.log(self.logger)
+        elapsed = datetime.now() - started
+        try:
+            self._save_report(started, elapsed, success)
+        except Exception:
+            self.logger.exception("unable to save run report")
+        self.logger.info("job finished (%s)", elapsed)
+        self.logger.info("-" * 40)
+        return success
+
+    def _start_cycle(self):
+        """Get ready for the next of the daemon's cycles.
+
+        The properties for a single run are dropped, so they're built
+        again for the new cycle. The NLM client keeps its pooled
+        connections, but its statistics now go to the new cycle's
+        metrics. The table of article dates is brought up to date
+        with an incremental request to the site.
+        """
+
+        for name in self.CYCLE_PROPERTIES:
+            self.__dict__.pop(name, None)
+        if "client" in self.__dict__:
+            self.client.metrics = self.metrics
+        if "ebms_dates" in self.__dict__:
+            try:
+                dates = self.ebms_dates
+                self.ebms_dates = self._sync_dates(dates, perf_counter())
+            except Exception:
+                self.logger.exception("unable to update article dates")
+
+    def _sync_dates(self, snapshot, started):
+        """Bring a copy of the article dates table up to date.
+
+        Required positional arguments:
+            snapshot - `RefreshDates` object from an earlier request
+                       (or `None` to fetch the entire table)
+            started - `perf_counter()` value for the statistics
+
+        Return:
+            `RefreshDates` object with the current dates
+        """
+
+        path = self._state_path(self.DATES_SNAPSHOT)
+        url = f"{self.base_url}/{self.IMPORT_DATES}"
+        headers = {"Accept-Encoding": "gzip"}
+        params = {}
+        if snapshot:
+            if snapshot.etag:
+                headers["If-None-Match"] = snapshot.etag
+            if snapshot.as_of:
+                params["since"] = snapshot.as_of
+        timeout = self._ebms_timeout()
+        opts = dict(params=params, headers=headers, timeout=timeout)
+        with get(url, stream=True, **opts) as response:
+            if response.status_code == 304:
+                count = len(snapshot)
+                self.logger.info("dates unchanged (%d articles)", count)
+                elapsed = perf_counter() - started
+                opts = dict(started=started, elapsed=elapsed, requests=1)
+                self.metrics.record("dates", **opts)
+                return snapshot
+            response.raise_for_status()
+            lines = response.iter_lines(decode_unicode=True)
+            dates = RefreshDates(lines)
+            etag = response.headers.get("ETag")
+            as_of = response.headers.get("X-Dates-As-Of")
+            size = response.raw.tell()
+        opts = dict(started=started, elapsed=perf_counter() - started)
+        self.metrics.record("dates", requests=1, bytes=size, **opts)
+        if "since" in params:
+            args = len(dates), params["since"]
+            self.logger.info("fetched %d changed dates since %s", *args)
+            snapshot.merge(dates)
+            dates = snapshot
+        dates.etag = etag
+        dates.as_of = as_of
+        try:
+            dates.save(path)
+        except Exception:
+            self.logger.exception("unable to save %s", path)
+        self.logger.info("fetched dates for %d articles", len(dates))
+        return dates
+
+    def _find_drops(self):
+        """Find out which of our articles NLM no longer has.
+
+        We only do this when it costs (next to) nothing. After a full
+        resync, the drops are the articles we asked for which weren't
+        in the EFETCH responses. If our IDs were posted to the history
+        server for the `--history` search, we ask NLM which of the IDs
+        in each posted set it can find, without sending them again.
+        In any other mode, checking would mean sending every ID to NLM
+        once more, which is no cheaper than the report's own check.
+
+        Return:
+            set of PubMed ID strings for the missing articles, or
+            `None` if they can't be found without the extra requests
+        """
+
+        if self.opts.full_resync or not self.journal.filter:
+            return set(self.journal.missing)
+        if "posted" not in self.__dict__:
+            return None
+        webenv, keys = self.posted
+
+        def check(key, ids):
+            parms = dict(db="pubmed", retmax=len(ids), WebEnv=webenv)
+            root = self._eutils(self.ESEARCH, parms, "ESEARCH", f"%23{key}")
+            found = set(int(node.text) for node in root.findall("IdList/Id"))
+            return [str(pmid) for pmid in ids if pmid not in found]
+
+        missing = set()
+        with ThreadPoolExecutor(self.opts.workers) as pool:
+            for ids in pool.map(lambda args: check(*args), keys):
+                missing.update(ids)
+        return missing
+
+    def _merge_drops(self):
+        """Combine the drops files saved by the shard runs.
+
+        Each shard's file is expected in the directory holding the
+        results file named for that shard by the `--merge` option.
+
+        Return:
+            tuple of the earliest date the shards checked NLM, the
+            number of articles checked, and the set of PubMed ID
+            strings for the missing articles
+
+        Raise:
+            `Exception` if a shard's drops file can't be found
+        """
+
+        shards = self.merged["shards"]
+        dates = []
+        checked = 0
+        missing = set()
+        for shard, name in sorted(shards.items()):
+            path = self._state_path(self.DROPS, (shard, len(shards)))
+            path = Path(name).parent / path.name
+            if not path.exists():
+                raise Exception(f"no drops file for shard {shard} ({path})")
+            values = loads(path.read_text(encoding="utf-8"))
+            dates.append(values["as_of"])
+            checked += values["checked"]
+            missing.update(values["missing"])
+        return min(dates), checked, missing
+
+    def _save_drops(self):
+        """Write the PubMed IDs NLM no longer has for the weekly report.
+
+        The report (`scheduled/find-pubmed-drops.php`) uses the file
+        instead of checking every article with NLM itself, as long as
+        the file is recent enough. A `--merge` run combines the files
+        written by the `--shard` runs (which the report doesn't read).
+        If the drops can't be found for free (see `_find_drops()`), we
+        remove any old file, so the report does its own check.
+        """
+
+        path = self._state_path(self.DROPS)
+        if self.opts.merge:
+            as_of, checked, missing = self._merge_drops()
+        else:
+            as_of, checked = date.today().isoformat(), len(self.pmids)
+            missing = self._find_drops()
+        if missing is None:
+            message = "drops are only checked with --history or --full-resync"
+            self.logger.warning(message)
+            path.unlink(missing_ok=True)
+            return
+        missing = sorted(missing, key=int)
+        values = dict(as_of=as_of, checked=checked, missing=missing)
+        temp = path.with_name(f"{path.name}.tmp")
+        temp.write_text(dumps(values) + "\n", encoding="utf-8")
+        temp.replace(path)
+        args = len(missing), checked, path
+        self.logger.info("%d of %d articles missing from NLM (%s)", *args)
+
+    def _save_failed(self, rejected):
+        """Remember the articles the site rejected, to submit them again.
+
+        An article which has been rejected in `FAILED_RUNS` runs is
+        dropped from the list (and logged), so we don't keep sending
+        XML which the site will never accept.
+
+        Required positional argument:
+            rejected - set of PubMed ID strings for the articles the
+                       site rejected in this run
+        """
+
+        failed = {}
+        dropped = []
+        for pmid in sorted(rejected, key=int):
+            runs = self.failed_articles.get(pmid, 0) + 1
+            if runs < self.FAILED_RUNS:
+                failed[pmid] = runs
+            else:
+                dropped.append(pmid)
+        if dropped:
+            args = len(dropped), self.FAILED_RUNS, ", ".join(dropped)
+            message = "giving up on %d articles rejected in %d runs: %s"
+            self.logger.warning(message, *args)
+        path = self._state_path(self.FAILED)
+        if failed:
+            temp = path.with_name(f"{path.name}.tmp")
+            temp.write_text(dumps(failed) + "\n", encoding="utf-8")
+            temp.replace(path)
+            args = len(failed), path
+            self.logger.info("%d articles to resubmit next run (%s)", *args)
+        else:
+            path.unlink(missing_ok=True)
+        self.failed_articles = failed
+
+    def _save_report(self, started, elapsed, success):
+        """Write the run's statistics to the JSON and Prometheus files.
+
+        The JSON report goes in the logs directory. The Prometheus
+        metrics go there too, unless the `--metrics-textfile` option
+        names a file in the node exporter's textfile directory.
+
+        Required positional arguments:
+            started - `datetime` object for the start of the run
+            elapsed - `timedelta` object for the length of the run
+            success - `True` if the run did everything it should have
+        """
+
+        scan = self.__dict__.get("scan")
+        recent, stale = (len(scan[0]), len(scan[1])) if scan else (0, 0)
+        report = dict(
+            started=started.isoformat(timespec="seconds"),
+            elapsed_seconds=round(elapsed.total_seconds(), 3),
+            success=success,
+            resumed="journal" in self.__dict__ and self.journal.resumed,
+            search_filter=self.__dict__.get("mdat_filter"),
+            recent_articles=recent,
+            stale_articles=stale,
+        )
+        if self.shard:
+            report["shard"] = "%d/%d" % self.shard
+        batch_sizes = {}
+        for name in "esearch", "efetch", "resync":
+            sizer = self.__dict__.get(f"{name}_sizer")
+            if sizer:
+                batch_sizes[name] = sizer.size
+        report["batch_sizes"] = batch_sizes
+        self.metrics.save(self._state_path(self.REPORT), **report)
+        path = self.opts.metrics_textfile
+        path = Path(path) if path else self._state_path(self.TEXTFILE)
+        values = dict(
+            last_run_timestamp_seconds=(
+                "When the last run started.",
+                int(started.timestamp()),
+            ),
+            last_run_duration_seconds=(
+                "How long the last run took.",
+                report["elapsed_seconds"],
+            ),
+            last_run_success=(
+                "Whether the last run succeeded (1) or failed (0).",
+                int(success),
+            ),
+            recent_articles=(
+                "Articles NLM modified in the last run's window.",
+                recent,
+            ),
+            stale_articles=(
+                "Articles the last run found needing a refresh.",
+                stale,
+            ),
+        )
+        self.metrics.save_textfile(path, values)
+
+    def _save_shard(self):
+        """Write this shard's results for the coordinator to merge.
+
+        The file holds everything the coordinating run (`--merge`)
+        needs to refresh the articles and advance the watermark. It's
+        written to a temporary file which is then renamed, so the
+        coordinator never sees a partial file.
+        """
+
+        shard, shards = self.shard
+        values = dict(
+            shard=shard,
+            shards=shards,
+            started=self.journal.started.isoformat(),
+            filter=self.mdat_filter,
+            recent=sorted(self.recently_changed_articles, key=int),
+            stale=sorted(self.stale_articles, key=int),
+        )
+        path = self._state_path(self.SHARD_RESULTS)
+        temp = path.with_name(f"{path.name}.tmp")
+        temp.write_text(dumps(values) + "\n", encoding="utf-8")
+        temp.replace(path)
+        args = len(values["stale"]), path
+        self.logger.info("saved %d stale articles to %s", *args)
+
+    def _save_watermark(self, started):
+        """Remember when the run which just succeeded began.
+
+        The value is written to a temporary file which is then renamed,
+        so a crash can't leave behind a truncated watermark.
+
+        Required positional argument:
+            started - date on which this run began
+        """
+
+        path = self.root / "logs" / self.WATERMARK
+        temp = path.with_name(f"{path.name}.tmp")
+        temp.write_text(f"{started.isoformat()}\n")
+        temp.replace(path)
+        self.logger.info("watermark set to %s", started)
+
+    def _split(self, queue, batch, sizer, label, error):
+        """Put the halves of a failed batch back in line to be tried again.
+
+        Only batches which failed because they look to be too big are
+        split. Any other failure has already used up all of its tries.
+
+        Required positional arguments:
+            queue - `BatchQueue` from which the batch was taken
+            batch - articles in the batch
+            sizer - `BatchSizer` for the kind of request
+            label - name of the request for logging
+            error - exception raised for the batch
+
+        Raise:
+            the batch's exception, if it wasn't a size-related failure
+            or the batch is too small to split
+        """
+
+        if not isinstance(error, BatchTooBig):
+            raise error
+        sizer.failed(len(batch))
+        if not sizer.splittable(len(batch)):
+            raise error
+        queue.split(batch)
+        self.metrics.record(label.lower(), splits=1)
+        args = label, len(batch), sizer.size
+        message = "%s batch of %d articles split (batch size now %d)"
+        self.logger.warning(message, *args)
+
+    def _state_path(self, name, shard=None):
+        """Location of one of the files we keep in the logs directory.
+
+        Shards running on the same machine need their own files, so
+        the shard is worked into the name (e.g., `x.shard-2-of-4.json`
+        instead of `x.json`).
+
+        Required positional argument:
+            name - default name of the file
+
+        Optional keyword argument:
+            shard - shard number and count (default is this run's)
+
+        Return:
+            `Path` object for the file
+        """
+
+        shard = shard or self.shard
+        if shard:
+            stem, extension = name.split(".", 1)
+            name = "{}.shard-{}-of-{}.{}".format(stem, *shard, extension)
+        return self.root / "logs" / name
+
+    @classmethod
+    def _check_revisions(cls, xml, refreshed, keep_xml):
+        """Parse an EFETCH response and find the stale articles in it.
+
+        Runs in one of the `--full-resync` parsing processes, so it
+        is given everything it needs instead of using our properties.
+
+        Required positional arguments:
+            xml - bytes for the EFETCH response
+            refreshed - dictionary of our refresh day numbers, indexed
+                        by PubMed ID string
+            keep_xml - if True, return the XML for the stale articles
+
+        Return:
+            tuple of the PubMed IDs of the articles in the response,
+            the stale ones among them, a sequence of PubMed ID and XML
+            pairs for the stale articles (if requested), the seconds
+            spent parsing, and the size of the response
+        """
+
+        started = perf_counter()
+
+        def is_stale(article):
+            day = refreshed.get(article.pmid)
+            return day is not None and article.revised >= day
+
+        keep = is_stale if keep_xml else None
+        articles = cls.PubmedArticle.parse([xml], keep=keep)
+        found = [article.pmid for article in articles]
+        stale = [article.pmid for article in articles if is_stale(article)]
+        staged = [(a.pmid, a.xml) for a in articles if a.xml]
+        return found, stale, staged, perf_counter() - started, len(xml)
+
+    @staticmethod
+    def _show_progress(percent):
+        """Draw a progress bar on the console.
+
+        Required positional argument:
+            percent - portion of the work done (between 0 and 1)
+        """
+
+        left = "=" * int(72 * percent)
+        right = " " * (72 - len(left))
+        stderr.write(f"\r[{left}>{right}]")
+
+
+    class PubmedArticle:
+        """PubMed ID and last revision date for an article fetched from NLM."""
+
+        ARTICLE_SET = "PubmedArticleSet"
+        ARTICLE = "PubmedArticle"
+
+        def __init__(self, pmid, revised=0):
+            """Remember the values extracted from the article's XML.
+
+            Required positional argument:
+                pmid - string for the article's PubMed ID
+
+            Optional keyword argument:
+                revised - day number (`date.toordinal()`) of the last
+                          revision (zero if unknown)
+            """
+
+            self.pmid = pmid
+            self.revised = revised
+            self.xml = None
+
+        @classmethod
+        def parse(cls, chunks, logger=None, keep=None):
+            """Pull the articles out of an EFETCH response as it arrives.
+
+            Each article's elements are discarded as soon as we have
+            picked out the two values we need, so memory use doesn't
+            grow with the size of the response, and we never copy or
+            re-parse slices of the document.
+
+            Required positional argument:
+                chunks - iterable of bytes for the serialized response
+
+            Optional keyword arguments:
+                logger - for recording articles we can't parse
+                keep - callback which returns `True` for articles whose
+                       serialized XML should be saved in the object
+
+            Return:
+                sequence of `PubmedArticle` objects
+
+            Raise:
+                `Exception` if the response is not a PubMed article set
+            """
+
+            opts = dict(resolve_entities=False, no_network=True)
+            opts["tag"] = cls.ARTICLE
+            parser = etree.XMLPullParser(events=["end"], **opts)
+            articles = []
+            for chunk in chunks:
+                parser.feed(chunk)
+                for event, node in parser.read_events():
+                    parent = node.getparent()
+                    if parent is None or parent.tag != cls.ARTICLE_SET:
+                        continue
+                    try:
+                        article = cls.extract(node)
+                        if article is not None:
+                            if keep and keep(article):
+                                article.xml = etree.tostring(node)
+                            articles.append(article)
+                    except Exception:
+                        if logger:
+                            logger.exception("parsing Pubmed article")
+                    node.clear()
+                    while node.getprevious() is not None:
+                        del parent[0]
+            root = parser.close()
+            if root.tag != cls.ARTICLE_SET:
+                message = " ".join("".join(root.itertext()).split())
+                raise Exception(f"fetch response: {message}")
+            return articles
+
+        @classmethod
+        def extract(cls, node):
+            """Create an object from the article's element, if possible."""
 
-            root = etree.fromstring(xml)
-            self.pmid = root.find("MedlineCitation/PMID").text.strip()
-            self.revised = ""
-            child = root.find("MedlineCitation/DateRevised")
+            pmid = node.findtext("MedlineCitation/PMID")
+            if not pmid or not pmid.strip():
+                return None
+            revised = 0
+            child = node.find("MedlineCitation/DateRevised")
             if child is not None:
-                year = int(child.find("Year").text)
-                month = int(child.find("Month").text)
-                day = int(child.find("Day").text)
-                self.revised = f"{year:04d}-{month:02d}-{day:02d}"
+                year = int(child.findtext("Year"))
+                month = int(child.findtext("Month"))
+                day = int(child.findtext("Day"))
+                revised = date(year, month, day).toordinal()
+            return cls(pmid.strip(), revised)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+"""Measure how fast the PubMed updater can parse EFETCH responses.
+
+Compares the streaming parser used by `scheduled/update-pubmed-data.py`
+with the approach it replaced (slicing `<PubmedArticle>` fragments out
+of the complete response and building an element tree for each one).
+Each parser runs in its own process, so the peak resident set size
+reported for one isn't polluted by the other.
+
+Pass the names of files holding captured EFETCH responses, or use
+`--synthesize` to generate a response with the specified number of
+articles.
+
+Example:
+
+    scripts/benchmark-efetch-parsing.py --synthesize 50000
+"""
+
+from argparse import ArgumentParser
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+from resource import getrusage, RUSAGE_SELF
+from subprocess import run
+from sys import executable
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+from lxml import etree
+
+UPDATER = Path(__file__).parent.parent / "scheduled/update-pubmed-data.py"
+METHODS = "legacy", "streaming"
+CHUNK_SIZE = 64 * 1024
+ARTICLE = """\
+<PubmedArticle>
+<MedlineCitation Status="MEDLINE" Owner="NLM">
+<PMID Version="1">{pmid}</PMID>
+<DateCompleted><Year>2020</Year><Month>01</Month><Day>15</Day></DateCompleted>
+<DateRevised><Year>2023</Year><Month>{month:02d}</Month><Day>{day:02d}</Day>\
+</DateRevised>
+<Article PubModel="Print">
+<ArticleTitle>Synthetic article number {pmid}.</ArticleTitle>
+<Abstract><AbstractText>{abstract}</AbstractText></Abstract>
+</Article>
+<CommentsCorrectionsList>
+<CommentsCorrections RefType="Cites"><PMID Version="1">{other}</PMID>
+</CommentsCorrections>
+</CommentsCorrectionsList>
+</MedlineCitation>
+<PubmedData><ArticleIdList>
+<ArticleId IdType="pubmed">{pmid}</ArticleId>
+</ArticleIdList></PubmedData>
+</PubmedArticle>
+"""
+
+
+def load_updater():
+    """Import the updater script (its name isn't a valid module name)."""
+
+    spec = spec_from_file_location("update_pubmed_data", UPDATER)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthesize(path, count):
+    """Write a fake EFETCH response with `count` articles to `path`."""
+
+    abstract = "Lorem ipsum dolor sit amet. " * 60
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write('<?xml version="1.0" ?>\n')
+        fp.write("<!DOCTYPE PubmedArticleSet PUBLIC "
+                 '"-//NLM//DTD PubMedArticle, 1st January 2023//EN" '
+                 '"https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_230101.dtd">'
+                 "\n<PubmedArticleSet>\n")
+        for i in range(count):
+            pmid = 10000000 + i
+            values = dict(
+                pmid=pmid,
+                other=pmid + 1,
+                month=i % 12 + 1,
+                day=i % 28 + 1,
+                abstract=abstract,
+            )
+            fp.write(ARTICLE.format(**values))
+        fp.write("</PubmedArticleSet>\n")
+
+
+def legacy(path, parse=None):
+    """Parse the response the way the updater used to do it."""
+
+    response = Path(path).read_bytes()
+    open_tag, close_tag = b"<PubmedArticle>", b"</PubmedArticle>"
+    articles = []
+    start = response.find(open_tag)
+    while start > 0:
+        end = response.find(close_tag, start)
+        if end < 0:
+            break
+        end += len(close_tag)
+        root = etree.fromstring(response[start:end])
+        start = response.find(open_tag, end)
+        pmid = root.find("MedlineCitation/PMID").text.strip()
+        revised = ""
+        child = root.find("MedlineCitation/DateRevised")
+        if child is not None:
+            year = int(child.find("Year").text)
+            month = int(child.find("Month").text)
+            day = int(child.find("Day").text)
+            revised = f"{year:04d}-{month:02d}-{day:02d}"
+        articles.append((pmid, revised))
+    return articles
+
+
+def streaming(path, parse):
+    """Parse the response using the updater's streaming parser."""
+
+    with open(path, "rb") as fp:
+        chunks = iter(lambda: fp.read(CHUNK_SIZE), b"")
+        return [(a.pmid, a.revised) for a in parse(chunks)]
+
+
+def measure(method, paths):
+    """Run a single parser over the responses and print the results."""
+
+    run_parser = dict(legacy=legacy, streaming=streaming)[method]
+    parse = None
+    if method == "streaming":
+        parse = load_updater().Control.PubmedArticle.parse
+    count = 0
+    started = perf_counter()
+    for path in paths:
+        count += len(run_parser(path, parse))
+    elapsed = perf_counter() - started
+    peak = getrusage(RUSAGE_SELF).ru_maxrss / 1024
+    rate = count / elapsed if elapsed else 0
+    print(f"{method:>10}: {count:d} articles in {elapsed:.2f} seconds "
+          f"({rate:,.0f} articles/sec); peak RSS {peak:,.1f} MB")
+
+
+def main():
+    """Run each parser in a separate process and report on the results."""
+
+    parser = ArgumentParser()
+    parser.add_argument("responses", nargs="*")
+    parser.add_argument("--synthesize", type=int, metavar="N")
+    parser.add_argument("--method", choices=METHODS)
+    opts = parser.parse_args()
+    if opts.method:
+        return measure(opts.method, opts.responses)
+    paths = list(opts.responses)
+    if opts.synthesize:
+        with NamedTemporaryFile(suffix=".xml", delete=False) as tmp:
+            path = tmp.name
+        synthesize(path, opts.synthesize)
+        paths.append(path)
+    if not paths:
+        parser.error("no responses to parse")
+    size = sum(Path(path).stat().st_size for path in paths)
+    print(f"parsing {len(paths)} response(s) ({size / 1024 / 1024:,.1f} MB)")
+    try:
+        for method in METHODS:
+            run([executable, __file__, "--method", method, *paths], check=True)
+    finally:
+        if opts.synthesize:
+            Path(path).unlink()
+
+
+if __name__ == "__main__":
+    main()
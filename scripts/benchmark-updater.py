@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""Measure the PubMed updater's throughput without touching NLM.
+
+Runs `scheduled/update-pubmed-data.py` against the stand-in services
+in `scripts/eutils-stand-in.py` for each of the requested numbers of
+articles, and reports the wall-clock time, the number of requests the
+stand-in server handled, the number of recently changed and stale
+articles the updater found, and the updater's peak resident set size.
+Each run gets a fresh stand-in server and a fresh (temporary) root
+directory for the updater's logs and state files, so no state carries
+over from one run to the next.
+
+Any arguments following `--` are passed through to the updater
+(for example, `-- --history --workers 8`).
+
+Example:
+
+    scripts/benchmark-updater.py 10000 100000 1000000 --latency .02
+"""
+
+from argparse import ArgumentParser
+from json import loads
+from os import wait4
+from pathlib import Path
+from subprocess import PIPE, Popen
+from sys import argv, executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from urllib.request import urlopen
+
+HERE = Path(__file__).parent
+UPDATER = HERE.parent / "scheduled/update-pubmed-data.py"
+STAND_IN = HERE / "eutils-stand-in.py"
+SIZES = 10000, 100000, 1000000
+REPORT = "logs/update-pubmed-data.report.json"
+COLUMNS = (
+    ("articles", "Articles", "{:,d}"),
+    ("seconds", "Seconds", "{:,.1f}"),
+    ("requests", "Requests", "{:,d}"),
+    ("retries", "Retries", "{:,d}"),
+    ("splits", "Splits", "{:,d}"),
+    ("recent", "Recent", "{:,d}"),
+    ("stale", "Stale", "{:,d}"),
+    ("rss", "Peak RSS MB", "{:,.1f}"),
+    ("success", "OK", "{}"),
+)
+
+
+def benchmark(articles, opts, extra):
+    """Run the updater once against a fresh stand-in server.
+
+    Required positional arguments:
+        articles - number of synthetic articles for the stand-in EBMS
+        opts - options controlling the stand-in server
+        extra - additional command-line arguments for the updater
+
+    Return:
+        dictionary of values for the run
+    """
+
+    server_args = [
+        executable, str(STAND_IN),
+        "--articles", str(articles),
+        "--recent", str(opts.recent),
+        "--stale", str(opts.stale),
+        "--latency", str(opts.latency),
+        "--ebms-latency", str(opts.ebms_latency),
+        "--errors", str(opts.errors),
+        "--article-latency", str(opts.article_latency),
+        "--max-batch", str(opts.max_batch),
+    ]
+    if opts.recorded:
+        server_args += ["--recorded", *opts.recorded]
+    server = Popen(server_args, stdout=PIPE, text=True)
+    try:
+        url = server.stdout.readline().split()[-1]
+        with TemporaryDirectory() as root:
+            (Path(root) / "logs").mkdir()
+            updater_args = [
+                executable, str(UPDATER),
+                "--root", root,
+                "--base-url", url,
+                "--eutils-url", url,
+                "--full-dates",
+                "--requests-per-second", str(opts.rate),
+                *extra,
+            ]
+            started = perf_counter()
+            updater = Popen(updater_args)
+            _, status, usage = wait4(updater.pid, 0)
+            elapsed = perf_counter() - started
+            report = loads((Path(root) / REPORT).read_text())
+        with urlopen(f"{url}/stats") as response:
+            stats = loads(response.read())
+    finally:
+        server.terminate()
+        server.wait()
+    requests = sum(count for path, count in stats.items()
+                   if "injected" not in path and path != "/stats")
+    retries = sum(stage["retries"] for stage in report["stages"].values())
+    splits = sum(stage["splits"] for stage in report["stages"].values())
+    return dict(
+        articles=articles,
+        seconds=elapsed,
+        requests=requests,
+        retries=retries,
+        splits=splits,
+        recent=report["recent_articles"],
+        stale=report["stale_articles"],
+        rss=usage.ru_maxrss / 1024,
+        success=report["success"] and status == 0,
+    )
+
+
+def main():
+    """Run the benchmark for each size and print a table of the results."""
+
+    parser = ArgumentParser()
+    parser.add_argument("sizes", nargs="*", type=int, default=SIZES)
+    parser.add_argument("--recent", type=float, default=5)
+    parser.add_argument("--stale", type=float, default=60)
+    parser.add_argument("--recorded", nargs="*", metavar="XML")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--ebms-latency", type=float, default=0)
+    parser.add_argument("--errors", type=float, default=0)
+    parser.add_argument("--article-latency", type=float, default=0)
+    parser.add_argument("--max-batch", type=int, default=0)
+    parser.add_argument("--rate", type=float, default=1000,
+                        help="E-utilities requests allowed per second")
+    args = argv[1:]
+    extra = []
+    if "--" in args:
+        i = args.index("--")
+        args, extra = args[:i], args[i+1:]
+    opts = parser.parse_args(args)
+    widths = [max(len(header), 12) for _, header, _ in COLUMNS]
+    print("  ".join(h.rjust(w) for (_, h, _), w in zip(COLUMNS, widths)))
+    for size in opts.sizes:
+        results = benchmark(size, opts, extra)
+        values = []
+        for (name, _, fmt), width in zip(COLUMNS, widths):
+            values.append(fmt.format(results[name]).rjust(width))
+        print("  ".join(values), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+
+"""Local stand-in for NLM's E-utilities and the EBMS article import routes.
+
+Serves just enough of ESEARCH, EFETCH, and EPOST (including the history
+server), and of the EBMS `articles/import/dates` and
+`articles/import/refresh` routes, for `scheduled/update-pubmed-data.py`
+to run against it without touching NLM or a real site. Point the
+updater's `--eutils-url` and `--base-url` options at the address this
+script prints when it starts.
+
+The articles are synthetic: PubMed IDs are assigned sequentially, and
+a fixed (pseudo-random) portion of them are treated as recently
+modified, with a portion of those having a revision date later than
+the date the stand-in EBMS reports for them (so they are stale).
+Captured EFETCH responses can be loaded with `--recorded`, in which
+case those articles are served as they were recorded and are all
+treated as recently modified. A portion of the synthetic articles can
+be marked as dropped by NLM (`--dropped`), in which case they are in
+the stand-in EBMS's list, but the stand-in E-utilities can't find them.
+
+Latency and errors (429 or 503 responses with a `Retry-After` header)
+can be injected to see how the updater copes. Latency can also grow
+with the number of articles in a request (`--article-latency`), and
+requests for more than `--max-batch` articles can be made to fail
+with a 502 (as they would if a proxy timed out), to exercise the
+updater's batch sizing. The stand-in EBMS can reject a portion of the
+articles the first time they're submitted for a refresh (`--rejected`).
+A GET request for `/stats` returns the number of requests handled for
+each route.
+
+Example:
+
+    scripts/eutils-stand-in.py --articles 100000 --latency .05 --errors .01
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import date, timedelta
+from email.parser import BytesParser
+from email.policy import HTTP
+from gzip import compress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from random import random, uniform
+from re import findall
+from threading import Lock
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
+from lxml import etree
+
+FIRST_PMID = 10000000
+ARTICLE = """\
+<PubmedArticle>
+<MedlineCitation Status="MEDLINE" Owner="NLM">
+<PMID Version="1">{pmid}</PMID>
+<DateRevised><Year>{year}</Year><Month>{month:02d}</Month><Day>{day:02d}</Day>\
+</DateRevised>
+<Article PubModel="Print">
+<ArticleTitle>Synthetic article number {pmid}.</ArticleTitle>
+<Abstract><AbstractText>{abstract}</AbstractText></Abstract>
+</Article>
+</MedlineCitation>
+<PubmedData><ArticleIdList>
+<ArticleId IdType="pubmed">{pmid}</ArticleId>
+</ArticleIdList></PubmedData>
+</PubmedArticle>
+"""
+ABSTRACT = "Lorem ipsum dolor sit amet. " * 40
+
+
+class Corpus:
+    """The articles (real or synthetic) known to the stand-in services."""
+
+    def __init__(self, count, recent, stale, recorded=(), dropped=0):
+        """Decide which articles exist and load any recorded ones.
+
+        Required positional arguments:
+            count - number of synthetic articles
+            recent - percentage of them modified recently
+            stale - percentage of the modified articles which are stale
+
+        Optional keyword arguments:
+            recorded - paths for captured EFETCH responses
+            dropped - percentage of synthetic articles NLM doesn't have
+        """
+
+        self.count = count
+        self.synthetic = range(FIRST_PMID, FIRST_PMID + count)
+        self.recent = recent
+        self.stale = stale
+        self.dropped = dropped
+        self.today = date.today()
+        self.recorded = {}
+        self.revised = {}
+        for path in recorded:
+            for _, node in etree.iterparse(path, tag="PubmedArticle"):
+                pmid = int(node.findtext("MedlineCitation/PMID").strip())
+                revised = node.find("MedlineCitation/DateRevised")
+                if revised is not None:
+                    year = int(revised.findtext("Year"))
+                    month = int(revised.findtext("Month"))
+                    day = int(revised.findtext("Day"))
+                    self.revised[pmid] = date(year, month, day)
+                self.recorded[pmid] = etree.tostring(node)
+                node.clear()
+
+    def __iter__(self):
+        """Walk through the PubMed IDs of all the articles."""
+
+        yield from self.synthetic
+        for pmid in sorted(self.recorded):
+            if pmid not in self.synthetic:
+                yield pmid
+
+    def article(self, pmid):
+        """Serialize an article's XML.
+
+        Required positional argument:
+            pmid - integer for the article's PubMed ID
+
+        Return:
+            bytes for the `PubmedArticle` element, or `None` if the
+            article doesn't exist
+        """
+
+        if pmid in self.recorded:
+            return self.recorded[pmid]
+        if not self.exists(pmid):
+            return None
+        revised = self.revision_date(pmid)
+        values = dict(
+            pmid=pmid,
+            year=revised.year,
+            month=revised.month,
+            day=revised.day,
+            abstract=ABSTRACT,
+        )
+        return ARTICLE.format(**values).encode("utf-8")
+
+    def ebms_date(self, pmid):
+        """Date on which the stand-in EBMS last refreshed the article."""
+
+        revised = self.revision_date(pmid)
+        if self.is_recent(pmid) and self._percent(pmid, 40503) < self.stale:
+            return revised - timedelta(days=1)
+        return revised + timedelta(days=1)
+
+    def exists(self, pmid):
+        """Does the stand-in for NLM have this article?"""
+
+        if pmid in self.recorded:
+            return True
+        if pmid not in self.synthetic:
+            return False
+        return self._percent(pmid, 69069) >= self.dropped
+
+    def is_recent(self, pmid):
+        """Was the article modified within the updater's search window?"""
+
+        if pmid in self.recorded:
+            return True
+        if not self.exists(pmid):
+            return False
+        return self._percent(pmid, 2654435761) < self.recent
+
+    def revision_date(self, pmid):
+        """Date on which NLM last revised the article."""
+
+        if pmid in self.revised:
+            return self.revised[pmid]
+        if self.is_recent(pmid):
+            return self.today - timedelta(days=pmid % 7)
+        return self.today - timedelta(days=365 + pmid % 365)
+
+    @staticmethod
+    def _percent(pmid, multiplier):
+        """Scatter the PubMed IDs evenly over the range 0-99.99."""
+        return pmid * multiplier % 1000003 % 10000 / 100
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answer requests for the stand-in services.
+
+    The class attributes are filled in by `main()` before the server
+    starts.
+    """
+
+    protocol_version = "HTTP/1.1"
+    corpus = None
+    latency = 0
+    article_latency = 0
+    max_batch = 0
+    errors = 0
+    rejected = 0
+    ebms_latency = 0
+    verbose = False
+    lock = Lock()
+    history = {}
+    submitted = set()
+    stats = Counter()
+
+    def do_GET(self):
+        """Handle the routes which are requested with GET."""
+
+        path = urlsplit(self.path).path.rstrip("/")
+        self._count(path)
+        if path == "/stats":
+            return self._send(dumps(dict(self.stats)), "application/json")
+        if path.endswith("/articles/import/dates"):
+            return self._dates()
+        self._send("Not found\n", status=404)
+
+    def do_POST(self):
+        """Handle the routes which are requested with POST."""
+
+        path = urlsplit(self.path).path.rstrip("/")
+        self._count(path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if path.endswith("/articles/import/refresh"):
+            return self._refresh(body)
+        service = path.rsplit("/", 1)[-1]
+        handler = dict(
+            esearch=self._esearch,
+            efetch=self._efetch,
+            epost=self._epost,
+        ).get(service.replace(".fcgi", ""))
+        if handler is None:
+            return self._send("Not found\n", status=404)
+        parms = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+        if self.latency:
+            sleep(uniform(.5, 1.5) * self.latency)
+        if self.errors and random() < self.errors:
+            self._count(f"{path} (injected error)")
+            status = 429 if random() < .5 else 503
+            headers = {"Retry-After": "0"}
+            return self._send("Try again later\n", status=status, **headers)
+        if service != "epost.fcgi":
+            articles = self._batch_size(parms)
+            if self.article_latency:
+                sleep(articles * self.article_latency)
+            if self.max_batch and articles > self.max_batch:
+                self._count(f"{path} (batch too big)")
+                return self._send("Gateway timeout\n", status=502)
+        handler(parms)
+
+    def log_message(self, format, *args):
+        """Only log requests if asked."""
+
+        if self.verbose:
+            super().log_message(format, *args)
+
+    @staticmethod
+    def _batch_size(parms):
+        """Find out how many articles a request is asking about."""
+
+        if "retmax" in parms and "query_key" in parms:
+            return int(parms["retmax"])
+        if "id" in parms:
+            return parms["id"].count(",") + 1
+        return parms.get("term", "").count("[pmid]")
+
+    def _count(self, path):
+        """Keep track of how many requests each route gets."""
+
+        with self.lock:
+            self.stats[path] += 1
+
+    def _dates(self):
+        """Send the stand-in EBMS's refresh date for each article."""
+
+        etag = f'"stand-in-{self.corpus.count}-{len(self.corpus.recorded)}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self._send("", status=304, ETag=etag)
+        rows = []
+        for i, pmid in enumerate(self.corpus, start=1):
+            rows.append(f"{i}\t{pmid}\t{self.corpus.ebms_date(pmid)}\n")
+        headers = {"ETag": etag, "X-Dates-As-Of": str(date.today())}
+        body = "".join(rows).encode("utf-8")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = compress(body, 1)
+            headers["Content-Encoding"] = "gzip"
+        self._send(body, **headers)
+
+    def _efetch(self, parms):
+        """Send the XML for the requested articles."""
+
+        if "query_key" in parms:
+            with self.lock:
+                pmids = self.history.get(parms["query_key"], [])
+            start = int(parms.get("retstart", 0))
+            pmids = pmids[start:start+int(parms.get("retmax", 20))]
+        else:
+            pmids = [int(pmid) for pmid in parms.get("id", "").split(",")]
+        parts = [b'<?xml version="1.0" ?>\n<PubmedArticleSet>\n']
+        for pmid in pmids:
+            xml = self.corpus.article(pmid)
+            if xml:
+                parts.append(xml)
+        parts.append(b"</PubmedArticleSet>\n")
+        self._send(b"".join(parts), "text/xml")
+
+    def _epost(self, parms):
+        """Store a set of IDs on the stand-in history server."""
+
+        pmids = [int(pmid) for pmid in parms.get("id", "").split(",")]
+        key = self._remember(pmids)
+        xml = f"<ePostResult><QueryKey>{key}</QueryKey>"
+        xml += "<WebEnv>STAND-IN</WebEnv></ePostResult>"
+        self._send(xml, "text/xml")
+
+    def _esearch(self, parms):
+        """Find the recently modified articles among those requested.
+
+        A search with no PubMed IDs or history sets covers the whole
+        corpus (as a search on the modification date window alone
+        would), and only the first `retmax` IDs are returned.
+        """
+
+        term = parms.get("term", "")
+        if parms.get("usehistory") == "y":
+            pmids = []
+            with self.lock:
+                for key in findall(r"#(\d+)", term):
+                    pmids.extend(self.history.get(key, []))
+            found = sorted(p for p in pmids if self.corpus.is_recent(p))
+            key = self._remember(found)
+            xml = f"<eSearchResult><Count>{len(found)}</Count>"
+            xml += f"<QueryKey>{key}</QueryKey><WebEnv>STAND-IN</WebEnv>"
+            return self._send(xml + "</eSearchResult>", "text/xml")
+        keys = findall(r"#(\d+)", term)
+        if keys:
+            pmids = []
+            with self.lock:
+                for key in keys:
+                    pmids.extend(self.history.get(key, []))
+            found = [p for p in pmids if self.corpus.exists(p)]
+        elif "[pmid]" in term:
+            pmids = findall(r"(\d+)\[pmid\]", term)
+            pmids = [int(pmid) for pmid in pmids]
+            found = [p for p in pmids if self.corpus.is_recent(p)]
+        else:
+            found = [p for p in self.corpus if self.corpus.is_recent(p)]
+        count = len(found)
+        found = found[:int(parms.get("retmax", 20))]
+        ids = "".join(f"<Id>{pmid}</Id>" for pmid in found)
+        xml = f"<eSearchResult><Count>{count}</Count>"
+        xml += f"<IdList>{ids}</IdList></eSearchResult>"
+        self._send(xml, "text/xml")
+
+    def _refresh(self, body):
+        """Pretend to refresh the articles the updater submitted."""
+
+        if self.ebms_latency:
+            sleep(uniform(.5, 1.5) * self.ebms_latency)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/"):
+            header = f"Content-Type: {content_type}\r\n\r\n".encode()
+            message = BytesParser(policy=HTTP).parsebytes(header + body)
+            parms = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if not part.get_filename():
+                    parms[name] = part.get_content()
+        else:
+            parms = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        pmids = [p for p in parms.get("pmids", "").split(",") if p]
+        failed = []
+        with self.lock:
+            for pmid in pmids:
+                if pmid not in self.submitted:
+                    self.submitted.add(pmid)
+                    if Corpus._percent(int(pmid), 48271) < self.rejected:
+                        failed.append(pmid)
+        refreshed = len(pmids) - len(failed)
+        message = f"Refreshed {refreshed} articles."
+        if parms.get("format") != "json":
+            return self._send(message)
+        values = dict(
+            success=True,
+            message=message,
+            refreshed=refreshed,
+            replaced=refreshed,
+            unchanged=0,
+            failed=len(failed),
+            failed_pmids=failed,
+        )
+        self._send(dumps(values), "application/json")
+
+    def _remember(self, pmids):
+        """Store IDs on the history server and return their query key."""
+
+        with self.lock:
+            key = str(len(self.history) + 1)
+            self.history[key] = pmids
+        return key
+
+    def _send(self, body, content_type="text/plain", status=200, **headers):
+        """Write the response, with a length so the connection stays open.
+
+        Required positional argument:
+            body - string or bytes for the response
+
+        Optional keyword arguments:
+            content_type - MIME type for the response
+            status - HTTP status code
+            headers - additional response headers
+        """
+
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name.replace("_", "-"), value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    """Start the server and run until interrupted."""
+
+    parser = ArgumentParser()
+    parser.add_argument("--articles", type=int, default=10000)
+    parser.add_argument("--recent", type=float, default=5,
+                        help="percentage of articles recently modified")
+    parser.add_argument("--stale", type=float, default=60,
+                        help="percentage of modified articles which are stale")
+    parser.add_argument("--recorded", nargs="*", default=[], metavar="XML")
+    parser.add_argument("--dropped", type=float, default=0,
+                        help="percentage of articles NLM no longer has")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="mean seconds added to each E-utilities request")
+    parser.add_argument("--ebms-latency", type=float, default=0,
+                        help="mean seconds added to each refresh request")
+    parser.add_argument("--errors", type=float, default=0,
+                        help="portion of E-utilities requests to fail")
+    parser.add_argument("--article-latency", type=float, default=0,
+                        help="seconds added for each article in a request")
+    parser.add_argument("--max-batch", type=int, default=0,
+                        help="fail requests for more articles than this")
+    parser.add_argument("--rejected", type=float, default=0,
+                        help="percentage of articles failing first refresh")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--verbose", "-v", action="store_true")
+    opts = parser.parse_args()
+    args = opts.articles, opts.recent, opts.stale
+    corpus = Corpus(*args, recorded=opts.recorded, dropped=opts.dropped)
+    Handler.corpus = corpus
+    Handler.latency = opts.latency
+    Handler.ebms_latency = opts.ebms_latency
+    Handler.errors = opts.errors
+    Handler.article_latency = opts.article_latency
+    Handler.max_batch = opts.max_batch
+    Handler.rejected = opts.rejected
+    Handler.verbose = opts.verbose
+    server = ThreadingHTTPServer(("127.0.0.1", opts.port), Handler)
+    server.daemon_threads = True
+    host, port = server.server_address
+    print(f"listening on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -3,31 +3,461 @@
 """
 Report on journal article acceptance rates.
 
-Does a lot of in-memory processing, so it helps to run this on a
-machine with plenty of RAM.  If this script is invoked with the
+The counts are computed with NumPy arrays (see `Tally`) rather than
+with a Python object for every article.  If this script is invoked with the
 `--path` option, it will read the data for the report from the files
 in that directory captured on a previous run without that option.
 
+The data is captured in a columnar layout (see `Snapshot`) which is
+memory-mapped when it's loaded. Directories captured by older versions
+of the script (one JSON-lines file per table) can still be read, and
+adding the `--convert` option rewrites them in the columnar layout.
+For date ranges too large to count in memory, the `--memory` option
+(a budget in megabytes) has the counting done a partition at a time
+(see `Control._count_in_partitions()`). The database filters the rows
+by article import date, and with the `--grouped` option it also folds
+the states for each article/board into flags before sending them.
+With `--store`, snapshots are kept from one run to the next, and only
+the rows which have changed since the last run are fetched.
+The workbooks are streamed to disk (or written as CSV or JSON files,
+using the `--format` option), in separate processes. Each `--window`
+option gets its own pair of workbooks, for the articles imported
+between the window's dates, all counted from a single load.
+
 See Jira ticket OCEEBMS-301 for original requirements.
 Rewritten for OCEEBMS-569 to use the new EBMS database tables.
 """
 
 import argparse
+import array
+import concurrent.futures
+import contextlib
+import csv
 import datetime
 import getpass
+import itertools
 import json
 import os
+import queue
+import shutil
 import sys
+import tempfile
+import threading
+import numpy as np
 import openpyxl
 
 
+class Snapshot:
+    """Data captured from the database for the report.
+
+    The original layout has a JSON-lines file for each table, with one
+    row per line. The columnar layout has a NumPy `.npy` file for each
+    numeric column (memory-mapped when it's read), a JSON file for each
+    column of strings, and a manifest recording the date range for the
+    articles, when the data was captured, and the number of rows in
+    each table. Journal IDs are strings, so the columns which refer to
+    journals hold integer codes for the IDs in the `journal_keys` list.
+    A snapshot captured with `--grouped` has the combined flags for each
+    article/board in `pair_flags`, in place of the rows for the article
+    boards, article states, and board decisions. Dates are stored as
+    integers (YYYYMMDD). Columns which were added after a snapshot was
+    captured come back as zeros.
+    """
+
+    MANIFEST = "manifest.json"
+    FORMAT = 2
+    TABLES = dict(
+        boards=("id", "name"),
+        not_list=("journal", "board"),
+        journals=("id", "title"),
+        articles=("id", "journal", "imported"),
+        states=("id", "text_id"),
+        article_boards=("article", "board"),
+        article_states=("id", "article", "state", "board"),
+        decision_values=("id", "name"),
+        board_decisions=("article_state", "decision"),
+        pair_flags=("article", "board", "flags"),
+    )
+    STRINGS = {
+        ("boards", "name"),
+        ("journals", "id"),
+        ("journals", "title"),
+        ("states", "text_id"),
+        ("decision_values", "name"),
+    }
+    JOURNALS = {("not_list", "journal"), ("articles", "journal")}
+    DATES = {("articles", "imported")}
+
+    def __init__(self, directory):
+        """Find out which layout the directory uses.
+
+        directory - string for the location of the captured data
+        """
+
+        self.directory = directory
+        self.manifest = None
+        self.codes = dict()
+        self.tables = dict()
+        path = f"{directory}/{self.MANIFEST}"
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fp:
+                self.manifest = json.load(fp)
+
+    @property
+    def columnar(self):
+        "True if the data is stored in the columnar layout"
+        return self.manifest is not None
+
+    @property
+    def grouped(self):
+        "True if the database combined the flags for each article/board"
+
+        if not self.columnar:
+            return False
+        return self.manifest["tables"].get("pair_flags", 0) > 0
+
+    @property
+    def journal_keys(self):
+        "Journal IDs for the codes in columns which refer to journals"
+
+        if not self.columnar:
+            return list(self.codes)
+        if not hasattr(self, "_journal_keys"):
+            with open(f"{self.directory}/journal_keys.json") as fp:
+                self._journal_keys = json.load(fp)
+        return self._journal_keys
+
+    def column(self, table, name):
+        """Load one column of a table.
+
+        table - name of the table (a key in `TABLES`)
+        name - name of the column
+
+        Return a memory-mapped NumPy array (a list for strings). For
+        an old snapshot, the table is read into memory the first time
+        one of its columns is requested.
+        """
+
+        if not self.columnar:
+            if table not in self.tables:
+                self.tables[table] = self._load(table)
+            return self.tables[table][self.TABLES[table].index(name)]
+        path = f"{self.directory}/{table}.{name}"
+        if (table, name) in self.STRINGS:
+            with open(f"{path}.json", encoding="utf-8") as fp:
+                return json.load(fp)
+        if not os.path.exists(f"{path}.npy"):
+            return np.zeros(self.manifest["tables"][table], dtype="<u4")
+        return np.load(f"{path}.npy", mmap_mode="r")
+
+    def chunks(self, table, names, size):
+        """Read columns of a table stored in the columnar layout in pieces.
+
+        table - name of the table (a key in `TABLES`)
+        names - names of the numeric columns we want
+        size - maximum number of rows in a piece
+
+        The values are read from the files (rather than memory-mapped),
+        so the pages we're done with don't count against the process.
+
+        Generate a list of arrays (one for each column) for each piece.
+        """
+
+        files = []
+        types = []
+        try:
+            for name in names:
+                path = f"{self.directory}/{table}.{name}.npy"
+                files.append(open(path, "rb"))
+                np.lib.format.read_magic(files[-1])
+                header = np.lib.format.read_array_header_1_0(files[-1])
+                types.append(header[2])
+            while True:
+                columns = []
+                for fp, dtype in zip(files, types):
+                    columns.append(np.fromfile(fp, dtype, count=size))
+                if not len(columns[0]):
+                    break
+                yield columns
+        finally:
+            for fp in files:
+                fp.close()
+
+    def rows(self, table):
+        """Generate the rows of a table, whichever layout is used.
+
+        table - name of the table (a key in `TABLES`)
+
+        Values come back as they did from the database (so journals
+        are identified by their IDs rather than by our codes).
+        """
+
+        if not self.columnar:
+            if not os.path.exists(f"{self.directory}/{table}"):
+                return
+            missing = (None,) * len(self.TABLES[table])
+            with open(f"{self.directory}/{table}", encoding="utf-8") as fp:
+                for line in fp:
+                    row = tuple(json.loads(line.strip()))
+                    yield row + missing[len(row):]
+            return
+        columns = []
+        for name in self.TABLES[table]:
+            column = self.column(table, name)
+            if (table, name) in self.JOURNALS:
+                keys = self.journal_keys
+                column = [keys[code] for code in column.tolist()]
+            elif not isinstance(column, list):
+                column = column.tolist()
+            columns.append(column)
+        yield from zip(*columns)
+
+    def _load(self, table):
+        """Read a table from an old snapshot's JSON-lines file.
+
+        table - name of the table (a key in `TABLES`)
+
+        Return a sequence of arrays (or lists for strings) of values.
+        """
+
+        names = self.TABLES[table]
+        columns = [[] for name in names]
+        for row in self.rows(table):
+            for column, value in zip(columns, row):
+                column.append(value)
+        for i, name in enumerate(names):
+            if (table, name) in self.JOURNALS:
+                codes = self.codes
+                column = [codes.setdefault(v, len(codes)) for v in columns[i]]
+                columns[i] = np.array(column, dtype="<u4")
+            elif (table, name) not in self.STRINGS:
+                column = [0 if v is None else v for v in columns[i]]
+                columns[i] = np.array(column, dtype="<u4")
+        return columns
+
+    @staticmethod
+    def day(value):
+        "Integer (YYYYMMDD) for a date, a datetime, or an ISO string"
+
+        if value is None:
+            return 0
+        if isinstance(value, int):
+            return value
+        return int(str(value)[:10].replace("-", ""))
+
+    def convert(self):
+        """Rewrite a snapshot stored in JSON-lines files as columns.
+
+        The date range of an old snapshot isn't known, so it isn't
+        recorded in the manifest.
+        """
+
+        if self.columnar:
+            sys.stderr.write(f"{self.directory} is already columnar\n")
+            return
+        writer = SnapshotWriter(self.directory)
+        for table in self.TABLES:
+            for row in self.rows(table):
+                writer.add(table, row)
+            sys.stderr.write(f"converted {table}\n")
+        writer.close()
+        self.manifest = writer.manifest
+
+
+class SnapshotWriter:
+    """Collect the columns for a snapshot and write them out at the end.
+
+    Numeric columns are accumulated in compact arrays of unsigned
+    32-bit integers (a missing value is stored as zero), so the
+    collection never holds a Python object for every value. Each
+    array is appended to a scratch file whenever it fills up, so the
+    memory used doesn't grow with the size of the snapshot. Different
+    threads can add rows to different tables at the same time.
+    """
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, directory, start=None, end=None, marks=None):
+        """Start with empty columns.
+
+        directory - where the snapshot is stored
+        start - beginning of the article import date range
+        end - end of the article import date range
+        marks - optional dictionary of values recording how far the
+                capture got (see `fetch()`)
+        """
+
+        self.directory = directory
+        self.start = start
+        self.end = end
+        self.marks = marks or dict()
+        self.codes = dict()
+        self.lock = threading.Lock()
+        self.columns = dict()
+        self.manifest = None
+        for table, names in Snapshot.TABLES.items():
+            columns = []
+            for name in names:
+                if (table, name) in Snapshot.STRINGS:
+                    columns.append([])
+                else:
+                    columns.append(array.array("I"))
+                    open(self._scratch(table, name), "wb").close()
+            self.columns[table] = columns
+        self.rows = dict.fromkeys(Snapshot.TABLES, 0)
+
+    def add(self, table, row):
+        """Add a row (as it came from the database) to a table.
+
+        table - name of the table (a key in `Snapshot.TABLES`)
+        row - sequence of values for the table's columns
+        """
+
+        names = Snapshot.TABLES[table]
+        for name, column, value in zip(names, self.columns[table], row):
+            if (table, name) in Snapshot.JOURNALS:
+                with self.lock:
+                    value = self.codes.setdefault(value, len(self.codes))
+            elif (table, name) in Snapshot.DATES:
+                value = Snapshot.day(value)
+            elif value is None and (table, name) not in Snapshot.STRINGS:
+                value = 0
+            column.append(value)
+        self.rows[table] += 1
+        if self.rows[table] % self.BUFFER_SIZE == 0:
+            self._flush(table)
+
+    def extend(self, table, columns, keys=None):
+        """Add rows to a table from arrays of values.
+
+        table - name of a table with only numeric columns
+        columns - sequence of arrays of values for the table's columns
+        keys - journal IDs for the codes in columns which refer to
+               journals (see `Snapshot.journal_keys`)
+        """
+
+        self._flush(table)
+        names = Snapshot.TABLES[table]
+        for name, column in zip(names, columns):
+            if (table, name) in Snapshot.JOURNALS:
+                with self.lock:
+                    codes = [self.codes.setdefault(k, len(self.codes))
+                             for k in keys]
+                column = np.array(codes, dtype="<u4")[column]
+            with open(self._scratch(table, name), "ab") as fp:
+                np.asarray(column, dtype="<u4").tofile(fp)
+        self.rows[table] += len(columns[0])
+
+    def close(self):
+        """Write the columns and the manifest."""
+
+        for table, names in Snapshot.TABLES.items():
+            self._flush(table)
+            for name, column in zip(names, self.columns[table]):
+                path = f"{self.directory}/{table}.{name}"
+                if (table, name) in Snapshot.STRINGS:
+                    with open(f"{path}.json", "w", encoding="utf-8") as fp:
+                        json.dump(column, fp)
+                    continue
+                scratch = self._scratch(table, name)
+                header = dict(
+                    descr="<u4",
+                    fortran_order=False,
+                    shape=(self.rows[table],),
+                )
+                with open(f"{path}.npy", "wb") as fp:
+                    np.lib.format.write_array_header_1_0(fp, header)
+                    with open(scratch, "rb") as values:
+                        shutil.copyfileobj(values, fp)
+                os.remove(scratch)
+        tables = self.rows
+        with open(f"{self.directory}/journal_keys.json", "w") as fp:
+            json.dump(list(self.codes), fp)
+        self.manifest = dict(
+            format=Snapshot.FORMAT,
+            start=self.start,
+            end=self.end,
+            created=datetime.datetime.now().isoformat(timespec="seconds"),
+            tables=tables,
+            marks=self.marks,
+        )
+        path = f"{self.directory}/{Snapshot.MANIFEST}"
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump(self.manifest, fp, indent=2)
+        self.columns = None
+
+    def _flush(self, table):
+        "Move the buffered numeric values for a table to scratch files"
+
+        names = Snapshot.TABLES[table]
+        for name, column in zip(names, self.columns[table]):
+            if isinstance(column, array.array):
+                with open(self._scratch(table, name), "ab") as fp:
+                    column.tofile(fp)
+                del column[:]
+
+    def _scratch(self, table, name):
+        "Where a numeric column's values are kept until we're done"
+        return f"{self.directory}/{table}.{name}.part"
+
+
+class Spill:
+    """Rows divided among partition files on disk by an integer key.
+
+    Used when the report is counted within a memory budget, so that
+    only one partition's rows have to be in memory at a time.
+    """
+
+    def __init__(self, directory, name, dtype, partitions):
+        """Start with empty partitions.
+
+        directory - where the partition files go
+        name - prefix for the names of the files
+        dtype - NumPy structured type for the rows
+        partitions - number of partitions
+        """
+
+        self.dtype = np.dtype(dtype)
+        self.paths = [f"{directory}/{name}.{i}" for i in range(partitions)]
+
+    def add(self, keys, rows):
+        """Append rows to the partitions for their keys.
+
+        keys - array of integers which pick the partitions
+        rows - structured array of rows, one for each key
+        """
+
+        partitions = np.asarray(keys, dtype=np.int64) % len(self.paths)
+        order = np.argsort(partitions, kind="stable")
+        bounds = np.searchsorted(partitions[order], range(len(self.paths) + 1))
+        rows = rows[order]
+        for i, path in enumerate(self.paths):
+            if bounds[i] < bounds[i+1]:
+                with open(path, "ab") as fp:
+                    rows[bounds[i]:bounds[i+1]].tofile(fp)
+
+    def load(self, partition):
+        """Read the rows for one partition (and remove its file).
+
+        partition - index of the partition
+
+        Return a structured array of rows.
+        """
+
+        path = self.paths[partition]
+        if not os.path.exists(path):
+            return np.empty(0, dtype=self.dtype)
+        rows = np.fromfile(path, dtype=self.dtype)
+        os.remove(path)
+        return rows
+
+
 class States:
     "Dictionary of article state values"
 
-    def __init__(self, path):
+    def __init__(self, rows):
         self.values = dict()
-        for line in open(f"{path}/states"):
-            state_id, state_text_id = json.loads(line.strip())
+        for state_id, state_text_id in rows:
             self.values[state_text_id] = state_id
         self.ABSTRACT_YES = self.values["passed_bm_review"]
         self.ABSTRACT_NO = self.values["reject_bm_review"]
@@ -44,66 +474,176 @@ class States:
                 self.FINAL_DECISION)
 
 
-class Counts:
-    "Base class for counting occurrences of particular states"
+class Tally:
+    """Per-board, per-journal counts for the report, computed with NumPy.
 
-    def __init__(self):
-        self.abstract_yes = self.abstract_no = 0
-        self.full_text_yes = self.full_text_no = 0
-        self.ed_board_yes = self.ed_board_no = 0
+    Each row for an article state gets a bit flag for the count it
+    feeds, the flags are OR-ed together for each article/board
+    combination, and the combinations are counted for each board and
+    journal with `numpy.bincount()`, so we never need a Python object
+    for every article.
 
-
-class Article(Counts):
-    """
-    Records the number of times we see a particular state for
-    this article in connection with a single board.
+    No matter how many times we see a particular state for an
+    article/board combination, it gets mapped to a single count when
+    folding the values into the counts for the article's journal.
+    A "yes" wins over a "no" for the same step of the review.
     """
 
-    def __init__(self, article_id):
-        Counts.__init__(self)
-        self.id = article_id
+    ABSTRACT_YES = 1
+    ABSTRACT_NO = 2
+    FULL_TEXT_YES = 4
+    FULL_TEXT_NO = 8
+    ED_BOARD_YES = 16
+    ED_BOARD_NO = 32
+    COLUMNS = (
+        "Total",
+        "Abstract Yes",
+        "Abstract No",
+        "Full-Text Yes",
+        "Full-Text No",
+        "Ed Board Yes",
+        "Ed Board No",
+    )
+
+    EVERYTHING = 0, 99999999
 
-    def map_counts(self, counts):
+    def __init__(self, board_ids, journals, windows=(EVERYTHING,)):
+        """Start with zero counts.
+
+        board_ids - sequence of IDs for the boards on the report
+        journals - number of journals on the report
+        windows - sequence of first and last import dates (integers,
+                  see `Snapshot.day()`) for the articles in each set
+                  of counts (by default, a single set for all of them)
+        """
+
+        self.board_ids = np.sort(np.asarray(board_ids, dtype=np.int64))
+        self.windows = list(windows)
+        shape = len(self.windows), len(self.board_ids), journals
+        self.counts = np.zeros(shape + (len(self.COLUMNS),), dtype=np.int64)
+
+    def add(self, pairs, article_ids, article_journals, article_dates=None):
+        """Count article/board combinations for their boards and journals.
+
+        pairs - article IDs, board IDs, and flags for the combinations
+                (see `combine()`)
+        article_ids - array of IDs for the articles on the report
+        article_journals - array of the position of each article's
+                           journal in the report's list of journals
+                           (-1 for journals which aren't reported)
+        article_dates - optional array of the articles' import dates
+                        (needed if there is more than one window)
+
+        The combinations are matched with their articles once, and a
+        combination is counted for each window its article falls in,
+        with a single `bincount()` for each column covering all of the
+        windows.
         """
-        No matter how many times we see a particular state for
-        this article/board combination, it gets mapped to a
-        single count when folding the values into the counts
-        for the article's journal.
+
+        articles, boards, flags = pairs
+        order = np.argsort(article_ids, kind="stable")
+        sorted_ids = np.asarray(article_ids)[order]
+        journals = np.asarray(article_journals, dtype=np.int64)[order]
+        a = self._find(sorted_ids, articles)
+        b = self._find(self.board_ids, boards)
+        keep = (a >= 0) & (b >= 0)
+        j = np.where(keep, journals[np.maximum(a, 0)], -1)
+        keep &= j >= 0
+        plane = self.counts.shape[1] * self.counts.shape[2]
+        groups = b[keep] * self.counts.shape[2] + j[keep]
+        flags = np.asarray(flags)[keep]
+        if article_dates is not None:
+            dates = np.asarray(article_dates)[order][a[keep]]
+            windows = []
+            for i, (first, last) in enumerate(self.windows):
+                inside = np.flatnonzero((dates >= first) & (dates <= last))
+                windows.append((i * plane + groups[inside], flags[inside]))
+            groups = np.concatenate([w[0] for w in windows])
+            flags = np.concatenate([w[1] for w in windows])
+        abstract_yes = (flags & self.ABSTRACT_YES) != 0
+        full_text_yes = (flags & self.FULL_TEXT_YES) != 0
+        ed_board_yes = (flags & self.ED_BOARD_YES) != 0
+        columns = (
+            np.ones(len(flags), dtype=bool),
+            abstract_yes,
+            ~abstract_yes & ((flags & self.ABSTRACT_NO) != 0),
+            full_text_yes,
+            ~full_text_yes & ((flags & self.FULL_TEXT_NO) != 0),
+            ed_board_yes,
+            ~ed_board_yes & ((flags & self.ED_BOARD_NO) != 0),
+        )
+        size = len(self.windows) * plane
+        for i, column in enumerate(columns):
+            counts = np.bincount(groups[column], minlength=size)
+            self.counts[..., i] += counts.reshape(self.counts.shape[:3])
+
+    @classmethod
+    def combine(cls, pair_articles, pair_boards, articles, boards, flags):
+        """Collect the flags for each article/board combination.
+
+        pair_articles - article IDs for the combinations
+        pair_boards - board IDs for the combinations
+        articles - article IDs for the state rows
+        boards - board IDs for the state rows
+        flags - flags for the state rows (see `state_flags()`)
+
+        Return a tuple of arrays of article IDs, board IDs, and flags,
+        with one entry for each distinct combination.
+        """
+
+        keys = np.unique(cls._key(pair_articles, pair_boards))
+        combined = np.zeros(len(keys), dtype=np.uint8)
+        positions = cls._find(keys, cls._key(articles, boards))
+        found = positions >= 0
+        positions, flags = positions[found], flags[found]
+        for bit in 1, 2, 4, 8, 16, 32:
+            combined[positions[(flags & bit) != 0]] |= bit
+        return keys >> 32, keys & 0xFFFFFFFF, combined
+
+    @classmethod
+    def state_flags(cls, states, ids, values, decided, rejected):
+        """Find the flag for each row for an article state.
+
+        states - `States` object for the state values we report on
+        ids - array of IDs for the article states
+        values - array of state value IDs for the article states
+        decided - array of IDs for the article states with decisions
+        rejected - array of IDs for the article states with a
+                   "Not cited" decision
+
+        Return an array of flags, one for each article state.
         """
 
-        counts.num_articles += 1
-        if self.abstract_yes:
-            counts.abstract_yes += 1
-        elif self.abstract_no:
-            counts.abstract_no += 1
-        if self.full_text_yes:
-            counts.full_text_yes += 1
-        elif self.full_text_no:
-            counts.full_text_no += 1
-        if self.ed_board_yes:
-            counts.ed_board_yes += 1
-        elif self.ed_board_no:
-            counts.ed_board_no += 1
-
-
-class Journal(Counts):
-    "Statistics for the articles in this journal considered by one board"
-
-    def __init__(self):
-        Counts.__init__(self)
-        self.num_articles = 0
-
-    def report(self, sheet, row, title):
-        "Write the statistics to a single row in a spreadsheet"
-
-        sheet.cell(row=row, column=1, value=title)
-        sheet.cell(row=row, column=2, value=self.num_articles)
-        sheet.cell(row=row, column=3, value=self.abstract_yes)
-        sheet.cell(row=row, column=4, value=self.abstract_no)
-        sheet.cell(row=row, column=5, value=self.full_text_yes)
-        sheet.cell(row=row, column=6, value=self.full_text_no)
-        sheet.cell(row=row, column=7, value=self.ed_board_yes)
-        sheet.cell(row=row, column=8, value=self.ed_board_no)
+        flags = np.zeros(len(ids), dtype=np.uint8)
+        for value, flag in (
+                (states.ABSTRACT_YES, cls.ABSTRACT_YES),
+                (states.ABSTRACT_NO, cls.ABSTRACT_NO),
+                (states.FULL_TEXT_YES, cls.FULL_TEXT_YES),
+                (states.FULL_TEXT_NO, cls.FULL_TEXT_NO)):
+            flags[values == value] = flag
+        final = values == states.FINAL_DECISION
+        flags[final & np.isin(ids, decided)] = cls.ED_BOARD_YES
+        flags[final & np.isin(ids, rejected)] = cls.ED_BOARD_NO
+        return flags
+
+    @staticmethod
+    def _find(keys, values):
+        "Positions of values in a sorted array of keys (-1 if missing)"
+
+        keys = np.asarray(keys)
+        values = np.asarray(values, dtype=keys.dtype)
+        if not len(keys):
+            return np.full(len(values), -1, dtype=np.int64)
+        positions = np.searchsorted(keys, values)
+        positions = np.minimum(positions, len(keys) - 1)
+        return np.where(keys[positions] == values, positions, -1)
+
+    @staticmethod
+    def _key(articles, boards):
+        "Single integer for each article/board combination"
+
+        articles = np.asarray(articles, dtype=np.uint64)
+        return articles << 32 | np.asarray(boards, dtype=np.uint64)
 
 
 class Board:
@@ -113,168 +653,550 @@ class Board:
         self.id = id
         self.name = name
         self.not_list = set()
-        self.articles = dict()
+        self.index = None
 
     def __lt__(self, other):
         return self.name < other.name
 
-    def add_sheet(self, book, control):
-        "Create a spreadsheet in one of the two report workbooks"
+    @property
+    def sheet_name(self):
+        "Title for the board's sheet in each of the report workbooks"
 
         if "Complementary" in self.name:
-            name = "IACT"
-        else:
-            name = self.name
-        sheet = book.create_sheet(title=name)
-        for row in sheet["A1:H1"]:
-            for cell in row:
-                cell.font = control.bold
-                cell.alignment = control.alignment
-        sheet.column_dimensions["A"].width = 60
-        sheet.cell(row=1, column=1, value="Journal Title")
-        sheet.cell(row=1, column=2, value="Total")
-        sheet.cell(row=1, column=3, value="Abstract Yes")
-        sheet.cell(row=1, column=4, value="Abstract No")
-        sheet.cell(row=1, column=5, value="Full-Text Yes")
-        sheet.cell(row=1, column=6, value="Full-Text No")
-        sheet.cell(row=1, column=7, value="Ed Board Yes")
-        sheet.cell(row=1, column=8, value="Ed Board No")
-        return sheet
+            return "IACT"
+        return self.name
 
-    def report(self, control):
-        """Create and populate two spreadsheet for this board's data.
+    def sheets(self, control, window=0):
+        """Collect the rows for this board's two spreadsheets.
 
-        control - access to the workbooks and style settings
+        control - access to the counts and the journals
+        window - index of the import date window for the counts
 
         One of the spreadsheets is for the statistical counts on the
         journals on the list of "don't bother with articles in this
         journal when working on this board's queue" (the "not" list),
         and the other sheet is for all the other journals.
+
+        Return a pair of sheets (for the not-listed journals and the
+        others), each a tuple of the sheet's title, a list of journal
+        titles, and an array of counts with a row for each journal.
         """
 
-        empty = Journal()
-        journals = dict()
-        for article_id in self.articles:
-            journal_id = control.articles[article_id]
-            if journal_id not in journals:
-                journals[journal_id] = Journal()
-            self.articles[article_id].map_counts(journals[journal_id])
-        not_listed = self.add_sheet(control.not_listed, control)
-        other = self.add_sheet(control.other, control)
-        not_listed_row = other_row = 2
-        for journal_id in control.journal_ids:
-            title = control.journals[journal_id]
-            journal = journals.get(journal_id, empty)
-            if journal.num_articles:
-                if journal_id in self.not_list:
-                    row = not_listed_row
-                    not_listed_row += 1
-                    sheet = not_listed
-                else:
-                    row = other_row
-                    other_row += 1
-                    sheet = other
-                journal.report(sheet, row, title)
+        counts = control.tally.counts[window, self.index]
+        indexes = np.flatnonzero(counts[:, 0])
+        ids = [control.journal_ids[index] for index in indexes.tolist()]
+        listed = np.array([id in self.not_list for id in ids], dtype=bool)
+        sheets = []
+        for wanted in listed, ~listed:
+            titles = itertools.compress(ids, wanted)
+            titles = [control.journals[id] for id in titles]
+            sheets.append((self.sheet_name, titles, counts[indexes[wanted]]))
         sys.stderr.write(f"board {self.name} reported\n")
+        return sheets
 
 
 class Control:
     """Top-level logic for the report."""
 
-    def __init__(self, directory):
+    BYTES_PER_ROW = 64
+    DECISIONS = [("state", "<u4"), ("rejected", "?")]
+    FINALS = [("id", "<u4"), ("article", "<u4"), ("board", "<u4")]
+    FLAGS = [("article", "<u4"), ("board", "<u4"), ("flags", "u1")]
+    PAIRS = [("article", "<u4"), ("board", "<u4")]
+    ARTICLES = [("id", "<u4"), ("journal", "<i8"), ("imported", "<u4")]
+
+    def __init__(self, directory, memory=None, windows=None):
         """Gather the values from the directory where they are cached.
 
         directory - string for the location of the cached data files.
+        memory - optional number of megabytes to keep the counting
+                 within (see `_count_in_partitions()`)
+        windows - optional sequence of first and last import dates
+                  (ISO strings) for separate reports on the articles
+                  imported in each window
         """
 
         self.directory = directory
-        self.states = States(directory)
+        self.windows = windows
+        snapshot = Snapshot(directory)
+        self.states = States(snapshot.rows("states"))
         self.boards = dict()
         self.journals = dict()
-        self.articles = dict()
-        self.decision_values = dict()
-        self.board_decisions = dict()
-        for line in open(f"{directory}/boards"):
-            board_id, name = json.loads(line.strip())
+        for board_id, name in snapshot.rows("boards"):
             self.boards[board_id] = Board(board_id, name)
         sys.stderr.write(f"loaded {len(self.boards):d} boards\n")
         count = 0
-        for line in open(f"{directory}/not_list"):
-            journal_id, board_id = json.loads(line.strip())
+        for journal_id, board_id in snapshot.rows("not_list"):
             self.boards[board_id].not_list.add(journal_id)
             count += 1
         sys.stderr.write(f"loaded {count:d} not-list directives\n")
-        for line in open(f"{directory}/journals"):
-            journal_id, journal_title = json.loads(line.strip())
+        for journal_id, journal_title in snapshot.rows("journals"):
             self.journals[journal_id] = journal_title
         sys.stderr.write(f"loaded {len(self.journals):d} journals\n")
-        for line in open(f"{directory}/articles"):
-            article_id, journal_id = json.loads(line.strip())
-            self.articles[article_id] = journal_id
-        sys.stderr.write(f"floaded {len(self.articles):d} articles\n")
-        count = 0
-        for line in open(f"{directory}/article_boards"):
-            article_id, board_id = json.loads(line.strip())
-            self.boards[board_id].articles[article_id] = Article(article_id)
-            count += 1
-        sys.stderr.write(f"loaded {count:d} article/board combos\n")
-        for line in open(f"{directory}/decision_values"):
-            value_id, value_name = json.loads(line.strip())
-            self.decision_values[value_id] = value_name
-        msg = f"loaded {len(self.decision_values):d} decision values\n"
-        sys.stderr.write(msg)
-        count = 0
-        for line in open(f"{directory}/board_decisions"):
-            article_state_id, decision_value_id = json.loads(line.strip())
-            decision_value = self.decision_values.get(decision_value_id)
-            if article_state_id not in self.board_decisions:
-                self.board_decisions[article_state_id] = set()
-            self.board_decisions[article_state_id].add(decision_value)
-            count += 1
-        sys.stderr.write(f"loaded {count:d} board decisions\n")
-        count = 0
-        for line in open(f"{directory}/article_states"):
-            values = json.loads(line.strip())
-            art_state_id, article_id, state_id, board_id = values
-            article = self.boards[board_id].articles[article_id]
-            if state_id == self.states.ABSTRACT_NO:
-                article.abstract_no += 1
-            elif state_id == self.states.ABSTRACT_YES:
-                article.abstract_yes += 1
-            elif state_id == self.states.FULL_TEXT_NO:
-                article.full_text_no += 1
-            elif state_id == self.states.FULL_TEXT_YES:
-                article.full_text_yes += 1
-            elif state_id == self.states.FINAL_DECISION:
-                board_decisions = self.board_decisions.get(art_state_id)
-                if board_decisions:
-                    if "Not cited" in board_decisions:
-                        article.ed_board_no += 1
-                    else:
-                        article.ed_board_yes += 1
-            count += 1
-            sys.stderr.write(f"\rloaded {count:d} article states")
-        sys.stderr.write("\n")
         self.journal_ids = list(self.journals.keys())
         self.journal_ids.sort(key=lambda k: self.journals[k])
+        self.not_cited = []
+        for value_id, value_name in snapshot.rows("decision_values"):
+            if value_name == "Not cited":
+                self.not_cited.append(value_id)
+        bounds = [Tally.EVERYTHING]
+        if windows:
+            bounds = [tuple(Snapshot.day(d) for d in w) for w in windows]
+        journals = len(self.journal_ids)
+        self.tally = Tally(list(self.boards), journals, bounds)
+        if memory:
+            self._count_in_partitions(snapshot, memory)
+        else:
+            self._count(snapshot)
+        for board in self.boards.values():
+            board.index = int(np.searchsorted(self.tally.board_ids, board.id))
         sys.stderr.write("data loaded\n")
 
-    def report(self):
-        """Generate two workbooks for the report (see Board.report())."""
+    def _count(self, snapshot):
+        """Count the articles for each board and journal all at once.
+
+        snapshot - `Snapshot` object for the captured data
+        """
+
+        if snapshot.grouped:
+            names = Snapshot.TABLES["pair_flags"]
+            pairs = [snapshot.column("pair_flags", name) for name in names]
+            sys.stderr.write(f"loaded {len(pairs[0]):d} article/board flags\n")
+            self._add(snapshot, pairs)
+            return
+        decided = snapshot.column("board_decisions", "article_state")
+        decisions = snapshot.column("board_decisions", "decision")
+        rejected = decided[np.isin(decisions, self.not_cited)]
+        sys.stderr.write(f"loaded {len(decided):d} board decisions\n")
+        ids = snapshot.column("article_states", "id")
+        values = snapshot.column("article_states", "state")
+        flags = Tally.state_flags(self.states, ids, values, decided, rejected)
+        pairs = Tally.combine(
+            snapshot.column("article_boards", "article"),
+            snapshot.column("article_boards", "board"),
+            snapshot.column("article_states", "article"),
+            snapshot.column("article_states", "board"),
+            flags,
+        )
+        sys.stderr.write(f"loaded {len(ids):d} article states\n")
+        sys.stderr.write(f"loaded {len(pairs[0]):d} article/board combos\n")
+        self._add(snapshot, pairs)
+
+    def _add(self, snapshot, pairs):
+        """Count the article/board combinations for the report.
+
+        snapshot - `Snapshot` object for the captured data
+        pairs - article IDs, board IDs, and flags for the combinations
+        """
+
+        article_ids = snapshot.column("articles", "id")
+        codes = snapshot.column("articles", "journal")
+        journals = self._journal_positions(snapshot)[codes]
+        dates = None
+        if self.windows:
+            dates = snapshot.column("articles", "imported")
+        sys.stderr.write(f"loaded {len(article_ids):d} articles\n")
+        self.tally.add(pairs, article_ids, journals, dates)
+
+    def _count_in_partitions(self, snapshot, memory):
+        """Count the articles a slice at a time, within a memory budget.
+
+        snapshot - `Snapshot` object for the captured data
+        memory - number of megabytes the counting should stay within
+
+        The big tables are read a chunk at a time, and their rows are
+        spilled to partition files on disk, so that the same counting
+        code used by `_count()` can be run on one partition at a time.
+        Only the article states for final board decisions need to be
+        matched with the decisions, so those are partitioned by the
+        ID of the article state first. After that, everything is
+        partitioned by article. The number of partitions is picked so
+        that the largest table's share fits in the budget, so memory
+        use depends on the budget instead of on the date range.
+        """
+
+        budget = memory * 1024 * 1024
+        chunk = max(1024, budget // self.BYTES_PER_ROW)
+        rows = max(snapshot.manifest["tables"].values())
+        partitions = max(1, -(-rows * self.BYTES_PER_ROW // budget))
+        msg = f"counting in {partitions:d} partitions of about {chunk:d} rows"
+        sys.stderr.write(f"{msg}\n")
+        states = self.states
+        journals = self._journal_positions(snapshot)
+        nothing = np.empty(0, dtype="<u4")
+        with tempfile.TemporaryDirectory(dir=self.directory) as spills:
+
+            def spill(name, dtype):
+                return Spill(spills, name, dtype, partitions)
+
+            decisions = spill("decisions", self.DECISIONS)
+            finals = spill("finals", self.FINALS)
+            flags = spill("flags", self.FLAGS)
+            pairs = spill("pairs", self.PAIRS)
+            articles = spill("articles", self.ARTICLES)
+            names = "article_state", "decision"
+            chunks = snapshot.chunks("board_decisions", names, chunk)
+            for ids, values in chunks:
+                rows = np.empty(len(ids), dtype=decisions.dtype)
+                rows["state"] = ids
+                rows["rejected"] = np.isin(values, self.not_cited)
+                decisions.add(ids, rows)
+            names = "id", "article", "state", "board"
+            count = 0
+            for columns in snapshot.chunks("article_states", names, chunk):
+                ids, article_ids, values, boards = columns
+                final = values == states.FINAL_DECISION
+                rows = np.empty(np.count_nonzero(final), dtype=finals.dtype)
+                rows["id"] = ids[final]
+                rows["article"] = article_ids[final]
+                rows["board"] = boards[final]
+                finals.add(rows["id"], rows)
+                other = ~final
+                values = values[other]
+                rows = np.empty(len(values), dtype=flags.dtype)
+                rows["article"] = article_ids[other]
+                rows["board"] = boards[other]
+                args = states, ids[other], values, nothing, nothing
+                rows["flags"] = Tally.state_flags(*args)
+                flags.add(rows["article"], rows)
+                count += len(ids)
+            sys.stderr.write(f"spilled {count:d} article states\n")
+            for partition in range(partitions):
+                decided = decisions.load(partition)
+                final = finals.load(partition)
+                values = np.full(len(final), states.FINAL_DECISION)
+                rejected = decided["state"][decided["rejected"]]
+                args = final["id"], values, decided["state"], rejected
+                rows = np.empty(len(final), dtype=flags.dtype)
+                rows["article"] = final["article"]
+                rows["board"] = final["board"]
+                rows["flags"] = Tally.state_flags(states, *args)
+                flags.add(rows["article"], rows)
+            if snapshot.grouped:
+                names = Snapshot.TABLES["pair_flags"]
+                chunks = snapshot.chunks("pair_flags", names, chunk)
+                for article_ids, boards, values in chunks:
+                    rows = np.empty(len(article_ids), dtype=flags.dtype)
+                    rows["article"] = article_ids
+                    rows["board"] = boards
+                    rows["flags"] = values
+                    flags.add(article_ids, rows)
+                    rows = np.empty(len(article_ids), dtype=pairs.dtype)
+                    rows["article"] = article_ids
+                    rows["board"] = boards
+                    pairs.add(article_ids, rows)
+            names = "article", "board"
+            chunks = snapshot.chunks("article_boards", names, chunk)
+            for article_ids, boards in chunks:
+                rows = np.empty(len(article_ids), dtype=pairs.dtype)
+                rows["article"] = article_ids
+                rows["board"] = boards
+                pairs.add(article_ids, rows)
+            names = ["id", "journal"]
+            if self.windows:
+                names.append("imported")
+            chunks = snapshot.chunks("articles", names, chunk)
+            for article_ids, codes, *dates in chunks:
+                rows = np.zeros(len(article_ids), dtype=articles.dtype)
+                rows["id"] = article_ids
+                rows["journal"] = journals[codes]
+                if dates:
+                    rows["imported"] = dates[0]
+                articles.add(article_ids, rows)
+            for partition in range(partitions):
+                combos = pairs.load(partition)
+                found = flags.load(partition)
+                combos = Tally.combine(
+                    combos["article"],
+                    combos["board"],
+                    found["article"],
+                    found["board"],
+                    found["flags"],
+                )
+                rows = articles.load(partition)
+                dates = rows["imported"] if self.windows else None
+                self.tally.add(combos, rows["id"], rows["journal"], dates)
+                sys.stderr.write(f"\rcounted partition {partition + 1:d}")
+            sys.stderr.write("\n")
+
+    def _journal_positions(self, snapshot):
+        """Map the snapshot's journal codes to positions on the report.
+
+        snapshot - `Snapshot` object for the captured data
+
+        Return an array of positions in `journal_ids` (-1 for journals
+        which aren't on the report), indexed by journal code.
+        """
+
+        positions = {id: i for i, id in enumerate(self.journal_ids)}
+        keys = snapshot.journal_keys
+        journals = [positions.get(key, -1) for key in keys]
+        return np.array(journals, dtype=np.int64)
+
+    def report(self, format="xlsx", workers=1):
+        """Generate two workbooks for the report (see Board.sheets()).
+
+        format - "xlsx" (the default), "csv", or "json"
+        workers - number of processes writing workbooks at once
+
+        If the report has import date windows, a pair of workbooks is
+        written for each window, with the window's dates added to the
+        names of the files.
+        """
+
+        books = dict()
+        for window, dates in enumerate(self.windows or [None]):
+            suffix = f"-{dates[0]}-{dates[1]}" if dates else ""
+            not_listed = books[f"not_listed{suffix}.{format}"] = []
+            other = books[f"not_not_listed{suffix}.{format}"] = []
+            for board in sorted(self.boards.values()):
+                sheets = board.sheets(self, window)
+                not_listed.append(sheets[0])
+                other.append(sheets[1])
+        write = WRITERS[format]
+        if workers < 2:
+            for name, sheets in books.items():
+                write(f"{self.directory}/{name}", sheets)
+            return
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+        with executor:
+            jobs = []
+            for name, sheets in books.items():
+                path = f"{self.directory}/{name}"
+                jobs.append(executor.submit(write, path, sheets))
+            for job in concurrent.futures.as_completed(jobs):
+                job.result()
+
+
+def write_xlsx(path, sheets):
+    """Write a report workbook as an Excel file.
+
+    path - where the workbook goes
+    sheets - sequence of sheets (see `Board.sheets()`)
+
+    The workbook is written in openpyxl's write-only mode, in which
+    rows are appended and streamed to the file, so memory doesn't
+    grow with the number of rows.
+    """
+
+    opts = dict(horizontal="center", vertical="center", wrap_text=True)
+    alignment = openpyxl.styles.Alignment(**opts)
+    bold = openpyxl.styles.Font(bold=True)
+    book = openpyxl.Workbook(write_only=True)
+    for name, titles, counts in sheets:
+        sheet = book.create_sheet(title=name)
+        sheet.column_dimensions["A"].width = 60
+        headers = []
+        for header in HEADERS:
+            cell = openpyxl.cell.WriteOnlyCell(sheet, value=header)
+            cell.font = bold
+            cell.alignment = alignment
+            headers.append(cell)
+        sheet.append(headers)
+        for title, values in zip(titles, counts.tolist()):
+            sheet.append([title] + values)
+    book.save(path)
+    sys.stderr.write(f"wrote {path}\n")
+
+
+def write_csv(path, sheets):
+    """Write a report workbook as a single CSV file.
+
+    path - where the file goes
+    sheets - sequence of sheets (see `Board.sheets()`)
+
+    The sheet title is added as the first column of each row.
+    """
+
+    with open(path, "w", newline="", encoding="utf-8") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(("Board",) + HEADERS)
+        for name, titles, counts in sheets:
+            for title, values in zip(titles, counts.tolist()):
+                writer.writerow([name, title] + values)
+    sys.stderr.write(f"wrote {path}\n")
+
+
+def write_json(path, sheets):
+    """Write a report workbook as a JSON object.
+
+    path - where the file goes
+    sheets - sequence of sheets (see `Board.sheets()`)
+
+    The object maps each sheet title to a list of objects, one for
+    each journal, keyed by the column headers.
+    """
+
+    book = dict()
+    for name, titles, counts in sheets:
+        rows = []
+        for title, values in zip(titles, counts.tolist()):
+            rows.append(dict(zip(HEADERS, [title] + values)))
+        book[name] = rows
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump(book, fp, indent=2)
+    sys.stderr.write(f"wrote {path}\n")
+
+
+HEADERS = ("Journal Title",) + Tally.COLUMNS
+WRITERS = dict(xlsx=write_xlsx, csv=write_csv, json=write_json)
+
+
+class ConnectionPool:
+    """Database connections shared by the threads fetching the data.
+
+    A connection is opened the first time a thread needs one and none
+    is idle, so there are never more of them than there are threads.
+    """
+
+    def __init__(self, opts):
+        """Remember how to connect (and ask for the password once).
+
+        opts - runtime options for the script
+        """
+
+        self.opts = opts
+        self.password = getpass.getpass(f"password for {opts.user}: ")
+        self.idle = queue.Queue()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def cursor(self):
+        "Unbuffered cursor for a connection no other thread is using"
+
+        import pymysql.cursors
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        "Close all of the connections"
 
-        opts = dict(horizontal="center", vertical="center", wrap_text=True)
-        self.alignment = openpyxl.styles.Alignment(**opts)
-        self.bold = openpyxl.styles.Font(bold=True)
-        self.not_listed = openpyxl.Workbook()
-        self.other = openpyxl.Workbook()
-        for sheet in self.not_listed.worksheets:
-            self.not_listed.remove(sheet)
-        for sheet in self.other.worksheets:
-            self.other.remove(sheet)
-        for board in sorted(self.boards.values()):
-            board.report(self)
-        self.not_listed.save(f"{self.directory}/not_listed.xlsx")
-        self.other.save(f"{self.directory}/not_not_listed.xlsx")
+        for conn in self.connections:
+            conn.close()
+
+    def _connect(self):
+        "Open a new connection"
+
+        import pymysql
+        conn = pymysql.connect(
+            host=self.opts.host,
+            port=self.opts.port,
+            user=self.opts.user,
+            passwd=self.password,
+            db=self.opts.db,
+        )
+        cursor = conn.cursor()
+        cursor.execute("SET NAMES utf8")
+        cursor.execute(f"USE {self.opts.db}")
+        cursor.close()
+        with self.lock:
+            self.connections.append(conn)
+        return conn
+
+
+class SnapshotStore:
+    """Snapshots kept from one run to the next (see `fetch()`).
+
+    Each capture goes into a new subdirectory of the store, and the
+    `latest` symbolic link is switched to it once it is complete, so
+    an interrupted run leaves the previous snapshot in place. The
+    data files of the snapshot which is replaced are removed, but
+    the reports written alongside them are kept.
+    """
+
+    LATEST = "latest"
+
+    def __init__(self, directory):
+        """Remember where the store is (creating it if necessary).
+
+        directory - location of the store
+        """
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def previous(self):
+        "The most recent complete `Snapshot` in the store (or None)"
+
+        path = f"{self.directory}/{self.LATEST}"
+        if not os.path.exists(path):
+            return None
+        snapshot = Snapshot(os.path.realpath(path))
+        return snapshot if snapshot.columnar else None
+
+    def create(self):
+        "Make a new subdirectory for a capture and return its path"
+
+        name = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        path = f"{self.directory}/{name}"
+        os.mkdir(path)
+        return path
+
+    def publish(self, path):
+        """Make a completed capture the store's latest snapshot.
+
+        path - location of the new snapshot
+        """
+
+        link = f"{self.directory}/{self.LATEST}"
+        old = os.path.realpath(link) if os.path.islink(link) else None
+        if os.path.lexists(f"{link}.new"):
+            os.remove(f"{link}.new")
+        os.symlink(os.path.basename(path), f"{link}.new")
+        os.replace(f"{link}.new", link)
+        if old and old != os.path.realpath(path):
+            prefixes = tuple(f"{table}." for table in Snapshot.TABLES)
+            names = Snapshot.MANIFEST, "journal_keys.json"
+            for name in os.listdir(old):
+                if name.startswith(prefixes) or name in names:
+                    os.remove(f"{old}/{name}")
+            if not os.listdir(old):
+                os.rmdir(old)
+
+
+def carry_over(previous, writer, touched):
+    """Copy the rows which are still current from the previous snapshot.
+
+    previous - `Snapshot` captured by an earlier run
+    writer - `SnapshotWriter` for the new snapshot
+    touched - array of IDs for articles whose rows are being fetched
+              again because they have new states
+
+    Return the number of articles carried over.
+    """
+
+    names = Snapshot.TABLES["articles"]
+    columns = [previous.column("articles", name) for name in names]
+    keep = ~np.isin(columns[0], touched)
+    columns = [column[keep] for column in columns]
+    writer.extend("articles", columns, previous.journal_keys)
+    for table in "article_boards", "pair_flags":
+        names = Snapshot.TABLES[table]
+        columns = [previous.column(table, name) for name in names]
+        keep = ~np.isin(columns[0], touched)
+        writer.extend(table, [column[keep] for column in columns])
+    names = Snapshot.TABLES["article_states"]
+    columns = [previous.column("article_states", name) for name in names]
+    keep = ~np.isin(columns[1], touched)
+    writer.extend("article_states", [column[keep] for column in columns])
+    dropped = columns[0][~keep]
+    names = Snapshot.TABLES["board_decisions"]
+    columns = [previous.column("board_decisions", name) for name in names]
+    keep = ~np.isin(columns[0], dropped)
+    writer.extend("board_decisions", [column[keep] for column in columns])
+    return writer.rows["articles"]
 
 
 def fetch(opts):
@@ -287,126 +1209,209 @@ def fetch(opts):
     object, without having to spend time talking to the database all
     over again (which is the lengthier part of the job by quite a bit).
 
+    The database does the filtering (by article import date and state
+    value), and the results are streamed from an unbuffered cursor,
+    so only the rows we keep cross the wire, and they never pile up
+    in the client. With the `--grouped` option, the database also
+    collapses the article states and board decisions into a single
+    set of flags for each article/board combination (see `Tally`).
+
+    None of the queries depends on the results of another one, except
+    that the queries for the article states need the IDs of the state
+    and decision values. So the queries are run at the same time, on
+    separate connections (`--connections` of them at most), and each
+    thread writes its own table's files. The wall-clock time is set
+    by the slowest query, rather than by the sum of all of them.
+
+    With the `--store` option, the snapshot is kept in a persistent
+    store (see `SnapshotStore`), and its manifest records the highest
+    `ebms_state` ID when the data was captured. When the next run
+    covers the same start date (and an end date at least as late),
+    only the articles imported after the stored range, and articles
+    which have been given states since the last capture, are fetched.
+    The stored rows for all other articles are carried over. Setting
+    a new state is the only way a state gets inactivated, so the
+    rows for an article don't change unless it has a new state. The
+    small lookup tables are always fetched in full.
+
     Return the name of the directory where the values are stored.
     """
 
-    import pymysql
-    where = str(datetime.date.today()).replace("-", "")
-    try:
-        os.mkdir(where)
-    except Exception as e:
-        print(f"{where}: {e}")
-        raise
-    start = opts["start"]
-    end = opts["end"] + " 23:59:59"
-    del opts["start"]
-    del opts["end"]
-    opts["passwd"] = getpass.getpass(f"password for {opts['user']}: ")
-    conn = pymysql.connect(**opts)
-    cursor = conn.cursor()
-    cursor.execute("SET NAMES utf8")
-    cursor.execute(f"USE {opts['db']}")
-    cursor.execute("SELECT id, name FROM ebms_board WHERE active = 1")
-    with open(f"{where}/boards", "w", encoding="utf-8") as fp:
-        rows = cursor.fetchall()
-        for row in rows:
-            fp.write(f"{json.dumps(tuple(row))}\n")
-    sys.stderr.write(f"fetched {len(rows):d} boards\n")
-    cursor.execute("""\
-SELECT j.source_id, n.not_lists_board
-  FROM ebms_journal j
-  JOIN ebms_journal__not_lists n
-    ON n.entity_id = j.id
- WHERE n.not_lists_start <= NOW()""")
-    rows = cursor.fetchall()
-    with open(f"{where}/not_list", "w", encoding="utf-8") as fp:
-        for row in rows:
-            fp.write(f"{json.dumps(tuple(row))}\n")
-    sys.stderr.write(f"fetched {len(rows):d} not-list rows\n")
-    cursor.execute("SELECT source_id, title from ebms_journal")
-    rows = cursor.fetchall()
-    with open(f"{where}/journals", "w") as fp:
-        for row in rows:
-            fp.write(f"{json.dumps(tuple(row))}\n")
-    sys.stderr.write(f"fetched {len(rows):d} journals\n")
-    cursor.execute("""\
-SELECT id, source_journal_id FROM ebms_article
- WHERE import_date BETWEEN %s AND %s""", (start, end))
-    articles = set()
-    with open(f"{where}/articles", "w", encoding="utf-8") as fp:
-        count = 0
-        row = cursor.fetchone()
-        while row:
-            articles.add(row[0])
-            fp.write(f"{json.dumps(tuple(row))}\n")
-            row = cursor.fetchone()
-            count += 1
-    sys.stderr.write(f"fetched {count:d} articles\n")
-    cursor.execute("""\
-SELECT entity_id, field_text_id_value
-  FROM taxonomy_term__field_text_id
- WHERE bundle = 'states'""")
-    with open(f"{where}/states", "w", encoding="utf-8") as fp:
-        rows = cursor.fetchall()
-        for row in rows:
-            fp.write(f"{json.dumps(tuple(row))}\n")
-    sys.stderr.write(f"fetched {len(rows):d} states\n")
-    states = States(where)
-    cursor.execute("""\
-SELECT DISTINCT article, board
-           FROM ebms_state
-          WHERE active = 1""")
-    with open(f"{where}/article_boards", "w", encoding="utf-8") as fp:
-        count = 0
-        row = cursor.fetchone()
-        while row:
-            if row[0] in articles:
-                fp.write(f"{json.dumps(tuple(row))}\n")
-                count += 1
-            row = cursor.fetchone()
-    sys.stderr.write(f"fetched {count:d} article boards\n")
-    wanted = ",".join([str(w) for w in states.wanted])
-    cursor.execute(f"""\
-SELECT id, article, value, board
+    store = previous = None
+    if opts.store:
+        store = SnapshotStore(opts.store)
+        previous = store.previous
+        where = store.create()
+    else:
+        where = str(datetime.date.today()).replace("-", "")
+        try:
+            os.mkdir(where)
+        except Exception as e:
+            print(f"{where}: {e}")
+            raise
+    if previous is not None:
+        manifest = previous.manifest
+        marks = manifest.get("marks", {})
+        if manifest["start"] != opts.start or manifest["end"] > opts.end \
+                or manifest["format"] != Snapshot.FORMAT \
+                or marks.get("grouped") != opts.grouped \
+                or "state_id" not in marks:
+            sys.stderr.write("stored snapshot doesn't match the options; "
+                             "fetching everything\n")
+            previous = None
+    dates = opts.start, opts.end + " 23:59:59"
+    pool = ConnectionPool(opts)
+    with pool.cursor() as cursor:
+        cursor.execute("SELECT MAX(id) FROM ebms_state")
+        state_id = cursor.fetchone()[0] or 0
+    marks = dict(state_id=state_id, grouped=opts.grouped)
+    writer = SnapshotWriter(where, opts.start, opts.end, marks)
+    scope = "a.import_date BETWEEN %s AND %s"
+    args = dates
+    if previous is not None:
+        since = previous.manifest["marks"]["state_id"]
+        with pool.cursor() as cursor:
+            cursor.execute("""\
+SELECT DISTINCT article
   FROM ebms_state
- WHERE active = 1
-   AND value IN ({wanted})""")
-    article_state_ids = set()
-    with open(f"{where}/article_states", "w", encoding="utf-8") as fp:
-        row = cursor.fetchone()
+ WHERE id > %s
+   AND id <= %s""", (since, state_id))
+            touched = np.array([row[0] for row in cursor], dtype=np.int64)
+        count = carry_over(previous, writer, touched)
+        sys.stderr.write(f"carried over {count:d} articles\n")
+        scope += """
+   AND (a.import_date > %s
+        OR a.id IN (SELECT article FROM ebms_state
+                     WHERE id > %s AND id <= %s))"""
+        args = dates + (previous.manifest["end"] + " 23:59:59",
+                        since, state_id)
+
+    def store_rows(table, query, args=None, keep=False):
+        rows = []
         count = 0
-        while row:
-            if row[1] in articles:
-                fp.write(f"{json.dumps(tuple(row))}\n")
+        with pool.cursor() as cursor:
+            cursor.execute(query, args)
+            for row in cursor:
+                writer.add(table, row)
+                if keep:
+                    rows.append(row)
                 count += 1
-                article_state_ids.add(row[0])
-            row = cursor.fetchone()
-    sys.stderr.write(f"fetched {count:d} article states\n")
-    cursor.execute("""\
+        sys.stderr.write(f"fetched {count:d} {table} rows\n")
+        return rows
+
+    workers = concurrent.futures.ThreadPoolExecutor(opts.connections)
+    with workers:
+        states = workers.submit(store_rows, "states", """\
+SELECT entity_id, field_text_id_value
+  FROM taxonomy_term__field_text_id
+ WHERE bundle = 'states'""", keep=True)
+        values = workers.submit(store_rows, "decision_values", """\
 SELECT tid, name
   FROM taxonomy_term_field_data
  WHERE vid = 'board_decisions'
-   AND status = 1""")
-    rows = cursor.fetchall()
-    with open(f"{where}/decision_values", "w", encoding="utf-8") as fp:
-        for row in rows:
-            fp.write(f"{json.dumps(tuple(row))}\n")
-    sys.stderr.write(f"fetched {len(rows):d} decision values\n")
-    cursor.execute("""\
-SELECT entity_id, decisions_decision
-  FROM ebms_state__decisions""")
-    row = cursor.fetchone()
-    count = 0
-    with open(f"{where}/board_decisions", "w", encoding="utf-8") as fp:
-        while row:
-            if row[0] in article_state_ids:
-                fp.write(f"{json.dumps(tuple(row))}\n")
-                count += 1
-            row = cursor.fetchone()
-    sys.stderr.write(f"fetched {count:d} board decisions\n")
+   AND status = 1""", keep=True)
+        jobs = [
+            workers.submit(store_rows, "articles", f"""\
+SELECT a.id, a.source_journal_id, a.import_date
+  FROM ebms_article a
+ WHERE {scope}""", args),
+            workers.submit(store_rows, "boards", """\
+SELECT id, name FROM ebms_board WHERE active = 1"""),
+            workers.submit(store_rows, "not_list", """\
+SELECT j.source_id, n.not_lists_board
+  FROM ebms_journal j
+  JOIN ebms_journal__not_lists n
+    ON n.entity_id = j.id
+ WHERE n.not_lists_start <= NOW()"""),
+            workers.submit(store_rows, "journals", """\
+SELECT source_id, title from ebms_journal"""),
+        ]
+        states = States(states.result())
+        not_cited = [str(row[0]) for row in values.result()
+                     if row[1] == "Not cited"]
+        wanted = ",".join([str(w) for w in states.wanted])
+        if opts.grouped:
+            rejections = ",".join(not_cited) or "NULL"
+            jobs.append(workers.submit(store_rows, "pair_flags", f"""\
+SELECT s.article, s.board,
+       BIT_OR(CASE s.value
+                WHEN {states.ABSTRACT_YES} THEN {Tally.ABSTRACT_YES}
+                WHEN {states.ABSTRACT_NO} THEN {Tally.ABSTRACT_NO}
+                WHEN {states.FULL_TEXT_YES} THEN {Tally.FULL_TEXT_YES}
+                WHEN {states.FULL_TEXT_NO} THEN {Tally.FULL_TEXT_NO}
+                WHEN {states.FINAL_DECISION} THEN
+                  CASE
+                    WHEN d.rejected > 0 THEN {Tally.ED_BOARD_NO}
+                    WHEN d.decisions > 0 THEN {Tally.ED_BOARD_YES}
+                    ELSE 0
+                  END
+                ELSE 0
+              END)
+  FROM ebms_state s
+  JOIN ebms_article a
+    ON a.id = s.article
+  LEFT JOIN (SELECT entity_id, COUNT(*) AS decisions,
+                    SUM(decisions_decision IN ({rejections})) AS rejected
+               FROM ebms_state__decisions
+           GROUP BY entity_id) d
+    ON d.entity_id = s.id
+ WHERE s.active = 1
+   AND {scope}
+ GROUP BY s.article, s.board""", args))
+        else:
+            jobs.append(workers.submit(store_rows, "article_boards", f"""\
+SELECT DISTINCT s.article, s.board
+           FROM ebms_state s
+           JOIN ebms_article a
+             ON a.id = s.article
+          WHERE s.active = 1
+            AND {scope}""", args))
+            jobs.append(workers.submit(store_rows, "article_states", f"""\
+SELECT s.id, s.article, s.value, s.board
+  FROM ebms_state s
+  JOIN ebms_article a
+    ON a.id = s.article
+ WHERE s.active = 1
+   AND s.value IN ({wanted})
+   AND {scope}""", args))
+            jobs.append(workers.submit(store_rows, "board_decisions", f"""\
+SELECT d.entity_id, d.decisions_decision
+  FROM ebms_state__decisions d
+  JOIN ebms_state s
+    ON s.id = d.entity_id
+  JOIN ebms_article a
+    ON a.id = s.article
+ WHERE s.active = 1
+   AND s.value IN ({wanted})
+   AND {scope}""", args))
+        for job in concurrent.futures.as_completed(jobs):
+            job.result()
+    pool.close()
+    writer.close()
+    if store is not None:
+        store.publish(where)
     return where
 
 
+def window(value):
+    """Parse a window of import dates for the `--window` option.
+
+    value - first and last dates, separated by a colon
+
+    Return a tuple of the two dates (as ISO strings).
+    """
+
+    try:
+        first, last = value.split(":")
+        first = datetime.date.fromisoformat(first)
+        last = datetime.date.fromisoformat(last)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not FIRST:LAST")
+    if first > last:
+        raise argparse.ArgumentTypeError(f"{value!r} ends before it starts")
+    return str(first), str(last)
+
+
 def main():
     """Collect runtime options and generate the report."""
 
@@ -419,15 +1424,40 @@ def main():
     parser.add_argument("--user", default="ebms")
     parser.add_argument("--start", default="2022-07-01")
     parser.add_argument("--end", default="2023-07-01")
+    parser.add_argument("--convert", action="store_true",
+                        help="rewrite a JSON-lines --path in columns")
+    parser.add_argument("--memory", type=int, metavar="MB",
+                        help="count in partitions within this budget")
+    parser.add_argument("--grouped", action="store_true",
+                        help="have the database combine the states")
+    parser.add_argument("--connections", type=int, default=4, metavar="N",
+                        help="most queries to run at the same time")
+    parser.add_argument("--store", metavar="DIR",
+                        help="keep snapshots here and fetch only changes")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="xlsx")
+    parser.add_argument("--workers", type=int, default=2, metavar="N",
+                        help="most workbooks to write at the same time")
+    parser.add_argument("--window", type=window, action="append",
+                        metavar="FIRST:LAST", dest="windows",
+                        help="report separately on articles imported in "
+                             "this range of dates (repeatable)")
     opts = parser.parse_args()
+    if opts.windows:
+        opts.start = min(first for first, last in opts.windows)
+        opts.end = max(last for first, last in opts.windows)
     if opts.path:
         path = opts.path
+        if opts.convert:
+            Snapshot(path).convert()
     else:
-        opts = vars(opts)
-        del opts["path"]
         path = fetch(opts)
-    control = Control(path)
-    control.report()
+    snapshot = Snapshot(path)
+    if opts.memory and not snapshot.columnar:
+        parser.error("--memory needs a columnar snapshot (use --convert)")
+    if opts.windows and not snapshot.column("articles", "imported").any():
+        parser.error("--window needs a snapshot with article import dates")
+    control = Control(path, opts.memory, opts.windows)
+    control.report(opts.format, opts.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""Tests for `scheduled/update-pubmed-data.py`, run against the stand-in.
+
+Each test gets a fresh stand-in server (`scripts/eutils-stand-in.py`)
+and a fresh (temporary) root directory for the updater's logs and
+state files.
+
+Example:
+
+    python3 -m unittest scripts/test_update_pubmed_data.py
+"""
+
+from importlib.util import module_from_spec, spec_from_file_location
+from json import loads
+from pathlib import Path
+from subprocess import PIPE, Popen
+from sys import executable
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from unittest.mock import patch
+from urllib.request import urlopen
+
+HERE = Path(__file__).parent
+UPDATER = HERE.parent / "scheduled/update-pubmed-data.py"
+STAND_IN = HERE / "eutils-stand-in.py"
+REPORT = "logs/update-pubmed-data.report.json"
+spec = spec_from_file_location("update_pubmed_data", UPDATER)
+updater = module_from_spec(spec)
+spec.loader.exec_module(updater)
+
+
+class StandInTest(TestCase):
+    """Base class for tests which run the updater against the stand-in."""
+
+    ARTICLES = 20000
+    SERVER_ARGS = ()
+
+    def setUp(self):
+        """Start the stand-in server and make a root directory."""
+
+        args = executable, str(STAND_IN), "--articles", str(self.ARTICLES)
+        args += self.SERVER_ARGS
+        self.server = Popen(args, stdout=PIPE, text=True)
+        self.url = self.server.stdout.readline().split()[-1]
+        self.root = TemporaryDirectory()
+        (Path(self.root.name) / "logs").mkdir()
+
+    def tearDown(self):
+        """Stop the server and clean up the root directory."""
+
+        self.server.terminate()
+        self.server.wait()
+        self.server.stdout.close()
+        self.root.cleanup()
+
+    def stats(self):
+        """Find out how many requests the stand-in has handled."""
+
+        with urlopen(f"{self.url}/stats") as response:
+            return loads(response.read())
+
+    def argv(self, *extra):
+        """Command line for the updater, pointed at the stand-in."""
+
+        return [
+            str(UPDATER),
+            "--root", self.root.name,
+            "--base-url", self.url,
+            "--eutils-url", self.url,
+            "--requests-per-second", "1000",
+            *extra,
+        ]
+
+
+class DaemonTest(StandInTest):
+    """Check the cycles of the updater's `--daemon` mode."""
+
+    def test_cycle_metrics(self):
+        """Each cycle's report should count that cycle's NLM requests."""
+
+        with patch("sys.argv", self.argv("--daemon")):
+            control = updater.Control()
+            before = self.stats()
+            for cycle in 1, 2:
+                control._start_cycle()
+                self.assertTrue(control._run())
+                after = self.stats()
+                report = loads((Path(self.root.name) / REPORT).read_text())
+                for stage in "esearch", "efetch":
+                    path = f"/{stage}.fcgi"
+                    sent = after.get(path, 0) - before.get(path, 0)
+                    requests = report["stages"][stage]["requests"]
+                    self.assertGreater(sent, 0)
+                    self.assertEqual(requests, sent, f"cycle {cycle}")
+                before = after
+
+    def test_window_limit(self):
+        """A window too big for one search should be searched in batches."""
+
+        found = []
+        for limit in updater.Control.HISTORY_LIMIT, 100:
+            with patch("sys.argv", self.argv("--daemon")):
+                with patch.object(updater.Control, "HISTORY_LIMIT", limit):
+                    control = updater.Control()
+                    control._start_cycle()
+                    window = control.window
+                    self.assertTrue(control._run())
+                    found.append(control.recently_changed_articles)
+            logs = Path(self.root.name) / "logs"
+            (logs / "update-pubmed-data.watermark").unlink()
+        self.assertIsNone(window)
+        self.assertGreater(len(found[0]), 100)
+        self.assertEqual(found[0], found[1])
+
+
+class RejectedTest(StandInTest):
+    """Check that articles the site rejects are submitted again."""
+
+    SERVER_ARGS = "--rejected", "10"
+
+    def test_resubmit(self):
+        """Rejected articles should be saved, and resubmitted next time."""
+
+        path = Path(self.root.name) / "logs/update-pubmed-data.failed.json"
+        with patch("sys.argv", self.argv()):
+            control = updater.Control()
+            self.assertTrue(control._run())
+            failed = loads(path.read_text())
+            self.assertTrue(failed)
+            self.assertEqual(set(failed.values()), {1})
+            # The next window finds nothing, but the rejects go again.
+            control = updater.Control()
+            control.__dict__["scan"] = set(), set()
+            self.assertTrue(control._run())
+            self.assertFalse(path.exists())
+            self.assertEqual(control.journal.refreshed, set(failed))
+
+
+if __name__ == "__main__":
+    main()
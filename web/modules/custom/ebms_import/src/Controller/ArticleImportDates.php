@@ -4,13 +4,32 @@
 
 use Drupal\Core\Controller\ControllerBase;
 use Symfony\Component\DependencyInjection\ContainerInterface;
+use Symfony\Component\HttpFoundation\Response;
 use Symfony\Component\HttpFoundation\StreamedResponse;
 
 /**
  * List of when each article was last imported, refreshed, or checked.
+ *
+ * The scheduled PubMed update job keeps a copy of this list from one run
+ * to the next, so we support conditional requests (using an ETag derived
+ * from the article dates), requests for only the rows which have changed
+ * on or after a given date (`since`), and gzip compression of the
+ * response.
  */
 class ArticleImportDates extends ControllerBase {
 
+  /**
+   * Number of bytes to accumulate before compressing and sending them.
+   */
+  const CHUNK_SIZE = 65536;
+
+  /**
+   * The current page request.
+   *
+   * @var \Symfony\Component\HttpFoundation\Request
+   */
+  protected $currentRequest;
+
   /**
    * Database connection.
    *
@@ -24,6 +43,7 @@ class ArticleImportDates extends ControllerBase {
   public static function create(ContainerInterface $container): ArticleImportDates {
     // Instantiates this form class.
     $instance = parent::create($container);
+    $instance->currentRequest = $container->get('request_stack')->getCurrentRequest();
     $instance->database = $container->get('database');
     return $instance;
   }
@@ -31,31 +51,106 @@ public static function create(ContainerInterface $container): ArticleImportDates
   /**
    * Return a plain-text response.
    */
-  public function list(): StreamedResponse {
+  public function list(): Response {
+
+    // Don't send anything if the caller's copy is still current.
+    $etag = $this->getEtag();
+    $if_none_match = $this->currentRequest->headers->get('If-None-Match');
+    if (!empty($if_none_match) && $if_none_match === $etag) {
+      ebms_debug_log('article dates unchanged');
+      $response = new Response('', Response::HTTP_NOT_MODIFIED);
+      $response->headers->set('ETag', $etag);
+      return $response;
+    }
+
+    // Tell the caller what to ask for next time.
+    $as_of = date('Y-m-d');
+    $since = $this->currentRequest->query->get('since', '');
+    if (!empty($since) && !preg_match('/^\d{4}-\d\d-\d\d$/', $since)) {
+      return new Response("Invalid since parameter.\n", Response::HTTP_BAD_REQUEST);
+    }
+    $accept = $this->currentRequest->headers->get('Accept-Encoding', '');
+    $gzip = str_contains($accept, 'gzip');
     $response = new StreamedResponse();
     $response->headers->set('Content-type', 'text/plain');
-    $response->setCallback(function () {
+    $response->headers->set('ETag', $etag);
+    $response->headers->set('X-Dates-As-Of', $as_of);
+    $response->headers->set('Vary', 'Accept-Encoding');
+    if ($gzip) {
+      $response->headers->set('Content-Encoding', 'gzip');
+    }
+    $response->setCallback(function () use ($since, $gzip) {
       $query = $this->database->select('ebms_article', 'article');
       $query->fields('article', [
         'id', 'source_id', 'import_date', 'update_date', 'data_checked'
       ]);
+      if (!empty($since)) {
+
+        // The stored values don't all use the same format for the time
+        // of day, so we compare dates only. That can give the caller a
+        // few rows it already has, but it never misses a change.
+        $group = $query->orConditionGroup()
+          ->condition('article.import_date', $since, '>=')
+          ->condition('article.update_date', $since, '>=')
+          ->condition('article.data_checked', $since, '>=');
+        $query->condition($group);
+      }
       $query->distinct();
+
+      // The update job can store the rows as they arrive if they come in
+      // PubMed ID order. The IDs are strings, so shorter ones go first.
+      $query->addExpression('LENGTH(article.source_id)', 'source_id_length');
+      $query->orderBy('source_id_length');
+      $query->orderBy('article.source_id');
       $query->orderBy('article.id');
       $results = $query->execute();
-      ebms_debug_log('streaming rows');
+      ebms_debug_log('streaming rows' . ($since ? " changed since $since" : ''));
+      $context = $gzip ? deflate_init(ZLIB_ENCODING_GZIP) : NULL;
+      $buffer = '';
       $count = 0;
       foreach ($results as $result) {
         $date = $result->update_date ?: $result->import_date;
         if (!empty($result->data_checked) && $result->data_checked > $date) {
           $date = $result->data_checked;
         }
-        echo "{$result->id}\t{$result->source_id}\t{$date}\n";
-        flush();
+        $buffer .= "{$result->id}\t{$result->source_id}\t{$date}\n";
+        if (strlen($buffer) >= self::CHUNK_SIZE) {
+          echo $gzip ? deflate_add($context, $buffer, ZLIB_NO_FLUSH) : $buffer;
+          flush();
+          $buffer = '';
+        }
         $count++;
       }
+      echo $gzip ? deflate_add($context, $buffer, ZLIB_FINISH) : $buffer;
+      flush();
       ebms_debug_log("finished streaming $count rows");
     });
     return $response;
   }
 
+  /**
+   * Create a tag which changes when the list of dates changes.
+   *
+   * We use aggregate values which can be computed cheaply (and portably)
+   * by the database. It's possible for a row's date to move forward
+   * without changing any of these values, but the dates only ever move
+   * forward, so the worst that can happen is that the caller treats an
+   * article as stale and has it refreshed unnecessarily. The caller
+   * keeps its old as-of date when it gets a 304 response, so the change
+   * will be picked up the next time the table changes.
+   *
+   * @return string
+   *   Quoted hash of the aggregate values for the article dates.
+   */
+  private function getEtag(): string {
+    $query = $this->database->select('ebms_article', 'article');
+    $query->addExpression('COUNT(*)', 'articles');
+    $query->addExpression('MAX(article.id)', 'max_id');
+    $query->addExpression('MAX(article.import_date)', 'imported');
+    $query->addExpression('MAX(article.update_date)', 'updated');
+    $query->addExpression('MAX(article.data_checked)', 'checked');
+    $values = $query->execute()->fetchAssoc() ?: [];
+    return '"' . md5(implode('|', $values)) . '"';
+  }
+
 }
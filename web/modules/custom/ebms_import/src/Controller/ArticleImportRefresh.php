@@ -3,8 +3,10 @@
 namespace Drupal\ebms_import\Controller;
 
 use Drupal\Core\Controller\ControllerBase;
+use Drupal\Core\Site\Settings;
 use Drupal\ebms_import\Entity\Batch;
 use Symfony\Component\DependencyInjection\ContainerInterface;
+use Symfony\Component\HttpFoundation\JsonResponse;
 use Symfony\Component\HttpFoundation\Response;
 
 /**
@@ -40,12 +42,20 @@ public static function create(ContainerInterface $container): ArticleImportRefre
   }
 
   /**
-   * Return a plain-text response.
+   * Return a plain-text response (or JSON values, if requested).
+   *
+   * If the `format` parameter is `json`, the response also carries the
+   * number of articles refreshed, replaced with changed XML, left
+   * unchanged, and rejected with errors (along with the PubMed IDs of
+   * the rejected articles), so the caller can keep track of the results
+   * for each batch it submits.
    */
   public function run(): Response {
 
     // Remember when we started so we can report the elapsed time.
     $start = microtime(TRUE);
+    $counts = [];
+    $success = TRUE;
     try {
 
       // Get the PubMed IDs.
@@ -68,10 +78,15 @@ public function run(): Response {
           'article-ids' => $pmids,
           'import-comments' => self::COMMENT,
         ];
+        $xml = $this->getUploadedXml();
+        if (!empty($xml)) {
+          $request['article-xml'] = $xml;
+        }
         $batch = Batch::process($request);
 
         // Check for failure.
         if (empty($batch->success->value)) {
+          $success = FALSE;
           if ($batch->messages->count() < 1) {
             $report = 'Import of fresh XML failed for unspecified reasons.';
           }
@@ -86,20 +101,40 @@ public function run(): Response {
 
         // Find out how many we updated.
         else {
-          $imported = [];
+          $imported = $replaced = $failed = [];
           $storage = $this->entityTypeManager()->getStorage('taxonomy_term');
           $query = $storage->getQuery()->accessCheck(FALSE);
           $query->condition('vid', 'import_dispositions');
-          $query->condition('field_text_id', 'error');
-          $ids = $query->execute();
-          $error_id = reset($ids);
+          $dispositions = [];
+          foreach ($storage->loadMultiple($query->execute()) as $term) {
+            $dispositions[$term->id()] = $term->field_text_id->value;
+          }
           foreach ($batch->actions as $action) {
-            if ($action->disposition != $error_id && !empty($action->article)) {
+            $disposition = $dispositions[$action->disposition] ?? '';
+            if ($disposition === 'error') {
+              $failed[$action->source_id] = 1;
+            }
+            elseif (!empty($action->article)) {
               $imported[$action->article] = 1;
+              if ($disposition === 'replaced') {
+                $replaced[$action->article] = 1;
+              }
             }
           }
           $count = count($imported);
           $report = "Refreshed $count articles.";
+          $supplied = $batch->getSuppliedCount();
+          if (!empty($supplied)) {
+            $report .= " Used uploaded XML for $supplied articles.";
+          }
+          $counts = [
+            'refreshed' => $count,
+            'replaced' => count($replaced),
+            'unchanged' => $count - count($replaced),
+            'failed' => count($failed),
+            'failed_pmids' => array_map('strval', array_keys($failed)),
+            'supplied' => $supplied,
+          ];
         }
       }
       else {
@@ -108,13 +143,24 @@ public function run(): Response {
       $report = [$report];
     }
     catch (\Exception $e) {
+      $success = FALSE;
       $report = "Failure: $e";
     }
 
-    // Notify the development team of the outcome.
-    $this->send_report($report, $start);
+    // Notify the development team of the outcome. A caller submitting
+    // the articles in several batches can ask us not to send a report
+    // for each batch which succeeds. Failures are always reported.
+    $quiet = !empty($this->currentRequest->request->get('quiet'));
+    if (!$quiet || !$success) {
+      $this->send_report($report, $start);
+    }
 
     // Tell the caller what happened.
+    if ($this->currentRequest->request->get('format') === 'json') {
+      $values = ['success' => $success];
+      $values['message'] = is_array($report) ? implode("\n", $report) : $report;
+      return new JsonResponse($values + $counts);
+    }
     if (is_array($report)) {
       $report = implode("\n", $report);
     }
@@ -123,6 +169,40 @@ public function run(): Response {
     return $response;
   }
 
+  /**
+   * Get the PubMed XML uploaded with the request, if any.
+   *
+   * The scheduled job which finds the stale articles has already
+   * downloaded their XML from NLM, and can send it along so we don't
+   * have to fetch it all over again. This route is open to anonymous
+   * requests, so we only accept the XML if the request carries the
+   * shared secret from the site's settings file.
+   *
+   * @return string
+   *   Uncompressed XML, or an empty string if none was uploaded or if
+   *   the request couldn't be trusted.
+   */
+  private function getUploadedXml(): string {
+    $file = $this->currentRequest->files->get('xml');
+    if (empty($file)) {
+      return '';
+    }
+    $token = Settings::get('ebms_refresh_token', '');
+    $supplied = $this->currentRequest->request->get('token', '');
+    if (empty($token) || !hash_equals($token, $supplied)) {
+      ebms_debug_log('ignoring uploaded XML: missing or invalid token', 1);
+      return '';
+    }
+    $xml = @gzdecode(file_get_contents($file->getPathname()));
+    if ($xml === FALSE) {
+      ebms_debug_log('ignoring uploaded XML: unable to decompress', 1);
+      return '';
+    }
+    $length = strlen($xml);
+    ebms_debug_log("received $length bytes of uploaded XML");
+    return $xml;
+  }
+
   /**
    * Email the report to the usual suspects.
    *
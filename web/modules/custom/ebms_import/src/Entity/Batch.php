@@ -92,6 +92,11 @@ class Batch extends ContentEntityBase implements ContentEntityInterface {
    */
   const PUBMED_ARTICLE_SET = '/<!DOCTYPE PubmedArticleSet/m';
 
+  /**
+   * Regex for finding the PubMed ID of an article record.
+   */
+  const PMID = '#<MedlineCitation[^>]*>\s*<PMID[^>]*>\s*(?P<pmid>\d+)\s*</PMID>#';
+
   /**
    * Used during processing of the requests for creating state entities.
    *
@@ -141,6 +146,20 @@ class Batch extends ContentEntityBase implements ContentEntityInterface {
    */
   private array $uniqueIds = [];
 
+  /**
+   * Did we have to ask NLM for the most recent slice of articles?
+   *
+   * @var bool
+   */
+  private bool $fetchedFromNlm = FALSE;
+
+  /**
+   * Number of article records taken from XML supplied with the request.
+   *
+   * @var int
+   */
+  private int $suppliedCount = 0;
+
   /**
    * Access method for test mode flag.
    *
@@ -163,6 +182,16 @@ public function getFollowup(): array {
     return $this->followup;
   }
 
+  /**
+   * Find out how many articles were processed using XML we were given.
+   *
+   * @return int
+   *   Number of article records not fetched from NLM.
+   */
+  public function getSuppliedCount(): int {
+    return $this->suppliedCount;
+  }
+
   /**
    * {@inheritdoc}
    */
@@ -219,7 +248,10 @@ public static function baseFieldDefinitions(EntityTypeInterface $entity_type): a
    * See https://drupal.stackexchange.com/questions/259784.
    *
    * We fetch articles from PubMed in batches, and we pause for a second
-   * between batches so that we don't wear out our welcome at NLM.
+   * between batches so that we don't wear out our welcome at NLM. If the
+   * request includes the PubMed XML for the articles (`article-xml`), as
+   * the scheduled refresh job can supply, we use those records and only
+   * go to NLM for the ones which are missing.
    *
    * @param array $request
    *   Dictionary of request options.
@@ -323,6 +355,7 @@ public static function process(array $request): Batch {
         ];
       }
     }
+    $supplied = self::index($request['article-xml'] ?? '');
     $fetched = [];
     $offset = 0;
     $slice = array_slice($pmids, $offset, self::PUBMED_BATCH_SIZE);
@@ -330,12 +363,11 @@ public static function process(array $request): Batch {
     $n = count($pmids);
     while (!empty($slice)) {
       ebms_debug_log("fetching $n articles from NLM (offset=$offset)");
-      $response = $batch->fetch($slice);
-      if (empty($batch->success->value)) {
+      $docs = $batch->getDocs($slice, $supplied);
+      if ($docs === NULL) {
         $slice = '';
       }
       else {
-        $docs = $batch->split($response);
         foreach ($docs as $doc) {
           static $done = FALSE;
           if (!$done && $debugging) {
@@ -470,7 +502,9 @@ public static function process(array $request): Batch {
         $offset += self::PUBMED_BATCH_SIZE;
         $slice = array_slice($pmids, $offset, self::PUBMED_BATCH_SIZE);
         if (!empty($slice)) {
-          usleep(500000);
+          if ($batch->fetchedFromNlm) {
+            usleep(500000);
+          }
           if ($text_id === self::IMPORT_TYPE_DATA_REFRESH) {
             set_time_limit(300);
           }
@@ -569,6 +603,61 @@ protected function fetch(array $pmids): string {
     return $response;
   }
 
+  /**
+   * Get the XML documents for a slice of the articles in the request.
+   *
+   * @param array $pmids
+   *   PubMed IDs for the articles in this slice.
+   * @param array $supplied
+   *   XML documents passed in with the request, indexed by PubMed ID.
+   *
+   * @return array|null
+   *   Separate XML document for each article, or `NULL` if the request
+   *   to NLM for the articles we weren't given failed.
+   */
+  protected function getDocs(array $pmids, array $supplied): ?array {
+    $docs = [];
+    $needed = [];
+    foreach ($pmids as $pmid) {
+      if (array_key_exists($pmid, $supplied)) {
+        $docs[] = $supplied[$pmid];
+        $this->suppliedCount++;
+      }
+      else {
+        $needed[] = $pmid;
+      }
+    }
+    $this->fetchedFromNlm = !empty($needed);
+    if ($this->fetchedFromNlm) {
+      $response = $this->fetch($needed);
+      if (empty($this->success->value)) {
+        return NULL;
+      }
+      $docs = array_merge($docs, self::split($response));
+    }
+    return $docs;
+  }
+
+  /**
+   * Index PubMed XML by the IDs of the articles it contains.
+   *
+   * @param string $xml
+   *   Serialized `PubmedArticleSet` document (can be empty).
+   *
+   * @return array
+   *   Separate XML document for each article, indexed by PubMed ID.
+   */
+  public static function index(string $xml): array {
+    $docs = [];
+    foreach (self::split($xml) as $doc) {
+      $matches = [];
+      if (preg_match(self::PMID, $doc, $matches)) {
+        $docs[$matches['pmid']] = $doc;
+      }
+    }
+    return $docs;
+  }
+
   /**
    * Split the response into separate XML documents for each article.
    *
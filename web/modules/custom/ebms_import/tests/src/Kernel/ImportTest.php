@@ -542,6 +542,42 @@ public function testImport() {
     ]);
   }
 
+  /**
+   * Test refreshing articles using XML supplied with the request.
+   */
+  public function testSuppliedXml() {
+
+    // Fetch the XML ourselves, the way the scheduled refresh job does.
+    $pmids = $this->findArticles('lung', 2010);
+    $parms = Batch::PARMS . implode(',', $pmids);
+    $ch = Batch::getCurlHandle($parms);
+    $response = curl_exec($ch);
+    $code = curl_getinfo($ch, CURLINFO_RESPONSE_CODE);
+    $this->assertEquals(200, $code);
+    curl_close($ch);
+    $supplied = Batch::index($response);
+    $this->assertCount(count($pmids), $supplied);
+    foreach ($pmids as $pmid) {
+      $this->assertArrayHasKey($pmid, $supplied);
+      Article::create([
+        'source' => 'Pubmed',
+        'source_id' => $pmid,
+        'title' => 'Original title',
+      ])->save();
+    }
+
+    // Leave one article out, so we know the rest still come from NLM.
+    $missing = array_pop($supplied);
+    $xml = '<PubmedArticleSet>' . implode("\n", $supplied) . '</PubmedArticleSet>';
+    $batch = $this->checkBatch([
+      'article-ids' => $pmids,
+      'article-xml' => $xml,
+      'import-comments' => self::IMPORT_REFRESH_TEST,
+    ]);
+    $this->assertEquals(count($pmids) - 1, $batch->getSuppliedCount());
+    $this->assertNotEmpty($missing);
+  }
+
   /**
    * Make sure a regular import without a topic fails.
    *
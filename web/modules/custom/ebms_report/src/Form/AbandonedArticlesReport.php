@@ -26,6 +26,18 @@ class AbandonedArticlesReport extends FormBase {
    */
   const URL = Batch::EUTILS . '/esearch.fcgi';
 
+  /**
+   * Where the PubMed update job records articles NLM no longer has.
+   *
+   * The path is relative to the directory above the Drupal root.
+   */
+  const DROPS_FILE = 'logs/update-pubmed-data.drops.json';
+
+  /**
+   * How many days old the update job's results can be and still be used.
+   */
+  const DROPS_MAX_AGE = 7;
+
   /**
    * {@inheritdoc}
    */
@@ -120,12 +132,17 @@ public function submitForm(array &$form, FormStateInterface $form_state) {
    *   Number of articles to ask about in a single request.
    * @param float $delay
    *   Number of seconds to wait between requests.
+   * @param bool $use_drops_file
+   *   If `TRUE` use the articles the PubMed update job found missing
+   *   when it last checked with NLM (if that was recent enough),
+   *   instead of checking every article with NLM ourselves.
    *
    * @return array
    *   Report data, including number of articles checked and identified
-   *   missing articles.
+   *   missing articles, and the date of the update job's check if its
+   *   results were used.
    */
-  public static function report(bool $all = FALSE, int $batch_size = 10000, float $delay = .5) {
+  public static function report(bool $all = FALSE, int $batch_size = 10000, float $delay = .5, bool $use_drops_file = FALSE) {
 
     // Find out which articles we need to check.
     if (!$all) {
@@ -142,6 +159,16 @@ public static function report(bool $all = FALSE, int $batch_size = 10000, float
       }
     }
 
+    // Use the update job's results if we can.
+    $drops = $use_drops_file ? self::loadDrops() : NULL;
+    if (!empty($drops)) {
+      return [
+        'checked' => count($articles),
+        'missing' => array_intersect($articles, $drops['missing']),
+        'as_of' => $drops['as_of'],
+      ];
+    }
+
     // Find out what NLM still has, so we can identify what's missing.
     $found = self::find($articles, $batch_size, $delay);
 
@@ -152,6 +179,36 @@ public static function report(bool $all = FALSE, int $batch_size = 10000, float
     ];
   }
 
+  /**
+   * Load the PubMed update job's list of articles NLM no longer has.
+   *
+   * The job (`scheduled/update-pubmed-data.py --drops`) checks every
+   * article we have, so an article imported since then (and thus not
+   * in its list) was found by NLM when it was imported.
+   *
+   * @return array|null
+   *   Values from the file, or `NULL` if it's missing, unreadable, or
+   *   too old to be trusted.
+   */
+  private static function loadDrops(): ?array {
+    $path = dirname(DRUPAL_ROOT) . '/' . self::DROPS_FILE;
+    if (!is_readable($path)) {
+      ebms_debug_log("no drops file at $path", 1);
+      return NULL;
+    }
+    $drops = json_decode(file_get_contents($path), TRUE);
+    if (empty($drops['as_of']) || !isset($drops['missing'])) {
+      ebms_debug_log("unable to parse $path", 1);
+      return NULL;
+    }
+    $age = (time() - strtotime($drops['as_of'])) / 86400;
+    if ($age > self::DROPS_MAX_AGE) {
+      ebms_debug_log("drops file is from {$drops['as_of']}; ignoring it", 1);
+      return NULL;
+    }
+    return $drops;
+  }
+
   /**
    * Find out which of the articles we have NLM can still find.
    *